@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# allocBench.py - per-allocation cost of the gc Heap as the heap grows
+#
+# Fills half of a heap with cells then times allocating a fixed number more,
+# both straight from Heap.alloc and through BuiltIns.cons, for heaps from 20
+# to 10^6 cells.  With the free list the cost per cell
+# should stay flat; with freeList=False it grows with the heap size (the
+# first-fit scan is only run up to 10^4 cells, filling a larger heap that
+# way takes far too long).  Python's cyclic gc is off while timing: its
+# pauses grow with the number of objects and would swamp the cost per cell.
+#
+# usage: python bench/allocBench.py [--scan]
+#
+
+import gc
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import programextgc
+from programextgc import Heap, BuiltIns, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+SIZES = [20, 1000, 10000, 100000, 1000000]
+SCAN_SIZES = [20, 1000, 10000]
+ALLOCS = 10000
+
+def timeAllocs( size, freeList ) :
+    heap = Heap(size, freeList)
+    programextgc.GLOBAL_HEAP = heap
+    for i in range(size / 2) :
+        heap.alloc()
+    n = min(ALLOCS, (size - heap.get_count_allocated()) / 2)
+    gc.disable()
+    start = time.time()
+    for i in range(n) :
+        heap.alloc()
+    allocTime = (time.time() - start) / n
+    start = time.time()
+    for i in range(n) :
+        BuiltIns.cons(Number(i), None)
+    consTime = (time.time() - start) / n
+    gc.enable()
+    return allocTime, consTime
+
+def main() :
+    freeList = '--scan' not in sys.argv
+    print "usec per cell, freeList=%s" % freeList
+    print "%-10s %-10s %s" % ("cells", "alloc", "cons")
+    for size in (SIZES if freeList else SCAN_SIZES) :
+        allocTime, consTime = timeAllocs(size, freeList)
+        print "%-10d %-10.2f %.2f" % (size, allocTime * 1e6, consTime * 1e6)
+
+if __name__ == '__main__' :
+    main()
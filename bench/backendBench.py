@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# backendBench.py - the ways interpreterextgc.py can run a program
+#
+# Runs scaled up iterList.p (listlength over a LENGTH element list, CALLS
+# times) and add1.p (add(N)) through interpreterextgc.py with each
+# --backend, and prints how long each took and how many times faster than
+# eval it was.  The time to start the interpreter on a one statement program
+# is taken off each run, so the speedup is for running the program alone.
+#
+# usage: python bench/backendBench.py
+#
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+INTERPRETER = os.path.join(BENCH_DIR, '..', 'interpreterextgc.py')
+
+BACKENDS = ['eval', 'closure', 'vm', 'python']
+
+ITERLIST = '''define listlength
+proc(l)
+i := 0;
+ll := l;
+while (nullp(ll)-1)*(0-1) do
+i := i + 1;
+ll := cdr(ll)
+od;
+return := i
+end;
+a := [%s];
+k := %d;
+while k do
+size := listlength(a);
+k := k - 1
+od
+''' % (','.join(['1'] * 100), 600)
+
+ADD1 = '''define add
+proc( n )
+  i := n;
+  s := 0;
+  while i do s := s + i;  i := i-1 od;
+  return := s
+end;
+n := %d;
+s := add( n )
+''' % 200000
+
+PROGRAMS = [('iterList', ITERLIST), ('add1', ADD1)]
+
+EMPTY = 'x := 1\n'
+
+def run( backend, program ) :
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, INTERPRETER, '--heap-size',
+                             '1000', '--backend', backend, program],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    proc.communicate()
+    return time.time() - start, proc.returncode
+
+def write_program( text ) :
+    fd, program = tempfile.mkstemp(suffix='.p')
+    os.write(fd, text)
+    os.close(fd)
+    return program
+
+def main() :
+    program = write_program(EMPTY)
+    try:
+        startup = min([run('eval', program)[0] for i in range(3)])
+    finally:
+        os.remove(program)
+    print "startup %.2f sec, not counted below" % startup
+    print "%-10s %-10s %-8s %s" % ("program", "backend", "sec", "speedup")
+    for name, text in PROGRAMS :
+        program = write_program(text)
+        try:
+            base = None
+            for backend in BACKENDS :
+                elapsed, rc = run(backend, program)
+                elapsed = max(elapsed - startup, 0.01)
+                if base is None :
+                    base = elapsed
+                status = "" if rc == 0 else "  (failed)"
+                print "%-10s %-10s %-8.2f %.1fx%s" % (name, backend, elapsed,
+                                                      base / elapsed, status)
+        finally:
+            os.remove(program)
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# bulkBench.py - building a list with build_list against cons by cons
+#
+# Turns a python list of N numbers into a list, once with
+# MiniLangUtils.pythonListToList (one alloc_many, then linking the cells)
+# and once consing the numbers on one at a time from the back, on each kind
+# of heap with a tenth of N cells free, so the heap has to grow on the way,
+# and prints the time and the collections each took.
+#
+# usage: python bench/bulkBench.py [elements]
+#
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import programextgc
+from programextgc import configure_heap, BuiltIns, MiniLangUtils, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+KINDS = ['heap', 'array', 'semispace', 'generational']
+
+def by_cons( values ) :
+    lst = List()
+    nt = programextgc.GLOBAL_NAME_TABLE
+    nt['l'] = lst
+    for val in reversed(values) :
+        nt['l'] = List(cons_cell=BuiltIns.cons(val, nt['l']))
+    lst = nt['l']
+    del nt['l']
+    return lst
+
+def run( kind, n, build ) :
+    heap = configure_heap(n // 10, n * 4, kind=kind)
+    values = [Number(i) for i in xrange(n)]
+    start = time.time()
+    build(values)
+    return time.time() - start, heap.numCollections
+
+def main() :
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print "%-14s %-12s %-12s %-14s %s" % ("heap", "cons msec", "collections",
+        "bulk msec", "collections")
+    for kind in KINDS :
+        consTime, consGCs = run(kind, n, by_cons)
+        bulkTime, bulkGCs = run(kind, n, MiniLangUtils.pythonListToList)
+        print "%-14s %-12.0f %-12d %-14.0f %d" % (kind, consTime * 1e3,
+            consGCs, bulkTime * 1e3, bulkGCs)
+
+if __name__ == '__main__' :
+    main()
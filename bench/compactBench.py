@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#
+# compactBench.py - list traversal before and after a sliding compaction
+#
+# Fills a CompactingHeap with two interleaved lists, picking at random which
+# one each new cell goes on, then drops one of them and collects without
+# compacting, which leaves the other list's cells spread over the whole heap
+# with holes in between.  A second heap is built the same way and then
+# compacted.  Times walking the list in each heap: once through the cdrs
+# array and once through cell handles, the way the interpreter does.  Each
+# walk is made once untimed, to warm up, then REPEATS times, alternating
+# between the heaps so that both see the same timing noise, and the median
+# time is printed.
+#
+# usage: python bench/compactBench.py [cells]
+#
+
+import os
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from programextgc import CompactingHeap, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+REPEATS = 5
+
+def build( heap, n ) :
+    random.seed(1)
+    heads = [None, None]
+    for i in xrange(n) :
+        which = random.randint(0, 1)
+        c = heap.alloc()
+        c.car = Number(i)
+        c.cdr = heads[which]
+        heads[which] = c
+    return heads[0]
+
+def walkArray( heap, head ) :
+    cdrs = heap.cdrs
+    tagged = (head.index << 2) | 2
+    count = 0
+    while tagged & 3 == 2 :
+        tagged = cdrs[tagged >> 2]
+        count += 1
+    return count
+
+def walkHandles( heap, head ) :
+    count = 0
+    cell = head
+    while cell is not None :
+        cell = cell.cdr
+        count += 1
+    return count
+
+def timeWalks( heaps ) :
+    '''nsec per cell of each walk of each (heap, head) in heaps: the median
+    of REPEATS walks, after one that isn't timed'''
+    times = [ list() for heap in heaps ]
+    for walk in (walkArray, walkHandles) :
+        walkTimes = [ list() for heap in heaps ]
+        for i in xrange(REPEATS + 1) :
+            for (heap, head), t in zip(heaps, walkTimes) :
+                start = time.time()
+                count = walk(heap, head)
+                t.append((time.time() - start) / count * 1e9)
+        for t, heapTimes in zip(walkTimes, times) :
+            heapTimes.append(sorted(t[1:])[REPEATS // 2])
+    return times
+
+def fragmented( n ) :
+    '''a heap of n cells holding a list scattered over it, the list's first
+    cell and the names table holding it'''
+    heap = CompactingHeap(n, compactAt=1.0)
+    head = build(heap, n)
+    nt = { 'l' : List(cons_cell=head) }
+    heap.collect(nt, dict())
+    return heap, head, nt
+
+def main() :
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    heap, head, nt = fragmented(n)
+    live = heap.get_count_allocated()
+    fragmentation = heap.fragmentation(live)
+
+    compacted, compactedHead, compactedNt = fragmented(n)
+    compacted.compactAt = 0.0
+    start = time.time()
+    compacted.collect(compactedNt, dict())
+    compactTime = time.time() - start
+
+    before, after = timeWalks([(heap, head), (compacted, compactedHead)])
+
+    print "%d cell heap, %d cell list, %.0f%% fragmented, compacted in %.0f msec" % (
+        n, live, fragmentation * 100, compactTime * 1e3)
+    print "%-8s %-20s %s" % ("", "nsec / cell array", "nsec / cell handles")
+    print "%-8s %-20.1f %.1f" % ("before", before[0], before[1])
+    print "%-8s %-20.1f %.1f" % ("after", after[0], after[1])
+
+if __name__ == '__main__' :
+    main()
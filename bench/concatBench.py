@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# concatBench.py - growing a list with || in a while loop
+#
+# Writes programs that build an N element accumulator in a while loop, one
+# appending (l := l || [1]) and one prepending (l := [1] || l), and runs them
+# through interpreterext.py and interpreterextgc.py for a few N.  || copies
+# the spine of its lhs and shares its rhs, so prepending should grow linearly
+# with N and appending quadratically.  l is dropped at the end, so printing
+# the symbol table doesn't count.
+#
+# usage: python bench/concatBench.py [N ...]
+#
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENGINES = [
+    ('interpreterext', [ os.path.join(BENCH_DIR, '..', 'interpreterext.py') ]),
+    ('interpreterextgc', [ os.path.join(BENCH_DIR, '..', 'interpreterextgc.py'),
+                           '--heap-size', '1000', '--heap-max', '1000000' ]),
+]
+
+LOOPS = [
+    ('append', 'l := l || [1]'),
+    ('prepend', 'l := [1] || l'),
+]
+
+PROGRAM = '''l := [] ;
+i := %d ;
+while i do
+  %s ;
+  i := i - 1
+od ;
+l := 0
+'''
+
+def run( command, program ) :
+    start = time.time()
+    proc = subprocess.Popen([sys.executable] + command + [program],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    proc.communicate()
+    return time.time() - start, proc.returncode
+
+def main() :
+    sizes = [int(n) for n in sys.argv[1:]] or [250, 500, 1000]
+    print "%-18s %-8s %-8s %s" % ("engine", "loop", "N", "sec")
+    for loopName, stmt in LOOPS :
+        for n in sizes :
+            fd, program = tempfile.mkstemp(suffix='.p')
+            os.write(fd, PROGRAM % (n, stmt))
+            os.close(fd)
+            try:
+                for engineName, command in ENGINES :
+                    elapsed, rc = run(command, program)
+                    status = "" if rc == 0 else "  (failed)"
+                    print "%-18s %-8s %-8d %.2f%s" % (engineName, loopName, n,
+                                                      elapsed, status)
+            finally:
+                os.remove(program)
+
+if __name__ == '__main__' :
+    main()
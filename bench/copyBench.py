@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# copyBench.py - mark/sweep against the semispace copying collector
+#
+# Fills a heap of n cells, with a rooted list taking the survival fraction of
+# them and garbage the rest, then times one collection.  Mark/sweep pays for
+# every cell in the heap; copying only for the survivors.
+#
+# usage: python bench/copyBench.py [cells]
+#
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from programextgc import Heap, ArrayHeap, SemispaceHeap, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+SURVIVAL = [0.01, 0.10, 0.50]
+
+def fill( heap, live ) :
+    prev = None
+    for i in xrange(live) :
+        c = heap.alloc()
+        c.car = Number(i)
+        c.cdr = prev
+        prev = c
+    nt = { 'l' : List(cons_cell=prev) }
+    while heap.hasSpace() :
+        heap.alloc().car = Number(0)
+    return nt
+
+def timeCollect( heapClass, size, survival ) :
+    heap = heapClass(size)
+    live = int(size * survival)
+    nt = fill(heap, live)
+    start = time.time()
+    heap.collect(nt, dict())
+    elapsed = time.time() - start
+    assert heap.get_count_allocated() == live
+    return elapsed
+
+def main() :
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    heaps = [Heap, ArrayHeap, SemispaceHeap]
+    print "msec per collection of a %d cell heap" % size
+    print "%-10s" % "survival" + "".join(["%-15s" % h.__name__ for h in heaps])
+    for survival in SURVIVAL :
+        times = [timeCollect(h, size, survival) * 1e3 for h in heaps]
+        print "%-10s" % ("%d%%" % (survival * 100)) + \
+              "".join(["%-15.1f" % t for t in times])
+
+if __name__ == '__main__' :
+    main()
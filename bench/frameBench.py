@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# frameBench.py - proc calls under the eval backend, across source trees
+#
+# Builds four call heavy programs: 5000 calls to a one line proc, fib(16),
+# add(1000) (a loop over two locals) ten times, and recLen.p's listlengthr
+# on a 100 element list a hundred times.  Runs each of them REPEATS times
+# and prints the median, in seconds of CPU time.
+#
+# Each TREE given is a checkout of this repository (a git worktree of
+# another commit, say); its programextgc.py is loaded under a name of its
+# own, and the runs of every tree are interleaved, so that they share the
+# machine's timing noise.  Times are also given as a ratio to the first
+# tree's.  With no TREE the one this script is in is run.
+#
+# usage: python bench/frameBench.py [tree ...]
+#
+
+import os
+import sys
+import imp
+import time
+import logging
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TREE = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, TREE)
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+REPEATS = 41
+
+PROGRAMS = ['calls', 'fib', 'add', 'recLen']
+
+def build( m ) :
+    '''the name table, function table, heap and programs for the module m'''
+    def stmts( *sl ) :
+        stmtList = m.StmtList()
+        stmtList.sl = list(sl)
+        return stmtList
+    Assign, Ident, Number, Call = m.AssignStmt, m.Ident, m.Number, m.FunCall
+
+    ft = dict()
+    m.define(ft, 'inc', m.Proc(['n'], stmts(
+        Assign('return', m.Plus(Ident('n'), Number(1))))))
+    m.define(ft, 'fib', m.Proc(['n'], stmts(
+        m.IfStmt(m.Minus(Ident('n'), Number(1)),
+            stmts(Assign('return', m.Plus(
+                Call('fib', [m.Minus(Ident('n'), Number(1))]),
+                Call('fib', [m.Minus(Ident('n'), Number(2))])))),
+            stmts(Assign('return', Number(1)))))))
+    m.define(ft, 'add', m.Proc(['n'], stmts(
+        Assign('i', Ident('n')),
+        Assign('s', Number(0)),
+        m.WhileStmt(Ident('i'), stmts(
+            Assign('s', m.Plus(Ident('s'), Ident('i'))),
+            Assign('i', m.Minus(Ident('i'), Number(1))))),
+        Assign('return', Ident('s')))))
+    m.define(ft, 'listlengthr', m.Proc(['l'], stmts(
+        Assign('ll', Ident('l')),
+        m.IfStmt(m.Times(m.Minus(Call('nullp', [Ident('ll')]), Number(1)),
+                         m.Minus(Number(0), Number(1))),
+            stmts(Assign('return', m.Plus(Number(1),
+                Call('listlengthr', [Call('cdr', [Ident('ll')])])))),
+            stmts(Assign('return', Number(0)))))))
+
+    gh = m.GLOBAL_HEAP = m.Heap(5000)
+    nt = dict()
+    Assign('a', m.List(m.Sequence(elements=[Number(1)] * 100))).eval(nt, ft, gh)
+    programs = {
+        'calls' : stmts(Assign('k', Number(5000)),
+            m.WhileStmt(Ident('k'), stmts(
+                Assign('s', Call('inc', [Ident('k')])),
+                Assign('k', m.Minus(Ident('k'), Number(1)))))),
+        'fib' : stmts(Assign('s', Call('fib', [Number(16)]))),
+        'add' : stmts(*[Assign('s', Call('add', [Number(1000)]))] * 10),
+        'recLen' : stmts(*[Assign('s', Call('listlengthr', [Ident('a')]))] * 100),
+    }
+    return nt, ft, gh, programs
+
+def main() :
+    trees = sys.argv[1:] or [TREE]
+    runs = list()
+    for i, tree in enumerate(trees) :
+        m = imp.load_source('programextgc_%d' % i,
+                            os.path.join(tree, 'programextgc.py'))
+        runs.append(build(m))
+    print "%-8s %s" % ("program", "  ".join(["%-14s" % os.path.basename(
+        os.path.normpath(tree)) for tree in trees]))
+    for name in PROGRAMS :
+        times = [ list() for tree in trees ]
+        for r in xrange(REPEATS) :
+            for (nt, ft, gh, programs), t in zip(runs, times) :
+                start = time.clock()
+                programs[name].eval(nt, ft, gh)
+                t.append(time.clock() - start)
+        medians = [ sorted(t)[REPEATS // 2] for t in times ]
+        print "%-8s %s" % (name, "  ".join(["%.4f (%.2fx)" % (med, med / medians[0])
+                                             for med in medians]))
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# generationalBench.py - nursery size against collection counts and pauses
+#
+# Keeps a list of LIVE cells rooted and conses CONSES short-lived cells onto
+# it, first on an ArrayHeap, then on GenerationalHeaps of the same size with
+# different nurseries, and prints the per-generation collection counts and
+# pause times.
+#
+# usage: python bench/generationalBench.py
+#
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import programextgc
+from programextgc import ArrayHeap, GenerationalHeap, BuiltIns, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+HEAP_SIZE = 20000
+LIVE = 5000
+CONSES = 100000
+NURSERIES = [100, 1000, 5000, 10000]
+
+def run( heap ) :
+    programextgc.GLOBAL_HEAP = heap
+    nt = programextgc.GLOBAL_NAME_TABLE
+    nt['live'] = List()
+    for i in xrange(LIVE) :
+        nt['live'] = List(cons_cell=BuiltIns.cons(Number(i), nt['live']))
+    start = time.time()
+    for i in xrange(CONSES) :
+        nt['t'] = List(cons_cell=BuiltIns.cons(Number(i), nt['live']))
+    elapsed = time.time() - start
+    del nt['live']
+    del nt['t']
+    return elapsed
+
+def msec( seconds ) :
+    return "%.2f" % (seconds * 1e3)
+
+def main() :
+    print "%d cell heap, %d live cells, %d short-lived conses" % (HEAP_SIZE,
+            LIVE, CONSES)
+    print "%-14s %-7s %-7s %-12s %-12s %-12s %s" % ("heap", "minor",
+            "major", "minor avg ms", "minor max ms", "major max ms",
+            "run sec")
+
+    heap = ArrayHeap(HEAP_SIZE)
+    elapsed = run(heap)
+    print "%-14s %-7s %-7d %-12s %-12s %-12s %.2f" % ("array", "-",
+            heap.numCollections, "-", "-", "-", elapsed)
+
+    for nursery in NURSERIES :
+        heap = GenerationalHeap(HEAP_SIZE, nurserySize=nursery)
+        elapsed = run(heap)
+        stats = heap.generation_stats()
+        minor = stats['minor']
+        major = stats['major']
+        avg = minor['totalPause'] / max(1, minor['collections'])
+        print "%-14s %-7d %-7d %-12s %-12s %-12s %.2f" % (
+                "nursery %d" % nursery, minor['collections'],
+                major['collections'], msec(avg), msec(minor['maxPause']),
+                msec(major['maxPause']), elapsed)
+
+if __name__ == '__main__' :
+    main()
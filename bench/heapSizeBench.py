@@ -0,0 +1,53 @@
+#!/usr/bin/python
+#
+# heapSizeBench.py - bytes per cell of Heap and ArrayHeap
+#
+# Builds a 10^6 cell heap, fills every cell with a cons of a Number onto the
+# previous cell, and reports how much the resident set grew per cell.  Each
+# heap is measured in its own process so one doesn't skew the other.
+#
+# usage: python bench/heapSizeBench.py [cells]
+#
+
+import os
+import sys
+import subprocess
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from programextgc import Heap, ArrayHeap, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+HEAPS = { 'Heap' : Heap, 'ArrayHeap' : ArrayHeap }
+
+def residentBytes() :
+    for line in open('/proc/self/status') :
+        if line.startswith('VmRSS:') :
+            return int(line.split()[1]) * 1024
+    return 0
+
+def measure( name, size ) :
+    before = residentBytes()
+    heap = HEAPS[name](size)
+    prev = None
+    for i in xrange(size) :
+        c = heap.alloc()
+        c.car = Number(i)
+        c.cdr = prev
+        prev = c
+    return float(residentBytes() - before) / size
+
+def main() :
+    if len(sys.argv) == 3 :
+        print measure(sys.argv[1], int(sys.argv[2]))
+        return
+    size = int(sys.argv[1]) if len(sys.argv) == 2 else 1000000
+    print "%-10s %s" % ("heap", "bytes / cell (%d cells)" % size)
+    for name in ['Heap', 'ArrayHeap'] :
+        out = subprocess.check_output([sys.executable, __file__, name, str(size)])
+        print "%-10s %.1f" % (name, float(out))
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+#
+# heapSizingBench.py - collections run under different heap sizing policies
+#
+# Runs recLenLoop.p (a recLen.p-style program that keeps a 15 element list
+# alive and conses a garbage cell onto it 300 times) through
+# interpreterextgc.py with each policy, and counts the collections and heap
+# growths it logs.
+#
+# usage: python bench/heapSizingBench.py [program.p]
+#
+
+import os
+import sys
+import time
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+INTERPRETER = os.path.join(BENCH_DIR, '..', 'interpreterextgc.py')
+
+POLICIES = [
+    [ '--heap-size', '20' ],
+    [ '--heap-size', '20', '--heap-max', '1000' ],
+    [ '--heap-size', '20', '--heap-max', '1000', '--heap-grow-at', '0.5' ],
+    [ '--heap-size', '20', '--heap-max', '1000', '--heap-grow-at', '0.9' ],
+    [ '--heap-size', '20', '--heap-max', '1000', '--heap-growth', '1.25' ],
+    [ '--heap-size', '100' ],
+]
+
+def run( program, policy ) :
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, INTERPRETER] + policy + [program],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    elapsed = time.time() - start
+    collections = err.count('Starting GC')
+    growths = err.count('Growing heap')
+    return collections, growths, elapsed, proc.returncode
+
+def main() :
+    if len(sys.argv) > 1 :
+        program = sys.argv[1]
+    else :
+        program = os.path.join(BENCH_DIR, 'recLenLoop.p')
+    print "%-60s %-12s %-8s %s" % ("policy", "collections", "growths", "sec")
+    for policy in POLICIES :
+        collections, growths, elapsed, rc = run(program, policy)
+        status = "" if rc == 0 else "  (failed)"
+        print "%-60s %-12d %-8d %.2f%s" % (' '.join(policy), collections,
+                                           growths, elapsed, status)
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# latencyBench.py - allocation pauses, stop-the-world against incremental
+#
+# Keeps a list of live cells in the global name table and conses garbage onto
+# it, timing every cons.  The stop-the-world ArrayHeap pays for a whole
+# collection in one cons; the IncrementalHeap spreads it out, with a budget in
+# cells or in microseconds per allocation.
+#
+# Python's own cycle collector is switched off while timing, so its pauses
+# don't get counted against the heaps.
+#
+# usage: python bench/latencyBench.py [cells] [live cells]
+#
+
+import gc
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import programextgc
+from programextgc import configure_heap, BuiltIns, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+BUCKETS = [10, 100, 1000, 10000]
+
+def run( size, live, kind, **options ) :
+    heap = configure_heap(size, kind=kind, **options)
+    nt = programextgc.GLOBAL_NAME_TABLE
+    nt['l'] = List()
+    for i in xrange(live) :
+        nt['l'] = List(cons_cell=BuiltIns.cons(Number(i), nt['l']))
+    pauses = list()
+    gc.disable()
+    for i in xrange(size * 4) :
+        start = time.time()
+        BuiltIns.cons(Number(i), nt['l'])
+        pauses.append((time.time() - start) * 1e6)
+    gc.enable()
+    del nt['l']
+    return heap, sorted(pauses)
+
+def main() :
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    live = int(sys.argv[2]) if len(sys.argv) > 2 else size / 4
+    runs = [
+        ('stop-the-world', 'array', dict()),
+        ('64 cells', 'incremental', dict(stepCells=64)),
+        ('16 cells', 'incremental', dict(stepCells=16)),
+        ('50 usec', 'incremental', dict(stepCells=None, stepMicros=50)),
+    ]
+    print "usec per cons, %d cell heap, %d live cells" % (size, live)
+    print "%-16s" % "" + "".join(["<%-9d" % b for b in BUCKETS]) + \
+          ">=%-8d" % BUCKETS[-1] + "%-10s%-10s%-10s%s" % ("p50", "p99", "max", "GCs")
+    for name, kind, options in runs :
+        heap, pauses = run(size, live, kind, **options)
+        counts = [0] * (len(BUCKETS) + 1)
+        for p in pauses :
+            b = 0
+            while b < len(BUCKETS) and p >= BUCKETS[b] :
+                b += 1
+            counts[b] += 1
+        print "%-16s" % name + "".join(["%-10d" % c for c in counts]) + \
+              "%-10.1f%-10.1f%-10.1f%d" % (pauses[len(pauses) / 2],
+                  pauses[len(pauses) * 99 / 100], pauses[-1], heap.numCollections)
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# lazySweepBench.py - collection pauses with eager and lazy sweeping
+#
+# Runs the memoryAlloc*.p programs on a small heap, then a synthetic workload
+# that keeps LIVE cells rooted and conses garbage onto them, once with the
+# Heap sweeping in collect and once with it sweeping in alloc.  Prints the
+# number of collections, the mean and longest collect pause, and the total
+# time, which also counts the sweeping done by alloc.
+#
+# usage: python bench/lazySweepBench.py [heap cells]
+#
+
+import os
+import sys
+import glob
+import time
+import logging
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import programextgc
+from programextgc import configure_heap, BuiltIns, List, Number
+import interpreterextgc
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+PROGRAM_HEAP_SIZE = 10
+PROGRAM_HEAP_MAX = 1000
+PROGRAMS = os.path.join(BENCH_DIR, '..', 'test', 'SampleInputs2', 'memoryAlloc*.p')
+
+def pauses( heap ) :
+    return [c['pause'] for c in heap.stats.collections]
+
+def runProgram( path, lazySweep ) :
+    heap = configure_heap(PROGRAM_HEAP_SIZE, PROGRAM_HEAP_MAX, lazySweep=lazySweep)
+    data = open(path).read()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        interpreterextgc.test_parser(data)
+    finally:
+        sys.stdout = stdout
+        programextgc.GLOBAL_NAME_TABLE.clear()
+        programextgc.GLOBAL_FUNCTION_TABLE.clear()
+    return pauses(heap), time.time() - start
+
+def runSynthetic( size, lazySweep ) :
+    heap = configure_heap(size, lazySweep=lazySweep)
+    nt = programextgc.GLOBAL_NAME_TABLE
+    nt['l'] = List()
+    for i in xrange(size / 10) :
+        nt['l'] = List(cons_cell=BuiltIns.cons(Number(i), nt['l']))
+    start = time.time()
+    for i in xrange(size * 4) :
+        BuiltIns.cons(Number(i), nt['l'])
+    elapsed = time.time() - start
+    del nt['l']
+    return pauses(heap), elapsed
+
+def report( name, lazySweep, pauses, elapsed ) :
+    mean = sum(pauses) / len(pauses) if pauses else 0
+    longest = max(pauses) if pauses else 0
+    print "%-20s %-6s %-12d %-12.1f %-12.1f %.1f" % (name,
+        "lazy" if lazySweep else "eager", len(pauses), mean * 1e6,
+        longest * 1e6, elapsed * 1e3)
+
+def main() :
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print "%-20s %-6s %-12s %-12s %-12s %s" % ("workload", "sweep",
+        "collections", "mean usec", "max usec", "total msec")
+    for path in sorted(glob.glob(PROGRAMS)) :
+        for lazySweep in [False, True] :
+            pauses, elapsed = runProgram(path, lazySweep)
+            report(os.path.basename(path), lazySweep, pauses, elapsed)
+    for lazySweep in [False, True] :
+        pauses, elapsed = runSynthetic(size, lazySweep)
+        report("%d cells" % size, lazySweep, pauses, elapsed)
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+#
+# markBench.py - cost of the mark phase on long and deeply nested lists
+#
+# Builds a cdr-chain (a flat list) and a car-nested structure ([[[...]]]) of
+# n cells in Heap and ArrayHeap, roots it, and times a collection.  Nothing is
+# garbage, so the time is marking plus a sweep that frees no cells.
+#
+# usage: python bench/markBench.py
+#
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from programextgc import Heap, ArrayHeap, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+SIZES = [10000, 100000, 1000000]
+
+def cdrChain( heap, n ) :
+    prev = None
+    for i in xrange(n) :
+        c = heap.alloc()
+        c.car = Number(i)
+        c.cdr = prev
+        prev = c
+    return prev
+
+def carNest( heap, n ) :
+    prev = None
+    for i in xrange(n) :
+        c = heap.alloc()
+        c.car = prev
+        prev = c
+    return prev
+
+def timeCollect( heapClass, build, n ) :
+    heap = heapClass(n)
+    nt = { 'l' : List(cons_cell=build(heap, n)) }
+    start = time.time()
+    heap.collect(nt, dict())
+    elapsed = time.time() - start
+    assert heap.get_count_allocated() == n
+    return elapsed
+
+def main() :
+    print "%-10s %-10s %-10s %s" % ("heap", "shape", "cells", "usec / cell")
+    for heapClass in [Heap, ArrayHeap] :
+        for build in [cdrChain, carNest] :
+            for n in SIZES :
+                elapsed = timeCollect(heapClass, build, n)
+                print "%-10s %-10s %-10d %.3f" % (heapClass.__name__,
+                        build.__name__, n, elapsed / n * 1e6)
+
+if __name__ == '__main__' :
+    main()
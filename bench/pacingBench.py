@@ -0,0 +1,65 @@
+#!/usr/bin/python
+#
+# pacingBench.py - collecting when full against GOGC style pacing
+#
+# Builds up a list of LIVE cells while consing CHURN garbage cells for every
+# live one, the pattern where a mostly full heap keeps collecting to free a
+# few cells.  Runs it under HeapSizing (collect when full, grow past growAt)
+# and PacedSizing with several gcPercent values, all starting at 1000 cells
+# and allowed to grow to 10^6, and prints the collections, the time spent
+# in them and the final heap size.
+#
+# usage: python bench/pacingBench.py [live cells]
+#
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import programextgc
+from programextgc import configure_heap, BuiltIns, List, Number
+
+logging.getLogger('programext').setLevel(logging.WARNING)
+
+START_SIZE = 1000
+MAX_SIZE = 1000000
+CHURN = 4
+
+POLICIES = [
+    ('full, growAt 0.75', dict()),
+    ('full, growAt 0.95', dict(growAt=0.95)),
+    ('gcPercent 50', dict(gcPercent=50)),
+    ('gcPercent 100', dict(gcPercent=100)),
+    ('gcPercent 200', dict(gcPercent=200)),
+    ('gcPercent 100, 1%', dict(gcPercent=100, gcFraction=0.01)),
+]
+
+def run( live, policy ) :
+    heap = configure_heap(START_SIZE, MAX_SIZE, kind='array', **policy)
+    nt = programextgc.GLOBAL_NAME_TABLE
+    nt['l'] = List()
+    start = time.time()
+    for i in xrange(live) :
+        nt['l'] = List(cons_cell=BuiltIns.cons(Number(i), nt['l']))
+        for j in xrange(CHURN) :
+            BuiltIns.cons(Number(j), nt['l'])
+    elapsed = time.time() - start
+    del nt['l']
+    return heap, elapsed
+
+def main() :
+    live = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print "%-20s %-12s %-10s %-10s %-10s %s" % ("policy", "collections",
+        "gc msec", "total msec", "gc share", "heap size")
+    for name, policy in POLICIES :
+        heap, elapsed = run(live, policy)
+        gcTime = sum([c['pause'] for c in heap.stats.collections])
+        print "%-20s %-12d %-10.0f %-10.0f %-10s %d" % (name,
+            len(heap.stats.collections), gcTime * 1e3, elapsed * 1e3,
+            "%.0f%%" % (gcTime / elapsed * 100), heap.maxSize)
+
+if __name__ == '__main__' :
+    main()
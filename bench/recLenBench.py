@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#
+# recLenBench.py - recLen.p scaled up, through both interpreters
+#
+# recLen.p counts a list recursively with listlengthr.  This makes the list
+# LENGTH elements long and calls listlengthr on it CALLS times in a while
+# loop, then times interpreterextgc.py running it with tracing off, and with
+# every trace category on.  interpreterext.py evaluates the rhs of every
+# assignment twice, so recursion there takes 2^length calls: it is timed
+# the same two ways on a SMALL_LENGTH element list, SMALL_CALLS times.
+# Each run is made REPEATS times, and the median time printed.
+#
+# With --before, both interpreters are run from the checkout TREE too,
+# untraced: one from before tracing.py, say (git worktree add TREE
+# 05c6f07^), whose programextgc.py builds its log.debug messages on every
+# evaluation whether or not debug logging is on.  Its programext.py logs at
+# DEBUG but has no log.debug calls in evaluation, so interpreterext.py
+# only differs from it by the trace switches it tests.
+#
+# usage: python bench/recLenBench.py [--before TREE] [length [calls]]
+#
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TREE = os.path.join(BENCH_DIR, '..')
+
+REPEATS = 5
+
+SMALL_LENGTH = 10
+SMALL_CALLS = 20
+
+def runs( tree, traced ) :
+    '''(name, command, environment, whether it takes the small program) for
+    each run of the interpreters in tree'''
+    interpreterGC = os.path.join(tree, 'interpreterextgc.py')
+    interpreter = os.path.join(tree, 'interpreterext.py')
+    env = dict(os.environ)
+    env.pop('MINILANG_TRACE', None)
+    tracedEnv = dict(env, MINILANG_TRACE='all')
+    yield ('interpreterextgc', [ interpreterGC, '--heap-size', '1000' ],
+           env, False)
+    if traced :
+        yield ('interpreterextgc, traced', [ interpreterGC, '--heap-size',
+               '1000', '--trace', 'all' ], env, False)
+    yield ('interpreterext', [ interpreter ], env, True)
+    if traced :
+        yield ('interpreterext, traced', [ interpreter ], tracedEnv, True)
+
+PROGRAM = '''define listlengthr
+proc(l)
+ll := l;
+if (nullp(ll)-1)*(0-1) then
+return := 1 + listlengthr(cdr(ll))
+else
+return := 0
+fi
+end;
+a := [%s];
+k := %d;
+while k do
+size := listlengthr(a);
+k := k - 1
+od
+'''
+
+def run( command, env, program ) :
+    '''the median time of REPEATS runs of command, and the last one's exit
+    status'''
+    times = list()
+    for i in range(REPEATS) :
+        start = time.time()
+        proc = subprocess.Popen([sys.executable] + command + [program],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                env=env)
+        proc.communicate()
+        times.append(time.time() - start)
+    return sorted(times)[REPEATS // 2], proc.returncode
+
+def write_program( length, calls ) :
+    fd, program = tempfile.mkstemp(suffix='.p')
+    os.write(fd, PROGRAM % (','.join(['1'] * length), calls))
+    os.close(fd)
+    return program
+
+def main() :
+    args = sys.argv[1:]
+    before = None
+    if args[:1] == ['--before'] :
+        before = args[1]
+        args = args[2:]
+    length = int(args[0]) if len(args) > 0 else 100
+    calls = int(args[1]) if len(args) > 1 else 300
+    programs = { False : write_program(length, calls),
+                 True : write_program(SMALL_LENGTH, SMALL_CALLS) }
+    trees = [ ('', TREE, True) ]
+    if before is not None :
+        trees.append(('before: ', before, False))
+    try:
+        print "%-36s %s" % ("run", "sec")
+        for prefix, tree, traced in trees :
+            for name, command, env, small in runs(tree, traced) :
+                elapsed, rc = run(command, env, programs[small])
+                status = "" if rc == 0 else "  (failed)"
+                print "%-36s %.2f%s" % (prefix + name, elapsed, status)
+    finally:
+        for program in programs.values() :
+            os.remove(program)
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,21 @@
+define listlengthr
+proc(l)
+ll := l;
+if (nullp(ll)-1)*(0-1) then
+return := 1 + listlengthr(cdr(ll))
+else
+return := 0
+fi
+end;
+keep := [];
+i := 0;
+while 15 - i do
+keep := cons(1, keep);
+i := i + 1
+od;
+i := 0;
+while 300 - i do
+t := cons(2, keep);
+n := listlengthr(t);
+i := i + 1
+od
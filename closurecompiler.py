@@ -0,0 +1,540 @@
+#!/usr/bin/python
+#
+# closurecompiler.py - compiles a programextgc Program into Python closures
+#
+# DESCRIPTION:
+#       Program.eval walks the AST, and every node works out again, on every
+#       evaluation, what kind its operands are and (for FunCall) whether its
+#       name is a builtin.  ClosureCompiler does all of that once: each node
+#       becomes a closure taking the name table, with the operand kinds,
+#       builtins and the statements of a StmtList fixed when it is built.
+#       Running the program is then calling the closure for its StmtList.
+#
+#       The closures do what the nodes' eval methods do, in the same order,
+#       including their quirks (intp looks at the argument's node, cons of an
+#       Ident holding an int conses nil, nullp of a call makes the call
+#       twice, ...).  A node without a closure of
+#       its own, or used in a way the evaluator only half handles (car with
+#       two arguments, say), is compiled to a call of its eval method, so it
+#       behaves exactly as it does there.
+#
+#       Proc bodies are compiled with the program.  A call still looks the
+#       name up in the function table, since a define can rebind it while the
+#       program runs, and then runs the closure compiled for that Proc.  A
+#       call of a builtin checks the function table first only if the
+#       program defines a proc of that name somewhere.  A call to a proc
+#       assigned to return with nothing in the proc after it is a tail call,
+#       as in the Resolver: it binds the callee's arguments and leaves a
+#       TailCall in return, and the call running the proc runs the callee's
+#       body in its place, so tail recursion doesn't nest closures.
+#
+#       Idents and Numbers used as operands are read inside the closure of
+#       the node using them rather than through closures of their own, and
+#       trace points are only compiled in for the categories on when the
+#       program is compiled.
+#
+
+import sys
+
+from programextgc import ( Number, List, Ident, Times, Plus, Minus, Concat,
+    FunCall, AssignStmt, DefineStmt, IfStmt, WhileStmt, StmtList, Proc,
+    BuiltIns, ConsCell, TailCall, GLOBAL_FRAMES, BUILTINS, returnSymbol,
+    evalIdent, define, defined_names )
+from tracing import TRACE
+
+
+def _force_int( val, nt, ft, gh ) :
+    'Plus evaluates its operands until they are ints (Numbers held in lists)'
+    while type(val) is not int :
+        val = val.eval(nt, ft, gh)
+    return val
+
+
+def _operand( expr ) :
+    '''how a closure reads an operand: ('name', identifier) for an Ident,
+    ('value', int) for a Number, ('code', None) for anything else'''
+    if isinstance(expr, Ident) :
+        return 'name', expr.name
+    elif isinstance(expr, Number) :
+        return 'value', expr.value
+    return 'code', None
+
+
+# closures for lhs - rhs and lhs * rhs, by the kinds of their operands; a and
+# b are the names, values or closures
+_ARITH = {
+    '-' : {
+        ('name', 'name') : lambda a, b : lambda nt : nt[a] - nt[b],
+        ('name', 'value') : lambda a, b : lambda nt : nt[a] - b,
+        ('name', 'code') : lambda a, b : lambda nt : nt[a] - b(nt),
+        ('value', 'name') : lambda a, b : lambda nt : a - nt[b],
+        ('value', 'value') : lambda a, b : lambda nt : a - b,
+        ('value', 'code') : lambda a, b : lambda nt : a - b(nt),
+        ('code', 'name') : lambda a, b : lambda nt : a(nt) - nt[b],
+        ('code', 'value') : lambda a, b : lambda nt : a(nt) - b,
+        ('code', 'code') : lambda a, b : lambda nt : a(nt) - b(nt),
+    },
+    '*' : {
+        ('name', 'name') : lambda a, b : lambda nt : nt[a] * nt[b],
+        ('name', 'value') : lambda a, b : lambda nt : nt[a] * b,
+        ('name', 'code') : lambda a, b : lambda nt : nt[a] * b(nt),
+        ('value', 'name') : lambda a, b : lambda nt : a * nt[b],
+        ('value', 'value') : lambda a, b : lambda nt : a * b,
+        ('value', 'code') : lambda a, b : lambda nt : a * b(nt),
+        ('code', 'name') : lambda a, b : lambda nt : a(nt) * nt[b],
+        ('code', 'value') : lambda a, b : lambda nt : a(nt) * b,
+        ('code', 'code') : lambda a, b : lambda nt : a(nt) * b(nt),
+    },
+}
+
+
+class ClosureCompiler :
+    '''Compiles a Program's statements, and the Procs defined in them, into
+    closures.  run() then runs the program against its name table.'''
+
+    def __init__( self, program ) :
+        self.program = program
+        self.ft = program.funcTable
+        self.gh = program.globalHeap
+        # Proc -> ( parameters, compiled body )
+        self.procs = dict()
+        # the builtins a proc may be defined over
+        self.shadowed = defined_names(program.stmtList) & set(BUILTINS)
+        self.main = self.compile_stmt(program.stmtList)
+
+    def run( self ) :
+        self.main(self.program.nameTable)
+
+    def fallback( self, node ) :
+        'a closure that just evals node'
+        ft = self.ft
+        gh = self.gh
+        def evalNode( nt ) :
+            return node.eval(nt, ft, gh)
+        return evalNode
+
+    ######   STATEMENTS   ##########
+
+    def compile_stmt( self, stmt, tail=False ) :
+        '''tail says nothing in the proc runs after stmt'''
+        if isinstance(stmt, StmtList) :
+            return self.compile_stmt_list(stmt, tail)
+        elif isinstance(stmt, AssignStmt) :
+            if (tail and stmt.name == returnSymbol
+                and isinstance(stmt.rhs, FunCall)
+                and stmt.rhs.name not in BUILTINS) :
+                return self.compile_tail_call(stmt.rhs)
+            return self.compile_assign(stmt)
+        elif isinstance(stmt, DefineStmt) :
+            return self.compile_define(stmt)
+        elif isinstance(stmt, IfStmt) :
+            return self.compile_if(stmt, tail)
+        elif isinstance(stmt, WhileStmt) :
+            return self.compile_while(stmt)
+        return self.fallback(stmt)
+
+    def compile_stmt_list( self, stmtList, tail=False ) :
+        last = len(stmtList.sl) - 1
+        stmts = tuple([self.compile_stmt(s, tail and i == last)
+                       for i, s in enumerate(stmtList.sl)])
+        if len(stmts) == 1 :
+            return stmts[0]
+        elif len(stmts) == 2 :
+            first, second = stmts
+            def twoStmts( nt ) :
+                first(nt)
+                second(nt)
+            return twoStmts
+        def stmtListClosure( nt ) :
+            for s in stmts :
+                s(nt)
+        return stmtListClosure
+
+    def compile_assign( self, stmt ) :
+        name = stmt.name
+        if isinstance(stmt.rhs, List) :
+            # a list literal is bound as it is
+            literal = stmt.rhs
+            traced = TRACE.eval
+            def assignList( nt ) :
+                if traced :
+                    TRACE.event('eval', "assign %s", name)
+                nt[name] = literal
+            return assignList
+        rhs = self.compile_expr(stmt.rhs)
+        if not TRACE.eval :
+            def assign( nt ) :
+                nt[name] = rhs(nt)
+            return assign
+        def assignTraced( nt ) :
+            TRACE.event('eval', "assign %s", name)
+            nt[name] = rhs(nt)
+        return assignTraced
+
+    def compile_define( self, stmt ) :
+        name = stmt.name
+        proc = stmt.proc
+        ft = self.ft
+        self.compile_proc(proc)
+        def defineClosure( nt ) :
+            define(ft, name, proc)
+        return defineClosure
+
+    def compile_if( self, stmt, tail=False ) :
+        cond = self.compile_expr(stmt.cond)
+        tBody = self.compile_stmt(stmt.tBody, tail)
+        fBody = self.compile_stmt(stmt.fBody, tail)
+        def ifClosure( nt ) :
+            if cond(nt) > 0 :
+                tBody(nt)
+            else :
+                fBody(nt)
+        return ifClosure
+
+    def compile_while( self, stmt ) :
+        body = self.compile_stmt(stmt.body)
+        if isinstance(stmt.cond, Ident) :
+            # while i do
+            name = stmt.cond.name
+            def whileName( nt ) :
+                while nt[name] > 0 :
+                    body(nt)
+            return whileName
+        cond = self.compile_expr(stmt.cond)
+        def whileClosure( nt ) :
+            while cond(nt) > 0 :
+                body(nt)
+        return whileClosure
+
+    def compile_proc( self, proc ) :
+        if proc not in self.procs :
+            self.procs[proc] = (proc.parList,
+                                self.compile_stmt(proc.body, True))
+
+    ######   EXPRESSIONS   #########
+
+    def compile_expr( self, expr ) :
+        if isinstance(expr, Number) :
+            value = expr.value
+            return lambda nt : value
+        elif isinstance(expr, Ident) :
+            name = expr.name
+            return lambda nt : nt[name]
+        elif isinstance(expr, Plus) :
+            return self.compile_plus(expr)
+        elif isinstance(expr, Minus) :
+            return self.compile_arith(expr, '-')
+        elif isinstance(expr, Times) :
+            return self.compile_arith(expr, '*')
+        elif isinstance(expr, Concat) :
+            return self.compile_concat(expr)
+        elif isinstance(expr, FunCall) :
+            return self.compile_call(expr)
+        return self.fallback(expr)
+
+    def compile_read( self, expr ) :
+        'the operand as a closure, with the kind _operand gives it'
+        kind, payload = _operand(expr)
+        if kind == 'code' :
+            payload = self.compile_expr(expr)
+        return kind, payload
+
+    def compile_arith( self, expr, op ) :
+        lhsKind, lhs = self.compile_read(expr.lhs)
+        rhsKind, rhs = self.compile_read(expr.rhs)
+        return _ARITH[op][(lhsKind, rhsKind)](lhs, rhs)
+
+    def compile_plus( self, expr ) :
+        ft = self.ft
+        gh = self.gh
+        lhsKind, lhsName = _operand(expr.lhs)
+        rhsKind, rhsValue = _operand(expr.rhs)
+        if lhsKind == 'name' and rhsKind == 'value' and not TRACE.eval :
+            # i + 1
+            def plusNameValue( nt ) :
+                lhsEval = nt[lhsName]
+                if type(lhsEval) is not int :
+                    lhsEval = _force_int(lhsEval, nt, ft, gh)
+                return lhsEval + rhsValue
+            return plusNameValue
+        lhs = self.compile_expr(expr.lhs)
+        rhs = self.compile_expr(expr.rhs)
+        traced = TRACE.eval
+        def plus( nt ) :
+            rhsEval = rhs(nt)
+            if type(rhsEval) is not int :
+                rhsEval = _force_int(rhsEval, nt, ft, gh)
+            lhsEval = lhs(nt)
+            if type(lhsEval) is not int :
+                lhsEval = _force_int(lhsEval, nt, ft, gh)
+            if traced :
+                TRACE.event('eval', "%s + %s", lhsEval, rhsEval)
+            return lhsEval + rhsEval
+        return plus
+
+    def compile_operand( self, expr ) :
+        '''the operands of ||, and of cons, are evaluated if they are Idents
+        or calls, and used as they are otherwise'''
+        if isinstance(expr, Ident) or isinstance(expr, FunCall) :
+            return self.compile_expr(expr)
+        return lambda nt : expr
+
+    def compile_concat( self, expr ) :
+        lhs = self.compile_operand(expr.lhs)
+        rhs = self.compile_operand(expr.rhs)
+        join_rooted = expr.join_rooted
+        return lambda nt : join_rooted(lhs(nt), rhs, nt)
+
+    def compile_call( self, call ) :
+        if call.name not in BUILTINS :
+            return self.compile_proc_call(call)
+        builtin = getattr(self, 'compile_' + call.name)(call)
+        if call.name not in self.shadowed :
+            return builtin
+        # the program defines a proc of the name, which is called instead
+        # once it has been defined
+        name = call.name
+        ft = self.ft
+        procCall = self.compile_proc_call(call)
+        def shadowedCall( nt ) :
+            if name in ft :
+                return procCall(nt)
+            return builtin(nt)
+        return shadowedCall
+
+    def compile_args( self, call ) :
+        'closures for the arguments of a call to a proc'
+        args = list()
+        for arg in call.argList :
+            if isinstance(arg, List) :
+                # a list literal is passed as it is
+                args.append(lambda nt, arg=arg : arg)
+            else :
+                args.append(self.compile_expr(arg))
+        return tuple(args)
+
+    def compile_proc_call( self, call ) :
+        name = call.name
+        lineno = call.lineno
+        ft = self.ft
+        gh = self.gh
+        procs = self.procs
+        args = self.compile_args(call)
+        nArgs = len(args)
+        argList = call.argList
+        traced = TRACE.call
+        def procCall( nt ) :
+            if traced :
+                TRACE.event('call', "%s line %s", name, lineno)
+            proc = ft[name]
+            parList, body = procs.get(proc, (None, None))
+            if body is None :
+                # defined some way the compiler didn't see
+                return proc.apply(nt, ft, argList, gh)
+            if nArgs != len(parList) :
+                print "Param count does not match:"
+                sys.exit( 1 )
+            base = len(GLOBAL_FRAMES)
+            newContext = {}
+            # the new name table holds GC roots while the proc runs
+            GLOBAL_FRAMES.append(newContext)
+            try :
+                for i in xrange(nArgs) :
+                    newContext[parList[i]] = args[i](nt)
+                # a tail call leaves a TailCall in return, its name table
+                # pushed after this one, which is no longer needed: run the
+                # callee's body here in its place
+                while True :
+                    body(newContext)
+                    val = newContext.get(returnSymbol)
+                    if val.__class__ is not TailCall :
+                        break
+                    body = val.proc
+                    newContext = val.frame
+                    del GLOBAL_FRAMES[-2]
+            finally :
+                del GLOBAL_FRAMES[base:]
+            if returnSymbol in newContext :
+                return newContext[returnSymbol]
+            print "Error:  no return value"
+            sys.exit( 2 )
+        return procCall
+
+    def compile_tail_call( self, call ) :
+        '''return := call, with nothing in the proc after it: the arguments
+        are bound in a name table pushed on GLOBAL_FRAMES, and the callee's
+        body left in return with it, as a TailCall for procCall to run'''
+        name = call.name
+        lineno = call.lineno
+        ft = self.ft
+        procs = self.procs
+        args = self.compile_args(call)
+        nArgs = len(args)
+        procCall = self.compile_proc_call(call)
+        tracedEval = TRACE.eval
+        traced = TRACE.call
+        def tailCall( nt ) :
+            if tracedEval :
+                TRACE.event('eval', "assign %s", returnSymbol)
+            parList, body = procs.get(ft[name], (None, None))
+            if body is None :
+                nt[returnSymbol] = procCall(nt)
+                return
+            if traced :
+                TRACE.event('call', "%s line %s", name, lineno)
+            if nArgs != len(parList) :
+                print "Param count does not match:"
+                sys.exit( 1 )
+            newContext = {}
+            GLOBAL_FRAMES.append(newContext)
+            for i in xrange(nArgs) :
+                newContext[parList[i]] = args[i](nt)
+            nt[returnSymbol] = TailCall(body, newContext)
+        return tailCall
+
+    def builtin( self, call, closure ) :
+        'wraps a builtin closure with its trace point, if call is traced'
+        if not TRACE.call :
+            return closure
+        name = call.name
+        def builtinCall( nt ) :
+            if TRACE.call:
+                TRACE.event('call', "builtin %s", name)
+            return closure(nt)
+        return builtinCall
+
+    def compile_list_arg( self, arg ) :
+        '''car's argument: an Ident or a call is evaluated, a list literal
+        taken as it is; None if it's anything else'''
+        if isinstance(arg, Ident) or isinstance(arg, FunCall) :
+            return self.compile_expr(arg)
+        elif isinstance(arg, List) :
+            return lambda nt : arg
+        return None
+
+    def compile_car( self, call ) :
+        if len(call.argList) != 1 :
+            return self.fallback(call)
+        listArg = self.compile_list_arg(call.argList[0])
+        if listArg is None :
+            return self.fallback(call)
+        def car( nt ) :
+            listPassed = listArg(nt)
+            if not isinstance(listPassed, List) :
+                raise Exception("Can only call car on List")
+            val = BuiltIns.car(listPassed)
+            if isinstance(val, ConsCell) :
+                return List(cons_cell=val)
+            return val
+        return self.builtin(call, car)
+
+    def compile_cdr( self, call ) :
+        if len(call.argList) < 1 :
+            return self.fallback(call)
+        arg = call.argList[0]
+        if isinstance(arg, Ident) :
+            ft = self.ft
+            gh = self.gh
+            name = arg.name
+            def listArg( nt ) :
+                val = nt[name]
+                if isinstance(val, List) :
+                    return val
+                return evalIdent(arg, nt, ft, gh)
+        else :
+            listArg = self.compile_list_arg(arg)
+            if listArg is None :
+                return self.fallback(call)
+        def cdr( nt ) :
+            listPassed = listArg(nt)
+            if not isinstance(listPassed, List) :
+                raise Exception("Can only call cdr on List")
+            # BuiltIns.cdr, inline
+            try:
+                rest = listPassed.sequence.cons_cell.cdr
+            except AttributeError:
+                rest = None
+            return List(cons_cell=rest)
+        return self.builtin(call, cdr)
+
+    def compile_nullp( self, call ) :
+        if len(call.argList) != 1 :
+            return self.fallback(call)
+        arg = call.argList[0]
+        if isinstance(arg, List) :
+            # a literal evaluates to a python list, which isn't a List
+            return self.builtin(call, lambda nt : 0)
+        if not (isinstance(arg, Ident) or isinstance(arg, FunCall)) :
+            return self.fallback(call)
+        # nullp evaluates its argument, then car evaluates it again and
+        # looks at what that gives.  An Ident gives the same List both
+        # times, so it is only read once; a call is made twice, allocations
+        # and all.
+        listArg = self.compile_expr(arg)
+        def first_is_nil( the_list ) :
+            # BuiltIns.car, inline
+            try:
+                first = the_list.sequence.cons_cell.car
+            except AttributeError:
+                first = None
+            return 1 if first is None else 0
+        if isinstance(arg, Ident) :
+            def nullp( nt ) :
+                the_list = listArg(nt)
+                if not isinstance(the_list, List) :
+                    return 0
+                return first_is_nil(the_list)
+        else :
+            def nullp( nt ) :
+                if not isinstance(listArg(nt), List) :
+                    return 0
+                listPassed = listArg(nt)
+                if not isinstance(listPassed, List) :
+                    raise Exception("Can only call car on List")
+                return first_is_nil(listPassed)
+        return self.builtin(call, nullp)
+
+    def compile_listp( self, call ) :
+        if len(call.argList) < 1 :
+            return self.builtin(call, lambda nt : 0)
+        arg = self.compile_expr(call.argList[0])
+        def listp( nt ) :
+            try:
+                evaledArg = arg(nt)
+            except:
+                return 0
+            if isinstance(evaledArg, List) or isinstance(evaledArg, list) :
+                return 1
+            return 0
+        return self.builtin(call, listp)
+
+    def compile_intp( self, call ) :
+        # intp looks at the node, not at what it evaluates to
+        if call.argList and isinstance(call.argList[0], Number) :
+            return self.builtin(call, lambda nt : 1)
+        return self.builtin(call, lambda nt : 0)
+
+    def compile_cons( self, call ) :
+        if len(call.argList) != 2 :
+            return self.fallback(call)
+        arg1 = self.compile_operand(call.argList[0])
+        arg2 = call.argList[1]
+        if isinstance(arg2, Ident) or isinstance(arg2, FunCall) :
+            dest = self.compile_expr(arg2)
+            def destList( nt ) :
+                val = dest(nt)
+                if isinstance(val, int) :
+                    raise Exception("Can only cons an object onto a List")
+                return val
+        elif isinstance(arg2, List) :
+            destList = lambda nt : arg2
+        else :
+            destList = lambda nt : None
+        def cons( nt ) :
+            return List(cons_cell=BuiltIns.cons(arg1(nt), destList(nt), call))
+        return self.builtin(call, cons)
+
+
+def compile_program( program ) :
+    'compiles program, returning the ClosureCompiler to run it'
+    return ClosureCompiler(program)
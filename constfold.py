@@ -0,0 +1,122 @@
+#!/usr/bin/python
+#
+# constfold.py - folds constant expressions and dead branches out of a
+#       programextgc Program before it is run
+#
+# DESCRIPTION:
+#       Folder rewrites a parsed Program in place, so every backend runs the
+#       smaller tree:
+#
+#         - a +, - or * of two Numbers becomes a Number, from the bottom up,
+#           so 1 + 2 * 3 and (0-1) are each one Number
+#         - an if whose condition is a Number is replaced by the statements
+#           of the branch it would take (a number > 0 being true, as in
+#           IfStmt.eval)
+#         - a while whose condition is a Number that isn't > 0 is dropped
+#
+#       Proc bodies are folded too, and their frameBody made again (see
+#       Proc.resolve).  The call arguments of car, cdr, nullp, listp, intp
+#       and cons are folded inside but never replaced by a Number, since
+#       intp and cons look at the argument's node rather than its value;
+#       a proc shadowing one of the names gets its arguments unfolded too.
+#       Nothing else changes what the program does: Numbers are ints, so
+#       folding them can't fail or allocate, and the branches dropped would
+#       never have run.
+#
+#       fold_program returns how many nodes it took out of the tree.
+#
+
+from programextgc import ( Number, Times, Plus, Minus, Concat, FunCall,
+    AssignStmt, DefineStmt, IfStmt, WhileStmt, StmtList, List, BUILTINS )
+
+# how each operator folds, by node class
+OPERATORS = {
+    Plus : lambda a, b : a + b,
+    Minus : lambda a, b : a - b,
+    Times : lambda a, b : a * b,
+}
+
+
+def size( node ) :
+    'the number of nodes in the tree at node, counting procs defined in it'
+    if isinstance(node, StmtList) :
+        return 1 + sum([ size(s) for s in node.sl ])
+    elif isinstance(node, AssignStmt) :
+        return 1 + size(node.rhs)
+    elif isinstance(node, DefineStmt) :
+        return 1 + size(node.proc.body)
+    elif isinstance(node, IfStmt) :
+        return 1 + size(node.cond) + size(node.tBody) + size(node.fBody)
+    elif isinstance(node, WhileStmt) :
+        return 1 + size(node.cond) + size(node.body)
+    elif (isinstance(node, Plus) or isinstance(node, Minus)
+          or isinstance(node, Times) or isinstance(node, Concat)) :
+        return 1 + size(node.lhs) + size(node.rhs)
+    elif isinstance(node, FunCall) :
+        return 1 + sum([ size(arg) for arg in node.argList ])
+    # Numbers, Idents, list literals
+    return 1
+
+
+class Folder :
+    '''Folds a Program's statements, proc bodies included, in place'''
+
+    def stmt_list( self, stmtList ) :
+        sl = list()
+        for s in stmtList.sl :
+            sl.extend(self.stmt(s))
+        stmtList.sl = sl
+
+    def stmt( self, s ) :
+        'the statements s folds to, a list'
+        if isinstance(s, AssignStmt) :
+            if not isinstance(s.rhs, List) :
+                s.rhs = self.expr(s.rhs)
+        elif isinstance(s, DefineStmt) :
+            self.stmt_list(s.proc.body)
+            s.proc.resolve()
+        elif isinstance(s, IfStmt) :
+            s.cond = self.expr(s.cond)
+            self.stmt_list(s.tBody)
+            self.stmt_list(s.fBody)
+            if isinstance(s.cond, Number) :
+                if s.cond.value > 0 :
+                    return s.tBody.sl
+                return s.fBody.sl
+        elif isinstance(s, WhileStmt) :
+            s.cond = self.expr(s.cond)
+            if isinstance(s.cond, Number) and not s.cond.value > 0 :
+                return []
+            self.stmt_list(s.body)
+        return [ s ]
+
+    def expr( self, e ) :
+        'e, with its operands folded, or the Number it folds to'
+        if e.__class__ in OPERATORS :
+            e.lhs = self.expr(e.lhs)
+            e.rhs = self.expr(e.rhs)
+            if isinstance(e.lhs, Number) and isinstance(e.rhs, Number) :
+                return Number(OPERATORS[e.__class__](e.lhs.value,
+                                                     e.rhs.value))
+        elif isinstance(e, Concat) :
+            e.lhs = self.expr(e.lhs)
+            e.rhs = self.expr(e.rhs)
+        elif isinstance(e, FunCall) :
+            argList = list()
+            for arg in e.argList :
+                folded = self.expr(arg)
+                if e.name in BUILTINS and folded.__class__ is not arg.__class__ :
+                    # arg's operands are folded, arg stays
+                    folded = arg
+                argList.append(folded)
+            e.argList = argList
+        return e
+
+
+def fold_program( program ) :
+    '''folds program's statements and procs in place, returns the number of
+    nodes taken out'''
+    before = size(program.stmtList)
+    Folder().stmt_list(program.stmtList)
+    program.folded = True
+    return before - size(program.stmtList)
@@ -1,9 +1,55 @@
 from interpreterextgc import *
 from programextgc import *
+from tracing import TRACE
+import programextgc
+import interpreterextgc
+import stackvm
+import transpiler
+import constfold
+import os
+import sys
+import csv
+import json
+import marshal
+import shutil
+import StringIO
+import tempfile
 import unittest
 
 class GCTest(unittest.TestCase) :
 
+    # tests may replace the heap, memoize, pick a backend and run programs,
+    # which fill the global tables; tearDown puts them back
+    def setUp(self) :
+        self.savedHeap = programextgc.GLOBAL_HEAP
+        self.savedNames = dict(programextgc.GLOBAL_NAME_TABLE)
+        self.savedFuncs = dict(programextgc.GLOBAL_FUNCTION_TABLE)
+
+    def tearDown(self) :
+        interpreterextgc.BACKEND = 'eval'
+        interpreterextgc.VM_CACHE = None
+        configure_memo(None)
+        programextgc.GLOBAL_NAME_TABLE.clear()
+        programextgc.GLOBAL_NAME_TABLE.update(self.savedNames)
+        programextgc.GLOBAL_FUNCTION_TABLE.clear()
+        programextgc.GLOBAL_FUNCTION_TABLE.update(self.savedFuncs)
+        programextgc.GLOBAL_HEAP = self.savedHeap
+
+    def run_source(self, source, backend='eval', kind='heap') :
+        '''runs the program source with backend on a new 20 cell heap of the
+        kind and empty global tables, returns what it printed'''
+        programextgc.GLOBAL_NAME_TABLE.clear()
+        programextgc.GLOBAL_FUNCTION_TABLE.clear()
+        configure_heap(20, kind=kind)
+        interpreterextgc.BACKEND = backend
+        savedStdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            test_parser(source)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = savedStdout
+
     # Initialize some variables useful across tests
     def getSimpleList(self, gh) :
         l1 = [1,2,3,[4,5]]
@@ -32,6 +78,809 @@ class GCTest(unittest.TestCase) :
         self.assertTrue(True)
 
 
+    def test_free_list_alloc_collect(self) :
+        gh = Heap(4)
+        cells = [gh.alloc() for i in range(4)]
+        self.assertFalse(gh.hasSpace())
+        self.assertEqual(gh.get_count_allocated(), 4)
+
+        # root a two cell list, the other two cells are garbage
+        cells[0].cdr = cells[1]
+        nt = { 'a' : List(cons_cell=cells[0]) }
+        gh.collect(nt, dict())
+        self.assertEqual(gh.get_count_allocated(), 2)
+        self.assertEqual(len(gh.freeList), 2)
+        self.assertTrue(gh.hasSpace())
+
+        gh.alloc()
+        gh.alloc()
+        self.assertFalse(gh.hasSpace())
+        self.assertTrue(gh.is_alloc(cells[0]))
+        self.assertTrue(gh.is_alloc(cells[1]))
+        self.assertFalse(gh.is_alloc(Heap(4).alloc()))
+
+    def test_cons_same_cell(self) :
+        c = programextgc.GLOBAL_HEAP.alloc()
+        self.assertRaises(MemoryError, BuiltIns.check_dup, c, None, c)
+
+    def test_first_fit_alloc_collect(self) :
+        gh = Heap(3, freeList=False)
+        cells = [gh.alloc() for i in range(3)]
+        gh.collect({ 'a' : List(cons_cell=cells[1]) }, dict())
+        self.assertEqual(gh.get_count_allocated(), 1)
+        self.assertTrue(gh.alloc() is cells[0])
+
+    def test_mark_epochs(self) :
+        gh = Heap(3)
+        cells = [gh.alloc() for i in range(3)]
+        cells[0].cdr = cells[1]
+        self.assertEqual(ConsCell.mark_cell(cells[0]), 2)
+        self.assertEqual(ConsCell.mark_cell(cells[1]), 0)
+        self.assertTrue(cells[1].mark)
+        # run through every epoch, including the one that wraps around
+        for i in range(300) :
+            cells[0].cdr = cells[1]
+            gh.collect({ 'a' : List(cons_cell=cells[i % 3]) }, dict())
+            self.assertEqual(gh.get_count_allocated(), 2 if i % 3 == 0 else 1)
+            self.assertTrue(cells[i % 3].mark)
+            self.assertFalse(cells[(i + 2) % 3].mark)
+            while gh.hasSpace() :
+                gh.alloc()
+
+    def test_lazy_sweep_alloc_collect(self) :
+        gh = Heap(4, lazySweep=True)
+        cells = [gh.alloc() for i in range(4)]
+        cells[1].cdr = cells[3]
+        gh.collect({ 'a' : List(cons_cell=cells[1]) }, dict())
+        self.assertEqual(gh.get_count_allocated(), 2)
+        # collect only marked, alloc sweeps up to the garbage
+        self.assertEqual(gh.sweepCursor, 0)
+        self.assertTrue(gh.alloc() is cells[0])
+        self.assertTrue(gh.alloc() is cells[2])
+        self.assertEqual(gh.sweepCursor, 3)
+        self.assertFalse(gh.hasSpace())
+
+        # the next collect finishes the sweep before marking again
+        gh.collect({ 'a' : List(cons_cell=cells[3]) }, dict())
+        self.assertEqual(gh.get_count_allocated(), 1)
+        self.assertFalse(cells[1].mark)
+        self.assertTrue(gh.alloc() is cells[0])
+
+    def test_array_heap_tagged_values(self) :
+        gh = ArrayHeap(3)
+        a = gh.alloc()
+        b = gh.alloc()
+        a.car = Number(-7)
+        a.cdr = b
+        b.car = Number(2 ** 70)
+        self.assertEqual(a.car.value, -7)
+        self.assertEqual(a.cdr, b)
+        self.assertEqual(b.car.value, 2 ** 70)
+        self.assertTrue(b.cdr is None)
+        self.assertEqual(str(a), "( -7 ( %s nil ) )" % 2 ** 70)
+
+    def test_array_heap_collect(self) :
+        gh = ArrayHeap(4)
+        cells = [gh.alloc() for i in range(4)]
+        self.assertFalse(gh.hasSpace())
+        cells[0].car = cells[2]
+        cells[2].cdr = cells[3]
+        gh.collect({ 'a' : List(cons_cell=cells[0]) }, dict())
+        self.assertEqual(gh.get_count_allocated(), 3)
+        self.assertFalse(gh.is_alloc(cells[1]))
+        self.assertEqual(gh.alloc(), cells[1])
+
+        ConsCell.mark_cell(cells[0])
+        self.assertTrue(cells[3].mark)
+
+    def test_array_heap_builtins(self) :
+        saved = programextgc.GLOBAL_HEAP
+        programextgc.GLOBAL_HEAP = ArrayHeap(10)
+        try:
+            l = List(cons_cell=BuiltIns.cons(Number(1), List()))
+            l = List(cons_cell=BuiltIns.cons(l, l))
+            self.assertEqual(str(l), "( ( 1 nil ) ( 1 nil ) )")
+            self.assertEqual(str(BuiltIns.car(l)), "( 1 nil )")
+            self.assertEqual(BuiltIns.car(List(cons_cell=BuiltIns.cdr(l))).value, 1)
+        finally:
+            programextgc.GLOBAL_HEAP = saved
+
+    def test_mark_long_and_deep_lists(self) :
+        saved = programextgc.GLOBAL_HEAP
+        for gh in [Heap(20000), ArrayHeap(20000)] :
+            programextgc.GLOBAL_HEAP = gh
+            try:
+                longList = List()
+                deepList = List()
+                for i in range(5000) :
+                    longList = List(cons_cell=BuiltIns.cons(Number(i), longList))
+                    gh.alloc()
+                for i in range(4000) :
+                    deepList = List(cons_cell=BuiltIns.cons(deepList, List()))
+                gh.collect({ 'a' : longList, 'b' : deepList }, dict())
+                self.assertEqual(gh.get_count_allocated(), 9000)
+            finally:
+                programextgc.GLOBAL_HEAP = saved
+
+    def test_heap_grows_when_full_after_collect(self) :
+        for heapClass in [Heap, ArrayHeap] :
+            gh = heapClass(4, sizing=HeapSizing(10, 2.0, 0.75))
+            nt = programextgc.GLOBAL_NAME_TABLE
+            try:
+                prev = None
+                for i in range(10) :
+                    c = gh.alloc()
+                    c.cdr = prev
+                    prev = c
+                    nt['a'] = List(cons_cell=c)
+                self.assertEqual(gh.maxSize, 10)
+                self.assertEqual(gh.numCollections, 2)
+                self.assertEqual(gh.get_count_allocated(), 10)
+                self.assertRaises(MemoryError, gh.alloc)
+            finally:
+                del nt['a']
+
+    def test_paced_sizing(self) :
+        nt = programextgc.GLOBAL_NAME_TABLE
+        try:
+            # the live list doubles, so the heap does too
+            gh = Heap(4, sizing=PacedSizing(100, 100, 1.0, minHeadroom=1))
+            prev = None
+            for i in range(10) :
+                c = gh.alloc()
+                c.cdr = prev
+                prev = c
+                nt['a'] = List(cons_cell=c)
+            self.assertEqual(gh.maxSize, 16)
+            self.assertEqual(gh.numCollections, 2)
+            self.assertEqual(gh.sizing.trigger, 16)
+
+            # one live cell: collect every other cell, long before it's full
+            gh = Heap(4, sizing=PacedSizing(100, 100, 1.0, minHeadroom=1))
+            nt['a'] = List(cons_cell=gh.alloc())
+            for i in range(5) :
+                gh.alloc()
+            self.assertEqual(gh.maxSize, 4)
+            self.assertEqual(gh.numCollections, 2)
+        finally:
+            del nt['a']
+
+    def test_build_list_allocates_at_once(self) :
+        nt = programextgc.GLOBAL_NAME_TABLE
+        try:
+            gh = Heap(6)
+            nt['a'] = List(cons_cell=gh.alloc())
+            gh.alloc()
+            gh.alloc()
+            # 3 free cells and 4 needed: collect once, not cell by cell
+            first = gh.build_list([Number(i) for i in range(1, 5)])
+            self.assertEqual(gh.numCollections, 1)
+            nt['b'] = List(cons_cell=first)
+            self.assertRaises(MemoryError, gh.alloc_many, 2)
+            self.assertEqual(gh.numCollections, 2)
+            self.assertEqual(str(first), "( 1 ( 2 ( 3 ( 4 nil ) ) ) )")
+
+            # a nursery too small for the list takes it in pieces
+            gh = GenerationalHeap(12, nurserySize=2)
+            first = gh.build_list([Number(i) for i in range(5)])
+            self.assertEqual(str(first), "( 0 ( 1 ( 2 ( 3 ( 4 nil ) ) ) ) )")
+        finally:
+            nt.pop('a', None)
+            nt.pop('b', None)
+
+    def test_concat_copies_lhs_and_shares_rhs(self) :
+        saved = programextgc.GLOBAL_HEAP
+        programextgc.GLOBAL_HEAP = Heap(10)
+        try:
+            a = List(cons_cell=BuiltIns.cons(Number(1),
+                BuiltIns.cons(Number(2), None)))
+            b = List(cons_cell=BuiltIns.cons(Number(3), None))
+            c = Concat(a, b).eval(dict(), dict(), programextgc.GLOBAL_HEAP)
+            self.assertEqual(str(c), "( 1 ( 2 ( 3 nil ) ) )")
+            self.assertEqual(str(a), "( 1 ( 2 nil ) )")
+            first = c.sequence.cons_cell
+            self.assertNotEqual(first.index, a.sequence.cons_cell.index)
+            self.assertEqual(first.cdr.cdr.index, b.sequence.cons_cell.index)
+            self.assertEqual(programextgc.GLOBAL_HEAP.get_count_allocated(), 5)
+
+            c = Concat(List(), b).eval(dict(), dict(), programextgc.GLOBAL_HEAP)
+            self.assertEqual(c.sequence.cons_cell.index,
+                b.sequence.cons_cell.index)
+        finally:
+            programextgc.GLOBAL_HEAP = saved
+
+    def test_tracing(self) :
+        saved = programextgc.GLOBAL_HEAP
+        programextgc.GLOBAL_HEAP = Heap(4)
+        try:
+            BuiltIns.cons(Number(1), None)
+            self.assertEqual(len(TRACE.ring), 0)
+
+            TRACE.enable('cons,alloc')
+            TRACE.resize(3)
+            c = BuiltIns.cons(Number(2), BuiltIns.cons(Number(1), None))
+            # only the last 3 events are kept, formatted when asked for
+            self.assertEqual(list(TRACE.events()), [
+                "cons  cell %s is ( 1 nil )" % c.cdr.index,
+                "alloc cell %s allocated" % c.index,
+                "cons  cell %s is ( 2 #%s )" % (c.index, c.cdr.index)])
+            self.assertEqual(TRACE.dropped, 1)
+            self.assertRaises(ValueError, TRACE.enable, 'bogus')
+        finally:
+            TRACE.disable()
+            TRACE.clear()
+            TRACE.resize(5000)
+            programextgc.GLOBAL_HEAP = saved
+
+    def test_backends_match_eval(self) :
+        for name in ['add1.p', 'concatTest3.p', 'embeddedFunCall1.p',
+                     'listLenRec.p'] :
+            with open(os.path.join('test', 'SampleInputs2', name)) as f :
+                source = f.read()
+            outputs = [ self.run_source(source, backend)
+                        for backend in ['eval', 'closure', 'vm', 'python'] ]
+            self.assertEqual(outputs[0], outputs[1], name)
+            self.assertEqual(outputs[0], outputs[2], name)
+            self.assertEqual(outputs[0], outputs[3], name)
+
+    def test_closure_nullp_calls_twice(self) :
+        # eval's nullp evaluates its argument, and car evaluates it again
+        source = '''define mk
+proc( n )
+  return := cons( n, [] )
+end;
+a := nullp( mk( 1 ) )'''
+        counts = list()
+        for backend in ['eval', 'closure'] :
+            # (cons of an Ident holding an int conses nil)
+            self.run_source(source, backend)
+            self.assertEqual(programextgc.GLOBAL_NAME_TABLE['a'], 1, backend)
+            counts.append(programextgc.GLOBAL_HEAP.get_count_allocated())
+        self.assertEqual(counts, [2, 2])
+
+    def test_concat_roots_lhs(self) :
+        # mk( 4 ) collects while mk( 3 )'s list is only held by the ||
+        source = '''define mk
+proc( n )
+  a := [1, 2, 3];
+  b := cons( n, a );
+  return := b
+end;
+k := 10;
+while k do
+  y := mk( 3 ) || mk( 4 );
+  k := k - 1
+od'''
+        for backend in ['eval', 'closure', 'vm', 'python'] :
+            self.run_source(source, backend, 'array')
+            self.assertEqual(str(programextgc.GLOBAL_NAME_TABLE['y']),
+                "( nil ( 1 ( 2 ( 3 ( nil ( 1 ( 2 ( 3 nil ) ) ) ) ) ) ) )",
+                backend)
+            self.assertEqual(programextgc.GLOBAL_TEMP_ROOTS, [], backend)
+
+    def test_procs_shadow_builtins(self) :
+        nt = programextgc.GLOBAL_NAME_TABLE
+        # car is the builtin until the define runs, then the proc
+        source = '''l := [4, 5];
+a := car(l);
+define car
+proc( x )
+  return := 7
+end;
+b := car(l);
+c := cdr(l)'''
+        for backend in ['eval', 'closure', 'vm', 'python'] :
+            self.run_source(source, backend)
+            self.assertEqual(nt['a'].value, 4, backend)
+            self.assertEqual(nt['b'], 7, backend)
+            self.assertEqual(str(nt['c']), "( 5 nil )", backend)
+
+        # only the builtins are builtins
+        call = FunCall('display', [Number(1)])
+        self.assertRaises(KeyError, call.eval, dict(), dict(), None)
+
+    def test_bytecode_round_trip(self) :
+        programextgc.GLOBAL_HEAP = Heap(10)
+        literals = len(programextgc.GLOBAL_LITERALS)
+        try:
+            body = StmtList()
+            body.insert(AssignStmt('return', Plus(Ident('n'), Number(1))))
+            sl = StmtList()
+            sl.insert(AssignStmt('b', FunCall('inc', [Ident('a')])))
+            sl.insert(AssignStmt('l', List(Sequence(elements=[Number(1),
+                List(Sequence(elements=[Number(2)]))]))))
+            sl.insert(AssignStmt('a', Times(Number(6), Number(7))))
+            sl.insert(DefineStmt('inc', Proc(['n'], body)))
+            code = stackvm.compile_program(Program(sl))
+
+            # loaded, the literal is built again, and is a root
+            loaded = stackvm.Code.loads(code.dumps())
+            self.assertEqual(loaded.units, code.units)
+            nt = dict()
+            stackvm.VM(loaded, nt, dict(), programextgc.GLOBAL_HEAP).run()
+            self.assertEqual(nt['b'], 43)
+            self.assertEqual(str(nt['l']), "( 1 ( ( 2 nil ) nil ) )")
+            self.assertTrue(nt['l'] is not sl.sl[2].rhs)
+            self.assertTrue(nt['l'].sequence.cons_cell
+                            in programextgc.GLOBAL_LITERALS)
+            self.assertRaises(ValueError, stackvm.Code.loads,
+                              marshal.dumps((0, (), ())))
+        finally:
+            del programextgc.GLOBAL_LITERALS[literals:]
+
+    def test_python_code_cache(self) :
+        programextgc.GLOBAL_HEAP = Heap(10)
+        cacheDir = tempfile.mkdtemp()
+        try:
+            body = StmtList()
+            body.insert(AssignStmt('return', Plus(Ident('n'), Number(1))))
+            sl = StmtList()
+            sl.insert(AssignStmt('b', FunCall('inc', [Ident('a')])))
+            sl.insert(AssignStmt('a', Number(41)))
+            sl.insert(DefineStmt('inc', Proc(['n'], body)))
+            program = Program(sl)
+            program.nameTable = dict()
+            program.funcTable = dict()
+            source = transpiler.transpile(program).source
+            code = transpiler.load_code(source, cacheDir)
+            path = os.path.join(cacheDir, transpiler.source_key(source)
+                                + transpiler.CACHE_SUFFIX)
+            self.assertTrue(os.path.exists(path))
+
+            # the second time it comes from the cache
+            cached = transpiler.load_code(source, cacheDir)
+            self.assertTrue(cached is not code)
+            self.assertEqual(cached.co_code, code.co_code)
+            transpiler.run_program(program, cacheDir)
+            self.assertEqual(program.nameTable['b'], 42)
+            self.assertEqual(os.listdir(cacheDir), [os.path.basename(path)])
+
+            # a file that isn't a code object is compiled again
+            with open(path, 'wb') as f :
+                f.write('\0')
+            self.assertEqual(transpiler.load_code(source, cacheDir).co_code,
+                             code.co_code)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_vm_code_cache(self) :
+        # 15 literal cells on a 20 cell heap: a Code from the cache has to
+        # use the parsed literal, there's no room to build it again
+        source = "y := [1,[2,3],[4,5],[6,7,8,9,10],[11]];\nt := car(y)\n"
+        cacheDir = tempfile.mkdtemp()
+        try:
+            interpreterextgc.VM_CACHE = cacheDir
+            compiled = self.run_source(source, 'vm')
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+            cached = self.run_source(source, 'vm')
+            self.assertEqual(cached, compiled)
+            self.assertEqual(programextgc.GLOBAL_NAME_TABLE['t'].value, 1)
+
+            # a file that isn't a Code is compiled again
+            path = os.path.join(cacheDir, os.listdir(cacheDir)[0])
+            with open(path, 'wb') as f :
+                f.write('\0')
+            self.assertEqual(self.run_source(source, 'vm'), compiled)
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_heap_without_max_size_does_not_grow(self) :
+        gh = Heap(2)
+        gh.alloc()
+        gh.alloc()
+        gh.collect(dict(), dict())
+        self.assertEqual(HeapSizing().new_size(gh), 2)
+
+    def test_heap_options_are_checked(self) :
+        args = parse_args(['--heap-size', '10', '--heap-max', '10',
+                           '--heap-kind', 'compact', '--compact-at', '0.5'])
+        self.assertEqual(args.compact_at, 0.5)
+        self.assertEqual(parse_args([]).gc_step_cells, None)
+        savedStderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            for argv in [['--heap-size', '0'], ['--heap-size', '-3'],
+                         ['--heap-size', '10', '--heap-max', '5'],
+                         ['--heap-growth', '0.5'], ['--heap-grow-at', '0'],
+                         ['--heap-grow-at', '1.5'],
+                         ['--heap-kind', 'array', '--lazy-sweep'],
+                         ['--nursery-size', '4'],
+                         ['--heap-kind', 'array', '--gc-step-usec', '5']] :
+                self.assertRaises(SystemExit, parse_args, argv)
+        finally:
+            sys.stderr = savedStderr
+
+    def test_semispace_copies_live_cells(self) :
+        gh = SemispaceHeap(4)
+        cells = [gh.alloc() for i in range(4)]
+        cells[3].car = Number(3)
+        cells[3].cdr = cells[1]
+        cells[1].car = Number(2 ** 70)
+        rest = cells[3].cdr
+        gh.collect({ 'a' : List(cons_cell=cells[3]) }, dict())
+        self.assertEqual(gh.get_count_allocated(), 2)
+        # survivors are packed at the front, handles moved with them
+        self.assertEqual(cells[3].index, 0)
+        self.assertEqual(rest.index, 1)
+        self.assertTrue(gh.is_alloc(rest))
+        self.assertFalse(gh.is_alloc(cells[0]))
+        self.assertEqual(str(cells[3]), "( 3 ( %s nil ) )" % 2 ** 70)
+        self.assertEqual(gh.alloc().index, 2)
+
+    def test_compacting_heap_slides_live_cells(self) :
+        gh = CompactingHeap(6, compactAt=0.4)
+        cells = [gh.alloc() for i in range(6)]
+        cells[5].car = Number(2 ** 70)
+        cells[5].cdr = cells[3]
+        cells[3].car = cells[1]
+        nt = { 'a' : List(cons_cell=cells[5]) }
+        cells[1].car = Number(1)
+        # 3 of the first 6 cells are free, over compactAt
+        gh.collect(nt, dict())
+        self.assertEqual(gh.compactions, 1)
+        self.assertEqual([c.index for c in (cells[1], cells[3], cells[5])], [0, 1, 2])
+        self.assertEqual(str(nt['a']), "( %s ( ( 1 nil ) nil ) )" % 2 ** 70)
+        self.assertEqual(gh.alloc().index, 3)
+
+        # 1 of the first 3 cells free is under compactAt, so just sweep
+        cells[3].car = None
+        gh.collect(nt, dict())
+        self.assertEqual(gh.compactions, 1)
+        self.assertEqual(gh.get_count_allocated(), 2)
+        self.assertEqual(cells[5].index, 2)
+
+    def test_heap_kinds_agree_across_collections(self) :
+        saved = programextgc.GLOBAL_HEAP
+        nt = programextgc.GLOBAL_NAME_TABLE
+        try:
+            for kind in sorted(HEAP_KINDS.keys()) :
+                gh = configure_heap(8, kind=kind)
+                nt['l'] = List()
+                for i in range(20) :
+                    l = nt['l']
+                    nt['l'] = List(cons_cell=BuiltIns.cons(Number(i), l))
+                    BuiltIns.cons(Number(i), List(cons_cell=BuiltIns.cdr(l)))
+                    if i >= 3 :
+                        nt['l'] = List(cons_cell=BuiltIns.cdr(nt['l']))
+                self.assertTrue(gh.numCollections > 0)
+                self.assertEqual(str(nt['l']), "( 2 ( 1 ( 0 nil ) ) )")
+        finally:
+            del nt['l']
+            programextgc.GLOBAL_HEAP = saved
+
+    def test_generational_minor_and_major(self) :
+        gh = GenerationalHeap(8, nurserySize=2)
+        old = gh.alloc()
+        young = gh.alloc()
+        young.car = Number(1)
+        gh.collect({ 'a' : List(cons_cell=old) }, dict())
+        # old was promoted, young died in the nursery
+        self.assertTrue(old.index >= 2)
+        self.assertFalse(gh.is_alloc(young))
+        self.assertEqual(gh.generation_stats()['minor']['collections'], 1)
+
+        # an old cell pointing into the nursery is remembered
+        young = gh.alloc()
+        young.car = Number(2)
+        old.car = young
+        gh.write_barrier(old)
+        self.assertEqual(gh.remembered, set([old.index]))
+        gh.collect({ 'a' : List(cons_cell=old) }, dict())
+        self.assertTrue(young.index >= 2)
+        self.assertEqual(str(old), "( ( 2 nil ) nil )")
+
+        # the old generation only gets collected once it could fill up
+        nt = { 'a' : List(cons_cell=old) }
+        for i in range(2) :
+            nt['b'] = List(cons_cell=gh.alloc())
+            nt['c'] = List(cons_cell=gh.alloc())
+            gh.collect(nt, dict())
+            self.assertEqual(gh.generation_stats()['major']['collections'], 0)
+        gh.alloc()
+        gh.collect({ 'a' : List(cons_cell=old) }, dict())
+        self.assertEqual(gh.generation_stats()['major']['collections'], 1)
+        self.assertEqual(gh.get_count_allocated(), 2)
+
+    def test_incremental_marking_keeps_tri_color_invariant(self) :
+        gh = IncrementalHeap(8, stepCells=1, startAt=1.0)
+        kept = gh.alloc()
+        white = gh.alloc()
+        gh.alloc()
+        nt = { 'a' : List(cons_cell=kept) }
+        gh.start_cycle(nt)
+        self.assertEqual(gh.phase, IncrementalHeap.MARKING)
+        # cells allocated during the cycle are black, and the barrier
+        # grays the white cell the new one points at
+        black = gh.alloc()
+        black.car = white
+        gh.write_barrier(black)
+        self.assertTrue(gh.marks[white.index])
+        self.assertTrue(white.index in gh.gray)
+        nt['b'] = List(cons_cell=black)
+        while gh.phase != IncrementalHeap.IDLE :
+            gh.step()
+        self.assertEqual(gh.get_count_allocated(), 3)
+        self.assertTrue(gh.is_alloc(white))
+
+        # alloc starts cycles by itself and finishes them a step at a time
+        gh.startAt = 0.5
+        del nt['b']
+        cells = [gh.alloc() for i in range(2)]
+        self.assertEqual(gh.numCollections, 1)
+        while gh.phase != IncrementalHeap.IDLE :
+            cells.append(gh.alloc())
+        # nothing is rooted in the global name table, so only the cells
+        # allocated black during the cycle are left
+        self.assertEqual(gh.get_count_allocated(), len(cells) - 1)
+
+    def test_incremental_cycles_start_from_build_list(self) :
+        gh = programextgc.GLOBAL_HEAP = IncrementalHeap(20, stepCells=4)
+        try:
+            # only list literals, which are built with alloc_many
+            for i in range(3) :
+                Sequence(elements=[Number(1), Number(2), Number(3)])
+            self.assertEqual(gh.numCollections, 0)
+            Sequence(elements=[Number(1), Number(2), Number(3)])
+            self.assertEqual(gh.numCollections, 1)
+            self.assertNotEqual(gh.phase, IncrementalHeap.IDLE)
+            # and finish it a step at a time, without a full collection
+            while gh.phase != IncrementalHeap.IDLE :
+                MiniLangUtils.pythonListToList([1, 2])
+            self.assertEqual(len(gh.stats.collections), 1)
+        finally:
+            del programextgc.GLOBAL_LITERALS[-4:]
+
+    def test_incremental_cycles_are_recorded(self) :
+        gh = IncrementalHeap(20, stepCells=4)
+        for i in range(100) :
+            gh.alloc()
+        # nothing is rooted, so only incremental cycles free cells
+        self.assertTrue(gh.numCollections > 1)
+        done = gh.numCollections
+        if gh.phase != IncrementalHeap.IDLE :
+            done -= 1
+        self.assertEqual(len(gh.stats.collections), done)
+        first = gh.stats.collections[0]
+        self.assertEqual(first['before'], 10)
+        self.assertTrue(first['after'] < first['before'])
+        self.assertTrue(0 < first['pause'])
+
+    def test_gc_stats(self) :
+        gh = Heap(4)
+        cells = [gh.alloc() for i in range(4)]
+        gh.collect({ 'a' : List(cons_cell=cells[0]) }, dict())
+        gh.alloc()
+        gh.collect(dict(), dict())
+        first, second = gh.stats.collections
+        self.assertEqual((first['before'], first['after'], first['freed']), (4, 1, 3))
+        self.assertEqual(first['allocated'], 4)
+        self.assertEqual(first['occupancyAfter'], 0.25)
+        self.assertEqual((second['before'], second['after'], second['allocated']), (2, 0, 1))
+
+        tmp = tempfile.mkdtemp()
+        try:
+            gh.stats.write(gh, os.path.join(tmp, 'gc.json'))
+            stats = json.load(open(os.path.join(tmp, 'gc.json')))
+            self.assertEqual(stats['summary']['collections'], 2)
+            self.assertEqual(stats['summary']['allocated'], 5)
+            gh.stats.write(gh, os.path.join(tmp, 'gc.csv'))
+            rows = list(csv.DictReader(open(os.path.join(tmp, 'gc.csv'))))
+            self.assertEqual([r['freed'] for r in rows], ['3', '2'])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_alloc_profiler(self) :
+        saved = programextgc.GLOBAL_HEAP
+        try:
+            for gh in [Heap(6), SemispaceHeap(6), GenerationalHeap(8, nurserySize=6)] :
+                programextgc.GLOBAL_HEAP = gh
+                gh.profiler = AllocProfiler()
+                site = FunCall('cons', [], lineno=3)
+                kept = BuiltIns.cons(Number(1), None, site)
+                kept = BuiltIns.cons(Number(2), kept, site)
+                for i in range(3) :
+                    BuiltIns.cons(Number(i), None, Concat(None, None, 5))
+                gh.collect({ 'a' : List(cons_cell=kept) }, dict())
+                self.assertEqual(gh.profiler.top_sites(),
+                                 [('Concat line 5', 3), ('cons() line 3', 2)])
+                self.assertEqual(gh.profiler.survived, { 'cons() line 3' : 2 })
+                self.assertEqual(gh.profiler.live, { 'cons() line 3' : 2 })
+        finally:
+            programextgc.GLOBAL_HEAP = saved
+
+    def test_proc_frames_and_literals_are_roots(self) :
+        saved = programextgc.GLOBAL_HEAP
+        gh = programextgc.GLOBAL_HEAP = Heap(4)
+        frame = { 'x' : List(cons_cell=gh.alloc()) }
+        programextgc.GLOBAL_FRAMES.append(frame)
+        try:
+            literal = Sequence(Number(1))
+            gh.alloc()
+            gh.collect(dict(), dict())
+            self.assertEqual(gh.get_count_allocated(), 2)
+        finally:
+            programextgc.GLOBAL_FRAMES.pop()
+            programextgc.GLOBAL_LITERALS.remove(literal.cons_cell)
+            programextgc.GLOBAL_HEAP = saved
+
+    def test_proc_variables_have_slots(self) :
+        saved = programextgc.GLOBAL_HEAP
+        gh = programextgc.GLOBAL_HEAP = Heap(4)
+        try:
+            body = StmtList()
+            body.insert(AssignStmt('return', Plus(Ident('t'), Ident('n'))))
+            body.insert(AssignStmt('t', Ident('n')))
+            proc = Proc(['n'], body)
+            self.assertEqual(proc.parSlots, [0])
+            self.assertEqual(proc.frame[-1], ['n', 'return', 't'])
+            # the body as written is left for display and the backends
+            self.assertEqual(body.sl[0].__class__, AssignStmt)
+            self.assertEqual(proc.frameBody.sl[0].slot, 2)
+            # t is read after it's assigned, so without looking for UNBOUND
+            self.assertEqual(proc.frameBody.sl[1].rhs.lhs.__class__,
+                             BoundIdent)
+            self.assertEqual(proc.apply(dict(x=4), dict(), [Ident('x')], gh), 8)
+
+            # a Frame's bound slots are roots; the unbound ones are skipped
+            frame = proc.frame[:]
+            frame[2] = List(cons_cell=gh.alloc())
+            gh.alloc()
+            programextgc.GLOBAL_FRAMES.append(frame)
+            try:
+                self.assertEqual(list(gh.roots(dict())), [frame[2].sequence.cons_cell])
+                gh.collect(dict(), dict())
+                self.assertEqual(gh.get_count_allocated(), 1)
+            finally:
+                programextgc.GLOBAL_FRAMES.pop()
+
+            # reading a variable before it's bound is a KeyError, as it is
+            # in a name table, including one only a branch assigns
+            body = StmtList()
+            body.insert(AssignStmt('return', Ident('u')))
+            self.assertRaises(KeyError, Proc(['n'], body).apply,
+                              dict(), dict(), [Number(1)], gh)
+            tBody = StmtList()
+            tBody.insert(AssignStmt('u', Number(1)))
+            body.insert(IfStmt(Ident('n'), tBody, StmtList()))
+            proc = Proc(['n'], body)
+            self.assertEqual(proc.frameBody.sl[1].rhs.__class__, LocalIdent)
+            self.assertEqual(proc.apply(dict(), dict(), [Number(1)], gh), 1)
+            self.assertRaises(KeyError, proc.apply,
+                              dict(), dict(), [Number(0)], gh)
+        finally:
+            programextgc.GLOBAL_HEAP = saved
+
+
+    def test_tail_calls_run_in_constant_stack(self) :
+        # deeper than the Python stack goes, unless the calls don't nest
+        source = '''define count
+proc( n, acc )
+  if n then return := count( n - 1, acc + 1 ) else return := acc fi
+end;
+x := count( %d, 0 )''' % (sys.getrecursionlimit() * 2)
+        for backend in ['eval', 'closure', 'vm', 'python'] :
+            self.run_source(source, backend)
+            self.assertEqual(programextgc.GLOBAL_NAME_TABLE['x'],
+                             sys.getrecursionlimit() * 2, backend)
+            self.assertEqual(programextgc.GLOBAL_FRAMES, [], backend)
+
+        # a tail call to a proc that makes none, and ones whose list
+        # arguments must be held while later ones allocate and collect
+        source = '''define last
+proc( l, k )
+  return := l
+end;
+define walk
+proc( l, n, g )
+  if n then return := walk( cons( 1, l ), n - 1, cons( 3, [] ) ) else return := last( l, cons( 2, [] ) ) fi
+end;
+x := walk( [], 12, [] )'''
+        # (the vm keeps its callers' name tables, and the garbage in them)
+        for backend in ['eval', 'closure', 'python'] :
+            self.run_source(source, backend)
+            self.assertEqual(str(programextgc.GLOBAL_NAME_TABLE['x']),
+                             "( 1 " * 12 + "nil" + " )" * 12, backend)
+            self.assertEqual(programextgc.GLOBAL_HEAP.numCollections, 1,
+                             backend)
+            self.assertEqual(programextgc.GLOBAL_FRAMES, [], backend)
+
+        # only a call nothing runs after is a tail call
+        tBody = StmtList()
+        tBody.insert(AssignStmt('return', FunCall('f', [Ident('n')])))
+        loop = StmtList()
+        loop.insert(AssignStmt('return', FunCall('f', [Ident('n')])))
+        body = StmtList()
+        body.insert(IfStmt(Ident('n'), tBody, StmtList()))
+        body.insert(WhileStmt(Ident('n'), loop))
+        # (a list of one statement is resolved to the statement)
+        frameBody = Proc(['n'], body).frameBody
+        self.assertEqual(frameBody.sl[0].body.__class__, LocalAssignStmt)
+        self.assertEqual(frameBody.sl[1].tBody.__class__, TailCallStmt)
+
+    def test_memoized_calls(self) :
+        source = '''define fib
+proc( n )
+  if n then
+    if n - 1 then return := fib( n - 1 ) + fib( n - 2 ) else return := 1 fi
+  else return := 1 fi
+end;
+x := fib( 20 )'''
+        memo = configure_memo(100)
+        self.run_source(source)
+        self.assertEqual(programextgc.GLOBAL_NAME_TABLE['x'], 10946)
+        # one call per n, the second call of each from the memo
+        self.assertEqual(memo.misses, 21)
+        self.assertEqual(memo.hits, 18)
+
+        # lists are keyed by their elements
+        a = MiniLangUtils.pythonListToList([1, [2, 3]])
+        b = MiniLangUtils.pythonListToList([1, [2, 3]])
+        c = MiniLangUtils.pythonListToList([1, [2]])
+        self.assertEqual(memo_key(a), memo_key(b))
+        self.assertNotEqual(memo_key(a), memo_key(c))
+        self.assertNotEqual(memo_key(a), memo_key(List()))
+
+        # longer ones by their first cell, until the heap's next epoch
+        saved = programextgc.GLOBAL_HEAP
+        gh = programextgc.GLOBAL_HEAP = ArrayHeap(100)
+        try:
+            elements = range(programextgc.MEMO_VALUE_CELLS + 1)
+            a = MiniLangUtils.pythonListToList(elements)
+            b = MiniLangUtils.pythonListToList(elements)
+            key = memo_key(a)
+            self.assertEqual(key, memo_key(List(cons_cell=BuiltIns.get_cell(a))))
+            self.assertNotEqual(key, memo_key(b))
+            gh.collect(dict(a=a, b=b), dict())
+            self.assertNotEqual(key, memo_key(a))
+        finally:
+            programextgc.GLOBAL_HEAP = saved
+
+        # the least recently used result goes first
+        memo = Memo(2)
+        memo.put(1, 1)
+        memo.put(2, 2)
+        memo.get(1)
+        memo.put(3, 3)
+        self.assertEqual(memo.results.keys(), [1, 3])
+        self.assertEqual(memo.evictions, 1)
+        # lists aren't kept
+        memo.put(4, a)
+        self.assertEqual(memo.get(4), UNBOUND)
+
+    def test_constant_folding(self) :
+        def stmts(*sl) :
+            stmtList = StmtList()
+            stmtList.sl = list(sl)
+            return stmtList
+        # x := 1 + 2 * 3; if 0 - 1 then a := 1 else a := 2 fi;
+        # while 0 do b := 1 od; c := intp(1 + 2)
+        program = Program(stmts(
+            AssignStmt('x', Plus(Number(1), Times(Number(2), Number(3)))),
+            IfStmt(Minus(Number(0), Number(1)),
+                   stmts(AssignStmt('a', Number(1))),
+                   stmts(AssignStmt('a', Number(2)))),
+            WhileStmt(Number(0), stmts(AssignStmt('b', Number(1)))),
+            AssignStmt('c', FunCall('intp', [Plus(Number(1), Number(2))]))))
+        self.assertEqual(constfold.fold_program(program), 17)
+        sl = program.stmtList.sl
+        self.assertEqual(len(sl), 3)
+        self.assertEqual(sl[0].rhs.__class__, Number)
+        self.assertEqual(sl[0].rhs.value, 7)
+        self.assertEqual(sl[1].name, 'a')
+        self.assertEqual(sl[1].rhs.value, 2)
+        # intp looks at its argument's node, which stays
+        self.assertEqual(sl[2].rhs.argList[0].__class__, Plus)
+
+        # a proc's frameBody is made again from its folded body
+        proc = Proc(['n'], stmts(
+            IfStmt(Number(1),
+                   stmts(AssignStmt('return', Plus(Ident('n'), Number(1)))),
+                   stmts(AssignStmt('t', Number(0))))))
+        program = Program(stmts(DefineStmt('f', proc)))
+        self.assertEqual(constfold.fold_program(program), 6)
+        self.assertEqual(proc.frame[-1], ['n', 'return'])
+        self.assertEqual(proc.apply(dict(), dict(), [Number(4)], None), 5)
+
 
 if __name__ == '__main__' :
     unittest.main()
@@ -25,8 +25,10 @@
 #   <listelement> -> <list>|NUMBER
 
 
+import os
 import sys
 from programext import *
+from tracing import TRACE
 
 # Debug Flag
 DEBUG = None
@@ -365,6 +367,13 @@ def main() :
         Will process file input or text input
         and will execute the scanner and the parser.
     """
+    # no command line options here, tracing is set from the environment
+    if os.environ.get('MINILANG_TRACE'):
+        TRACE.enable(os.environ['MINILANG_TRACE'])
+        if os.environ.get('MINILANG_TRACE_SIZE'):
+            TRACE.resize(int(os.environ['MINILANG_TRACE_SIZE']))
+        TRACE.install()
+
     data = []
     nArgs = len(sys.argv) - 1
     if nArgs == 1:
@@ -25,8 +25,16 @@
 #   <listelement> -> <list>|NUMBER
 
 
+import os
+import atexit
 import sys
+import argparse
 from programextgc import *
+from tracing import TRACE, CATEGORIES, parse_categories
+from closurecompiler import compile_program
+import stackvm
+import transpiler
+from constfold import fold_program
 
 # Debug Flag
 DEBUG = None
@@ -132,15 +140,33 @@ import ply.yacc as yacc
 # create a function for each production (note the prefix)
 # The rule is given in the doc string
 
+# how to run a parsed Program; main picks one with --backend
+BACKENDS = {
+    'eval' : lambda P : P.eval(),
+    'closure' : lambda P : compile_program(P).run(),
+    'vm' : lambda P : stackvm.run_program(P, cacheDir=VM_CACHE),
+    'python' : lambda P : transpiler.run_program(P, PYTHON_CACHE),
+}
+BACKEND = 'eval'
+# where the python and vm backends keep compiled programs, if anywhere
+PYTHON_CACHE = None
+VM_CACHE = None
+# whether constants are folded before the program runs
+FOLD = True
+
 def p_program( p ) :
     'program : stmt_list'
-    P = Program( p[1] )
+    P = Program( p[1], p.lexer.lexdata )
     P.display()
+    if FOLD :
+        removed = fold_program(P)
+        if removed :
+            log.info("Folding removed %d nodes" % removed)
     print 'Running Program'
-    P.eval()
+    BACKENDS[BACKEND](P)
     P.dump()
     # Note: Uncomment this line if you wish to see what garbage can be collected after execution
-    # GLOBAL_HEAP.collect(P.nameTable,P.funcTable)
+    # P.globalHeap.collect(P.nameTable,P.funcTable)
 
 def p_stmt_list( p ) :
     '''stmt_list : stmt SEMICOLON stmt_list
@@ -264,14 +290,15 @@ def p_param_list( p ) :
 def p_func_call( p ) :
     'func_call : IDENT LPAREN expr_list RPAREN'
     _debugMessage("p_func_call")
-    p[0] = FunCall( p[1], p[3] )
+    p[0] = FunCall( p[1], p[3], p.lineno(1) )
 
 
 # List parsing rules #
 def p_list_lbracket_sequence_rbracket(p):
     'list : LBRACKET sequence RBRACKET'
 #    print("p_list_lbracket_sequence_rbracket")
-    p[0] = List(p[2])
+    # the elements are consed into a list all at once
+    p[0] = List(Sequence(elements=p[2], lineno=p.lineno(1)))
     #p[0].registerWithHeap(globalHeap)
 
 def p_list_leftparen_rightparen(p):
@@ -283,13 +310,14 @@ def p_list_leftparen_rightparen(p):
 def p_sequence_element_comma_sequence(p):
     'sequence : element COMMA sequence'
 #    print("p_sequence_element_comma_sequence")
-    p[0] = Sequence(p[1],p[3])
+    p[3].insert(0, p[1])
+    p[0] = p[3]
 
 
 def p_sequence_element(p):
     'sequence : element'
 #    print("p_sequence_element")
-    p[0] = Sequence(p[1])
+    p[0] = [ p[1] ]
 
 
 def p_element_list(p):
@@ -307,11 +335,11 @@ def p_element_expr(p):
 def p_element_element_LISTCONCATENATOR_list(p):
     'element : element LISTCONCATENATOR list'
 #    print("p_list_element_LISTCONCATENATOR element")
-    p[0] = Concat(p[1],p[3])
+    p[0] = Concat(p[1],p[3], p.lineno(2))
 
 def p_element_element_LISTCONCATENATOR_fact(p):
     'element : element LISTCONCATENATOR fact'
-    p[0] = Concat(p[1], p[3])
+    p[0] = Concat(p[1], p[3], p.lineno(2))
 
 
 # Error rule for syntax errors
@@ -357,27 +385,197 @@ def test_parser(data) :
     :param data: string data from either
                  a file or text input.
     """
+    # test_scanner has already counted the lines once
+    lex.lexer.lineno = 1
     yacc.parse(data)
 
 
+# the options only one heap kind takes: (attribute, option, kind)
+KIND_OPTIONS = [
+    ('lazy_sweep', '--lazy-sweep', 'heap'),
+    ('nursery_size', '--nursery-size', 'generational'),
+    ('compact_at', '--compact-at', 'compact'),
+    ('gc_step_cells', '--gc-step-cells', 'incremental'),
+    ('gc_step_usec', '--gc-step-usec', 'incremental'),
+]
+
+def parse_args(argv) :
+    """ Parses the command line.  Each heap option defaults to
+    the environment variable named in its help, then to the
+    built in default.  Heap sizes and factors out of range, and
+    options the --heap-kind doesn't take, are errors.
+
+    :param argv: the arguments, without the program name.
+    """
+    env = os.environ
+    parser = argparse.ArgumentParser(
+        description="Mini language interpreter with garbage collection")
+    parser.add_argument('file', nargs='?',
+        help="program to run, read from stdin if not given")
+    parser.add_argument('--heap-size', type=int,
+        default=env.get('MINILANG_HEAP_SIZE', 20),
+        help="initial number of cells in the heap (MINILANG_HEAP_SIZE)")
+    parser.add_argument('--heap-max', type=int,
+        default=env.get('MINILANG_HEAP_MAX'),
+        help="most cells the heap may grow to, no growth if not set "
+             "(MINILANG_HEAP_MAX)")
+    parser.add_argument('--heap-growth', type=float,
+        default=env.get('MINILANG_HEAP_GROWTH', 2.0),
+        help="factor the heap grows by (MINILANG_HEAP_GROWTH)")
+    parser.add_argument('--heap-grow-at', type=float,
+        default=env.get('MINILANG_HEAP_GROW_AT', 0.75),
+        help="grow when more than this fraction of the heap is still in "
+             "use after a collection (MINILANG_HEAP_GROW_AT)")
+    parser.add_argument('--gc-percent', type=int,
+        default=env.get('MINILANG_GC_PERCENT'),
+        help="pace collections GOGC style: collect once the heap holds this "
+             "percent more cells than were live after the last collection, "
+             "growing up to --heap-max to make room (MINILANG_GC_PERCENT)")
+    parser.add_argument('--gc-fraction', type=float,
+        default=env.get('MINILANG_GC_FRACTION', 0.05),
+        help="with --gc-percent, the most of the run time collections "
+             "should take (MINILANG_GC_FRACTION)")
+    parser.add_argument('--heap-kind', choices=sorted(HEAP_KINDS.keys()),
+        default=env.get('MINILANG_HEAP_KIND', 'heap'),
+        help="heap implementation: heap (mark/sweep over cell objects), "
+             "array (mark/sweep over arrays), semispace (copying), "
+             "generational, incremental or compact (mark/compact) "
+             "(MINILANG_HEAP_KIND)")
+    parser.add_argument('--nursery-size', type=int,
+        default=env.get('MINILANG_NURSERY_SIZE'),
+        help="cells in the nursery of the generational heap, a quarter of "
+             "the heap if not set (MINILANG_NURSERY_SIZE)")
+    parser.add_argument('--gc-stats', metavar='FILE',
+        default=env.get('MINILANG_GC_STATS'),
+        help="write the heap's collection numbers to FILE at exit, as CSV if "
+             "it ends in .csv and JSON otherwise (MINILANG_GC_STATS)")
+    parser.add_argument('--alloc-profile', action='store_true',
+        default=bool(env.get('MINILANG_ALLOC_PROFILE')),
+        help="tag cells with the AST node and line that allocated them, log "
+             "the top allocation sites at each collection and print them at "
+             "exit (MINILANG_ALLOC_PROFILE)")
+    parser.add_argument('--lazy-sweep', action='store_true',
+        default=bool(env.get('MINILANG_LAZY_SWEEP')),
+        help="heap only marks when it collects, and sweeps as it allocates "
+             "(MINILANG_LAZY_SWEEP)")
+    parser.add_argument('--compact-at', type=float,
+        default=env.get('MINILANG_COMPACT_AT'),
+        help="the compact heap slides its live cells together when more "
+             "than this fraction of the cells below the last live one are "
+             "free (MINILANG_COMPACT_AT)")
+    parser.add_argument('--gc-step-cells', type=int,
+        default=env.get('MINILANG_GC_STEP_CELLS'),
+        help="cells the incremental heap marks or sweeps per allocation "
+             "(MINILANG_GC_STEP_CELLS)")
+    parser.add_argument('--gc-step-usec', type=float,
+        default=env.get('MINILANG_GC_STEP_USEC'),
+        help="microseconds the incremental heap may spend per allocation, "
+             "used instead of --gc-step-cells if set (MINILANG_GC_STEP_USEC)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS.keys()),
+        default=env.get('MINILANG_BACKEND', 'eval'),
+        help="how to run the program: eval walks the AST, closure compiles "
+             "it to python closures first, vm to bytecode for a stack "
+             "machine, python to python source (MINILANG_BACKEND)")
+    parser.add_argument('--python-cache', metavar='DIR',
+        default=env.get('MINILANG_PYTHON_CACHE'),
+        help="directory the python backend keeps compiled programs in, by "
+             "a hash of their source (MINILANG_PYTHON_CACHE)")
+    parser.add_argument('--vm-cache', metavar='DIR',
+        default=env.get('MINILANG_VM_CACHE'),
+        help="directory the vm backend keeps bytecode in, by a hash of the "
+             "program's source and the bytecode format (MINILANG_VM_CACHE)")
+    parser.add_argument('--memoize', metavar='SIZE', type=int,
+        default=env.get('MINILANG_MEMOIZE'),
+        help="keep the results of the last SIZE proc calls, by their "
+             "arguments, and reuse them for calls with equal ones; eval "
+             "backend only.  Each call costs a key: a list argument of up "
+             "to 16 cells is keyed by its elements, a longer one by its "
+             "first cell, so it only matches the same cells, until the next "
+             "collection.  The hits and misses are printed at exit "
+             "(MINILANG_MEMOIZE)")
+    parser.add_argument('--no-fold', action='store_true',
+        default=bool(env.get('MINILANG_NO_FOLD')),
+        help="run the program as parsed, without folding constant "
+             "arithmetic and the branches of ifs and whiles with constant "
+             "conditions first (MINILANG_NO_FOLD)")
+    parser.add_argument('--trace', metavar='CATEGORIES', type=parse_categories,
+        default=env.get('MINILANG_TRACE'),
+        help="comma separated trace categories to record, of %s, or all; "
+             "the last events are printed if the program fails "
+             "(MINILANG_TRACE)" % ', '.join(CATEGORIES))
+    parser.add_argument('--trace-size', type=int,
+        default=env.get('MINILANG_TRACE_SIZE', 5000),
+        help="trace events kept (MINILANG_TRACE_SIZE)")
+    args = parser.parse_args(argv)
+
+    if args.heap_size < 1:
+        parser.error("--heap-size must be at least 1")
+    if args.heap_max is not None and args.heap_max < args.heap_size:
+        parser.error("--heap-max must be at least --heap-size")
+    if args.heap_growth <= 1:
+        parser.error("--heap-growth must be more than 1")
+    if not 0 < args.heap_grow_at <= 1:
+        parser.error("--heap-grow-at must be more than 0 and at most 1")
+    for attr, option, kind in KIND_OPTIONS:
+        if getattr(args, attr) not in (None, False) and args.heap_kind != kind:
+            parser.error("%s is only for --heap-kind %s, not %s"
+                         % (option, kind, args.heap_kind))
+    return args
+
+
 def main() :
     """ Main method.
         Will process file input or text input
         and will execute the scanner and the parser.
     """
+    args = parse_args(sys.argv[1:])
+    options = dict()
+    if args.heap_kind == 'heap':
+        options['lazySweep'] = args.lazy_sweep
+    elif args.heap_kind == 'generational':
+        options['nurserySize'] = args.nursery_size
+    elif args.heap_kind == 'compact':
+        if args.compact_at is not None:
+            options['compactAt'] = args.compact_at
+    elif args.heap_kind == 'incremental':
+        if args.gc_step_usec is not None:
+            options['stepCells'] = None
+            options['stepMicros'] = args.gc_step_usec
+        elif args.gc_step_cells is not None:
+            options['stepCells'] = args.gc_step_cells
+    heap = configure_heap(args.heap_size, args.heap_max, args.heap_growth,
+                          args.heap_grow_at, args.heap_kind, args.gc_percent,
+                          args.gc_fraction, **options)
+    if args.gc_stats is not None:
+        atexit.register(heap.stats.write, heap, args.gc_stats)
+    if args.alloc_profile:
+        heap.profiler = AllocProfiler()
+        atexit.register(heap.profiler.report)
+    if args.memoize is not None:
+        memo = configure_memo(args.memoize)
+        atexit.register(memo.report)
+    global BACKEND, PYTHON_CACHE, VM_CACHE, FOLD
+    BACKEND = args.backend
+    PYTHON_CACHE = args.python_cache
+    VM_CACHE = args.vm_cache
+    FOLD = not args.no_fold
+    if args.trace:
+        TRACE.enable(args.trace)
+        TRACE.resize(args.trace_size)
+        TRACE.install()
+
     data = []
-    nArgs = len(sys.argv) - 1
-    if nArgs == 1:
+    if args.file is not None:
         # One argument, hopefully it a filename.
         # If not, it will error out when attempting
         # to open.
         try:
-            fSpec = sys.argv[1]
+            fSpec = args.file
             _debugMessage("Reading %s" % fSpec)
             data = open(fSpec, 'r').read()
         except Exception as e:
             print "({0}): {1}".format(type(e), e.message)
-    elif nArgs < 1:
+    else:
         # No Arguments, just enter manual mode.
         data=sys.stdin.read()
 
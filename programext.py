@@ -47,13 +47,14 @@
 #
 
 import sys
-import copy
 import itertools
 import logging
 
+from tracing import TRACE
+
 logging.basicConfig(
    format = "%(levelname) -4s %(message)s",
-   level = logging.DEBUG
+   level = logging.INFO
 )
 
 log = logging.getLogger('programext')
@@ -88,38 +89,24 @@ class Expr :
             'Expr.display: virtual method.  Must be overridden.' )
 
     def pythonListToList(self, inputList):
-        listLen = len(inputList)
-
-        outerSeq = None
-        i = 0
-        while( i < listLen) :
-
-            val = inputList[i]
+        # fill in the List's values directly; going through a Sequence per
+        # element nests them as deep as the list is long
+        createdList = List()
+        for val in inputList :
 
             # check to see if the current element is a native python type
 
             if isinstance(val,int) :
                 # convert to Number
-                currentElem = Number(val)
+                val = Number(val)
 
             elif isinstance(val, list) :
                 # convert to List
-                currentElem = self.pythonListToList(val)
-
-            else :
-                # it's not a native python type
-                currentElem = val
-
-            innerSeq = Sequence(currentElem)
-
-            if(outerSeq is not None) :
-                outerSeq = Sequence(outerSeq,innerSeq)
-            else :
-                outerSeq = Sequence(innerSeq)
-            i = (i+1)
+                val = self.pythonListToList(val)
 
-        createdList = List(outerSeq)
+            createdList.values.append(val)
 
+        createdList.constant = createdList.onlyConstants()
         return createdList
 
 
@@ -151,11 +138,23 @@ class List( Element ) :
 
     def __init__( self, s=None ) :
         self.values = list()
+        # another List whose elements follow these, shared, not copied
+        self.tail = None
         if(s is not None):
             if (isinstance(s,Sequence)) :
                 self.unPackSequence(s)
             else :
                 self.values.append(s)
+        self.constant = self.onlyConstants()
+
+    def onlyConstants( self ) :
+        '''True if the values are only Numbers and constant Lists: eval always
+        gives the same thing, so the List can be shared (see Concat)'''
+        for val in self.values :
+            if not (isinstance(val, Number) or
+                    (isinstance(val, List) and val.constant)) :
+                return False
+        return True
 
     def unPackSequence(self,seq):
         """ Loops through the sequence, pulling out
@@ -187,8 +186,18 @@ class List( Element ) :
                 self.values.append(val)
 
     def eval( self, nt, ft ) :
+        # walk the tails in a loop, a long chain of || would blow the stack
+        evaledList = list()
+        lst = self
+        while lst is not None :
+            evaledList.extend(lst.evalValues(nt, ft))
+            lst = lst.tail
+        return evaledList
 
-        evaledList = copy.deepcopy(self.values)
+    def evalValues( self, nt, ft ) :
+        'evaluates this List\'s own values, not its tail\'s'
+        # every value is replaced by what it evaluates to, so a shallow copy
+        evaledList = list(self.values)
         for i in xrange(len(evaledList)) :
             if evaledList[i] is not None:
                 if isinstance(evaledList[i], FunCall) :
@@ -204,13 +213,20 @@ class List( Element ) :
     def display( self, nt, ft, depth=0 ) :
         for val in self.values :
                 val.display(nt,ft,depth+1)
+        if self.tail is not None :
+            self.tail.display(nt,ft,depth)
 
     def __str__(self):
         '''Define a repr to have pretty printing of lists.  Otherwise, we get
         the memory addr, which doesn't work out so well when trying to compare
         test results.
         '''
-        return "List with %d elements" % len(self.values)
+        count = 0
+        lst = self
+        while lst is not None :
+            count += len(lst.values)
+            lst = lst.tail
+        return "List with %d elements" % count
 
 class Sequence( Expr ) :
 
@@ -342,24 +358,28 @@ class Concat( Expr ) :
             # only requires one-level of evaluation to get to the native python list
             lhsListEval = self.lhs.eval(nt, ft)
 
-        if isinstance(self.rhs, Ident) :
-            # since it's an Ident, it needs two-level evaluation to get to the native python list
-            rhsIdent = self.rhs.eval(nt, ft)
-            rhsListEval = rhsIdent.eval(nt, ft)
-            if not isinstance(rhsListEval, list) :
+        # a constant rhs is shared rather than copied, so it only needs to get
+        # as far as a List object; the new list's tail points at it
+        rhsList = self.rhs
+        if isinstance(self.rhs, Ident) or isinstance(self.rhs, FunCall) :
+            rhsList = self.rhs.eval(nt, ft)
+            if isinstance(rhsList, FunCall) :
+                # an Ident bound to a call that returns a native python list
+                rhsList = rhsList.eval(nt, ft)
+            if isinstance(rhsList, list) :
+                rhsList = self.pythonListToList(rhsList)
+        if not isinstance(rhsList, List) :
+            if isinstance(self.rhs, Ident) :
                 raise Exception("Identity must be a list for || operator")
-        elif isinstance(self.rhs, FunCall) :
-            # since it's a FunCall, it needs two-level evaluation to get to the native python list
-            rhsFunc = self.rhs.eval(nt, ft)
-            rhsListEval = rhsFunc.eval(nt, ft)
-            if not isinstance(rhsListEval, list) :
-                raise Exception("Function must return a List for || operator")
-        else :
-            # only requires one-level of evaluation to get to the native python list
-            rhsListEval = self.rhs.eval(nt, ft)
+            raise Exception("Function must return a List for || operator")
+        if not rhsList.constant :
+            # a literal with Idents or calls in it, which we have to freeze
+            rhsList = self.pythonListToList(rhsList.eval(nt, ft))
 
-        extendedList = lhsListEval + rhsListEval
-        return self.pythonListToList(extendedList)
+        # only the lhs is copied, so this costs len(lhs), however long rhs is
+        extendedList = self.pythonListToList(lhsListEval)
+        extendedList.tail = rhsList
+        return extendedList
 
 
 
@@ -507,6 +527,9 @@ class FunCall( Expr ):
 
     def eval( self, nt, ft ) :
         func = getattr(self, self.name, None)
+        if TRACE.call:
+            TRACE.event('call', "%s%s", self.name,
+                        " (builtin)" if func else "")
         # Is this function defined in this class?
         if func:
             # It is, so call it (like car, cdr, etc...)
@@ -553,6 +576,8 @@ class AssignStmt( Stmt ) :
         self.rhs = rhs
 
     def eval( self, nt, ft ) :
+        if TRACE.eval:
+            TRACE.event('eval', "assign %s", self.name)
         if(isinstance(self.rhs.eval(nt,ft),list)) :
             # We shouldn't eval the list at assignment time, per instructions
             nt[ self.name ] = self.rhs
@@ -47,12 +47,32 @@
 #
 
 import sys
+import csv
+import copy
+import json
+import collections
+import time
+import weakref
 import logging
+from array import array
+
+from tracing import TRACE
 
 
 GLOBAL_NAME_TABLE = dict()
 GLOBAL_FUNCTION_TABLE = dict()
 
+# GC roots besides GLOBAL_NAME_TABLE: the name tables of the procs being
+# applied, the list literals in the program, and the operands of a cons that
+# is allocating its cell
+GLOBAL_FRAMES = list()
+GLOBAL_LITERALS = list()
+GLOBAL_TEMP_ROOTS = list()
+
+# the Memo Proc.apply keeps proc results in, if calls are memoized (see
+# configure_memo)
+GLOBAL_MEMO = None
+
 logging.basicConfig(
    format = "%(levelname) -4s %(message)s",
    level = logging.INFO
@@ -66,6 +86,15 @@ log = logging.getLogger('programext')
 # the variable name used to store a proc's return value
 returnSymbol = 'return'
 
+# what a Frame's slot holds until something is bound to it
+UNBOUND = object()
+
+# the functions FunCall has methods for, unless a proc of the name is defined
+BUILTINS = ('car', 'cdr', 'nullp', 'listp', 'intp', 'cons')
+
+# bumped by define, so FunCalls look up what they call again
+defineEpoch = 0
+
 tabstop = '  ' # 2 spaces
 
 ##### General Helper Methods ########
@@ -74,51 +103,45 @@ class MiniLangUtils :
 
     @staticmethod
     def pythonListToList(inputList):
-        listLen = len(inputList)
-
-        outerSeq = None
-        i = 0
-        while( i < listLen) :
-
-            val = inputList[i]
+        '''Builds a List from a python list of ints, python lists and
+        mini language values, allocating each level in one go (see
+        BaseHeap.build_list)'''
+        elements = list()
+        for val in inputList :
 
             # check to see if the current element is a native python type
 
             if isinstance(val,int) :
                 # convert to Number
-                currentElem = Number(val)
+                elements.append(Number(val))
 
             elif isinstance(val, list) :
                 # convert to List
-                currentElem = MiniLangUtils.pythonListToList(val)
+                elements.append(MiniLangUtils.pythonListToList(val))
 
             else :
                 # it's not a native python type
-                currentElem = val
-
-            innerSeq = Sequence( currentElem)
-
-            if(outerSeq is not None) :
-                outerSeq = Sequence(outerSeq,innerSeq)
-            else :
-                outerSeq = Sequence(innerSeq)
-            i = (i+1)
-
-        createdList = List(outerSeq)
+                elements.append(val)
 
-        return createdList
+        if not elements :
+            return List()
+        return List(cons_cell=GLOBAL_HEAP.build_list(elements))
 
 ######  GARBAGE COLLECTION ##########
 
 class ConsCell:
-    def __init__(self):
+    '''heap and index say where the cell lives, so finding its HeapCell
+    doesn't need a search.  The cell's mark is kept by the heap.'''
+
+    def __init__(self, heap=None, index=None):
         self.__car = None
         self.__cdr = None
-        self.__mark = False
+        self.heap = heap
+        self.index = index
 
     @property
     def mark(self):
-        return self.__mark
+        return self.heap is not None and self.heap.is_marked(self.index)
 
     @property
     def car(self):
@@ -164,11 +187,11 @@ class ConsCell:
 
     @staticmethod
     def mark_cell(cell):
-        if not isinstance(cell, ConsCell):
-            return
-        cell.mark = True
-        ConsCell.mark_cell(cell.car)
-        ConsCell.mark_cell(cell.cdr)
+        '''Marks cell and everything reachable from it in its heap.
+        Returns the number of cells it marked.'''
+        if not isinstance(cell, ConsCell) or cell.heap is None:
+            return 0
+        return cell.heap.mark_from(cell.index)
 
     def __to_string(self, val):
         if val is None:
@@ -181,6 +204,20 @@ class ConsCell:
     def __str__(self):
         return "( %s %s )" % (self.__to_string(self.car), self.__to_string(self.cdr))
 
+    @staticmethod
+    def __brief(val):
+        if val is None:
+            return "nil"
+        elif isinstance(val, ConsCell):
+            return "#%s" % val.index
+        else:
+            return str(val)
+
+    def shallow(self):
+        '''the cell on its own, cells it points at shown as #index.  Unlike
+        str it doesn't walk the rest of the list, so it is cheap to trace'''
+        return "( %s %s )" % (self.__brief(self.car), self.__brief(self.cdr))
+
 
 
 
@@ -191,91 +228,1490 @@ class HeapCell:
         self.allocated = False
 
 
-class Heap :
+class HeapSizing :
+    '''The policy deciding when a heap collects and how it grows.
+    should_collect is asked before every alloc, new_size after every
+    collection that alloc runs.
 
-    def __init__( self, maxSize=100 ) :
-        self.cellHeap = list()
+    This one collects when the heap is full.  After a collection that
+    leaves more than growAt of the heap in use, the heap grows by
+    growthFactor, up to maxSize cells, rather than going straight back into
+    another collection.  With maxSize None the heap never grows.'''
+
+    def __init__( self, maxSize=None, growthFactor=2.0, growAt=0.75 ) :
         self.maxSize = maxSize
-        self.allocated = False
-        for i in range(maxSize):
-            self.cellHeap.append(HeapCell(ConsCell()))
+        self.growthFactor = growthFactor
+        self.growAt = growAt
+
+    def should_collect(self, heap):
+        return not heap.hasSpace()
+
+    def new_size(self, heap):
+        "the size heap should be after a collection"
+        if self.maxSize is None or heap.maxSize >= self.maxSize:
+            return heap.maxSize
+        if heap.get_count_allocated() <= self.growAt * heap.maxSize:
+            return heap.maxSize
+        grown = max(heap.maxSize + 1, int(heap.maxSize * self.growthFactor))
+        return min(self.maxSize, grown)
+
+
+class PacedSizing( HeapSizing ) :
+    '''GOGC style pacing.  After a collection leaving live cells in use,
+    the next one is due once the heap holds live * (1 + gcPercent / 100)
+    cells, growing the heap (up to maxSize) to make room.  The headroom is
+    also made big enough that, at the allocation rate and pause the heap's
+    stats measured for the last collection, collecting takes at most
+    gcFraction of the run time.  Until the first collection, and if the heap
+    can't grow, it collects when the heap is full.'''
+
+    def __init__( self, maxSize=None, gcPercent=100, gcFraction=0.05,
+                  growthFactor=2.0, minHeadroom=16 ) :
+        HeapSizing.__init__(self, maxSize, growthFactor)
+        self.gcPercent = gcPercent
+        self.gcFraction = gcFraction
+        self.minHeadroom = minHeadroom
+        self.trigger = None
+
+    def should_collect(self, heap):
+        if not heap.hasSpace():
+            return True
+        return self.trigger is not None and heap.get_count_allocated() >= self.trigger
+
+    def new_size(self, heap):
+        live = heap.get_count_allocated()
+        headroom = max(self.minHeadroom, live * self.gcPercent / 100)
+        if heap.stats.collections:
+            last = heap.stats.collections[-1]
+            # allocating headroom cells takes headroom / allocRate seconds,
+            # which should be at least pause * (1 - f) / f
+            paced = last['allocRate'] * last['pause'] * (1 - self.gcFraction) / self.gcFraction
+            headroom = max(headroom, int(paced))
+        target = live + headroom
+        size = heap.maxSize
+        if target > size and self.maxSize is not None and size < self.maxSize:
+            grown = max(target, int(size * self.growthFactor))
+            size = min(self.maxSize, grown)
+        self.trigger = min(target, size)
+        return size
+
+
+class GCStats :
+    '''Numbers on each collection of a heap, for charting GC behaviour.
+
+    collect calls record, which appends one dict with FIELDS to
+    collections: when it started (seconds since the heap was made), how
+    long it took, the heap size, the cells in use before and after (the
+    live cells) and freed, and the cells allocated since the previous
+    collection and how fast.  write saves them as JSON, with a summary, or
+    as CSV if the file name ends in .csv.'''
+
+    FIELDS = ['collection', 'time', 'pause', 'heapSize', 'before', 'after',
+              'freed', 'occupancyBefore', 'occupancyAfter', 'allocated',
+              'allocRate']
 
-    def hasSpace( self ) :
-        num_allocated = self.get_count_allocated()
-        return ( num_allocated < self.maxSize)
+    def __init__( self ) :
+        self.collections = list()
+        self.started = time.time()
+        self.lastEnd = self.started
+        self.lastAllocated = 0
+
+    def record(self, heap, start, end, before, after, pause=None):
+        '''records a collection of heap that ran from start to end, pausing
+        the program for pause seconds, all of it if pause is None'''
+        allocated = heap.totalAllocated - self.lastAllocated
+        elapsed = start - self.lastEnd
+        self.collections.append({
+            'collection' : len(self.collections) + 1,
+            'time' : start - self.started,
+            'pause' : end - start if pause is None else pause,
+            'heapSize' : heap.maxSize,
+            'before' : before,
+            'after' : after,
+            'freed' : before - after,
+            'occupancyBefore' : float(before) / heap.maxSize,
+            'occupancyAfter' : float(after) / heap.maxSize,
+            'allocated' : allocated,
+            'allocRate' : allocated / elapsed if elapsed > 0 else 0.0,
+        })
+        self.lastEnd = end
+        self.lastAllocated = heap.totalAllocated
+
+    def summary(self, heap):
+        pauses = [c['pause'] for c in self.collections]
+        runTime = time.time() - self.started
+        summary = {
+            'heap' : heap.__class__.__name__,
+            'heapSize' : heap.maxSize,
+            'collections' : len(pauses),
+            'totalPause' : sum(pauses),
+            'maxPause' : max(pauses) if pauses else 0.0,
+            'meanPause' : sum(pauses) / len(pauses) if pauses else 0.0,
+            'allocated' : heap.totalAllocated,
+            'runTime' : runTime,
+            'allocRate' : heap.totalAllocated / runTime if runTime > 0 else 0.0,
+        }
+        if hasattr(heap, 'generation_stats'):
+            summary['generations'] = heap.generation_stats()
+        return summary
+
+    def write(self, heap, path):
+        "writes the collections of heap to path"
+        f = open(path, 'wb' if path.endswith('.csv') else 'w')
+        try:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(f, self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self.collections)
+            else:
+                json.dump({ 'summary' : self.summary(heap),
+                            'collections' : self.collections },
+                          f, indent=2, sort_keys=True)
+                f.write('\n')
+        finally:
+            f.close()
+
+
+class AllocProfiler :
+    '''Counts the cells allocated at each allocation site, the AST node
+    (and its source line) whose eval, or list literal, called BuiltIns.cons.
+
+    Every cell is tagged with its site when it is allocated.  After each
+    collection the heap says where each tagged cell went (see
+    BaseHeap.relocated); allocated, survived and live count, per site, the
+    cells allocated, the ones that lived through at least one collection,
+    and the ones alive after the last collection.'''
+
+    def __init__( self, top=10 ) :
+        self.top = top
+        self.allocated = dict()
+        self.survived = dict()
+        self.live = dict()
+        # index -> site, for cells that haven't been through a collection
+        # yet, and for the ones that have
+        self.youngTags = dict()
+        self.oldTags = dict()
 
+    @staticmethod
+    def site_of(node):
+        if node is None:
+            return 'unknown'
+        name = node.__class__.__name__
+        if isinstance(node, FunCall):
+            name = '%s()' % node.name
+        return '%s line %s' % (name, getattr(node, 'lineno', None))
+
+    def tag(self, cell, node):
+        site = self.site_of(node)
+        self.allocated[site] = self.allocated.get(site, 0) + 1
+        self.oldTags.pop(cell.index, None)
+        self.youngTags[cell.index] = site
+
+    def collected(self, heap):
+        "moves the tags to where heap put the cells, dropping freed ones"
+        oldTags = dict()
+        live = dict()
+        for index, site in self.youngTags.iteritems():
+            index = heap.relocated(index)
+            if index is not None:
+                oldTags[index] = site
+                self.survived[site] = self.survived.get(site, 0) + 1
+        for index, site in self.oldTags.iteritems():
+            index = heap.relocated(index)
+            if index is not None:
+                oldTags[index] = site
+        for site in oldTags.itervalues():
+            live[site] = live.get(site, 0) + 1
+        self.youngTags = dict()
+        self.oldTags = oldTags
+        self.live = live
+        top = self.top_sites(3)
+        log.info("Top allocation sites: %s" % ', '.join(
+            ["%s (%s cells, %s survived)" % (site, n, self.survived.get(site, 0))
+             for site, n in top]))
+
+    def top_sites(self, n=None):
+        "the n sites that allocated the most cells, with their counts"
+        sites = sorted(self.allocated.iteritems(), key=lambda x: (-x[1], x[0]))
+        return sites[:n or self.top]
+
+    def report(self, out=sys.stderr):
+        out.write("%-30s %10s %10s %10s\n" % ("allocation site", "allocated",
+                                               "survived", "live"))
+        for site, n in self.top_sites():
+            out.write("%-30s %10d %10d %10d\n" % (site, n,
+                      self.survived.get(site, 0), self.live.get(site, 0)))
+
+
+class BaseHeap :
+    '''Virtual base class for heaps of cons cells.
+
+    A heap has maxSize cells, numAllocated of them in use.  alloc hands out
+    a free cell, collecting if there are none; after a collection the
+    heap's sizing decides whether it grows as well.  totalAllocated counts
+    every alloc, and stats (a GCStats) every collection.  If profiler (an
+    AllocProfiler) is set, BuiltIns.cons tags the cells with their
+    allocation site.
+
+    Cells aren't changed once built, and while freeEpoch stays the same
+    only garbage is freed or moved, so a live cell's index names the same
+    list until it changes.  collect moves it on, and so does anything else
+    that frees cells.'''
+
+    def __init__( self, maxSize, sizing=None ) :
+        self.maxSize = maxSize
+        self.numAllocated = 0
+        self.numCollections = 0
+        self.freeEpoch = 0
+        self.totalAllocated = 0
+        self.stats = GCStats()
+        self.profiler = None
+        if sizing is None:
+            sizing = HeapSizing()
+        self.sizing = sizing
 
-    def is_alloc(self, cons_cell):
-        for heap_cell in self.cellHeap:
-            if hex(id(cons_cell)) == hex(id(heap_cell.cell)):
-                return heap_cell.allocated
+    def hasSpace( self ) :
+        return self.numAllocated < self.maxSize
 
-        return False
+    def room(self):
+        "how many cells alloc can hand out before it has to collect"
+        return self.maxSize - self.numAllocated
 
-    def __find_available(self):
-        for cell in self.cellHeap:
-            if cell.allocated == False:
-                cell.cell.car = None
-                cell.cell.cdr = None
-                cell.allocated = True
-                log.debug("available cell: %s %s" % (hex(id(cell.cell)), cell.cell))
-                return cell.cell
+    def get_count_allocated(self):
+        return self.numAllocated
 
     def alloc(self):
         "retuns a ConsCell.  It may invoke GC"
 
-        if self.hasSpace():
-            log.debug("Num cells in use: %s" % self.get_count_allocated())
-            return self.__find_available()
-        else:
-            log.debug("out of memory, collecting...")
+        if self.sizing.should_collect(self):
+            if TRACE.gc:
+                TRACE.event('gc', "collecting with %s cells in use",
+                            self.get_count_allocated())
             self.collect(GLOBAL_NAME_TABLE, GLOBAL_FUNCTION_TABLE)
+            newSize = self.sizing.new_size(self)
+            if newSize > self.maxSize:
+                log.info("Growing heap from %s to %s cells" % (self.maxSize, newSize))
+                self.grow(newSize)
             if not self.hasSpace():
                 #still don't have enough memory...
                 raise MemoryError("Out of memory in the heap")
-            else:
-                return self.__find_available()
-
-    def get_count_allocated(self):
-        return len(filter(lambda x: x.allocated == True, self.cellHeap))
+        self.totalAllocated += 1
+        c = self.find_available()
+        if TRACE.alloc:
+            TRACE.event('alloc', "cell %s allocated", c.index)
+        return c
 
-    def print_cells(self):
-        for cell in self.cellHeap:
-            log.debug("Cell: %s is %s" % (hex(id(cell.cell)), cell.cell))
+    def alloc_many(self, n):
+        '''returns a list of n new cells.  Room for all of them is made up
+        front, collecting at most once, and growing the heap as far as the
+        sizing allows if the collection didn't free enough.'''
+        if self.room() < n or self.sizing.should_collect(self):
+            if TRACE.gc:
+                TRACE.event('gc', "collecting for %s cells", n)
+            self.collect(GLOBAL_NAME_TABLE, GLOBAL_FUNCTION_TABLE)
+            newSize = self.sizing.new_size(self)
+            needed = self.maxSize + n - self.room()
+            if newSize < needed and self.sizing.maxSize is not None:
+                newSize = max(newSize, min(needed, self.sizing.maxSize))
+            if newSize > self.maxSize:
+                log.info("Growing heap from %s to %s cells" % (self.maxSize, newSize))
+                self.grow(newSize)
+            if self.room() < n:
+                raise MemoryError("Out of memory in the heap")
+        self.totalAllocated += n
+        cells = [self.find_available() for i in xrange(n)]
+        if TRACE.alloc:
+            TRACE.event('alloc', "cells %s allocated",
+                        ' '.join([str(c.index) for c in cells]))
+        return cells
+
+    def max_reservation(self):
+        "the most cells alloc_many could hand out at once, None if no limit"
+        return None
+
+    def build_list(self, values, site=None, tail=None):
+        '''conses values (Numbers, Lists or cells) into a list in one go,
+        with one alloc_many and one pass linking the cells, and returns its
+        first cell, tail if there are no values.  The last cell's cdr is
+        tail, which is shared, not copied.  The values and tail are roots
+        while it allocates (only the cells need to be).  site is for the
+        profiler, as in BuiltIns.cons.
+
+        If there are more values than max_reservation, the list is built
+        from the back in pieces that size, the part built so far rooted.'''
+        values = [BuiltIns.get_cell(val) for val in values]
+        for val in values:
+            ConsCell.check_car(val)
+        tail = BuiltIns.get_cell(tail)
+        ConsCell.check_cdr(tail)
+        chunk = self.max_reservation() or len(values)
+
+        base = len(GLOBAL_TEMP_ROOTS)
+        GLOBAL_TEMP_ROOTS.extend([val for val in values
+            if isinstance(val, ConsCell)])
+        GLOBAL_TEMP_ROOTS.append(tail)
+        first = tail
+        try:
+            end = len(values)
+            while end > 0:
+                start = max(0, end - chunk)
+                cells = self.alloc_many(end - start)
+                chunk = self.max_reservation() or chunk
+                if first is not None and not self.is_alloc(first):
+                    raise MemoryError("Out of Memory")
+                for i in xrange(end - 1, start - 1, -1):
+                    val = values[i]
+                    if isinstance(val, ConsCell) and not self.is_alloc(val):
+                        raise MemoryError("Out of Memory")
+                    c = cells[i - start]
+                    c.car = val
+                    c.cdr = first
+                    self.write_barrier(c)
+                    if self.profiler is not None:
+                        self.profiler.tag(c, site)
+                    if TRACE.cons:
+                        TRACE.event('cons', "cell %s is %s", c.index,
+                                    c.shallow())
+                    first = c
+                GLOBAL_TEMP_ROOTS[-1] = first
+                end = start
+        finally:
+            del GLOBAL_TEMP_ROOTS[base:]
+        return first
+
+    def write_barrier(self, cell):
+        "called after cell's car or cdr has been set"
+        pass
+
+    def roots(self, nt):
+        '''the cells of this heap that the name table nt, the active procs'
+        name tables, list literals and cons operands refer to'''
+        for table in [nt] + GLOBAL_FRAMES:
+            if type(table) is list:
+                # a Frame: its slots by the names at its end; unbound ones
+                # hold UNBOUND, which isn't a cell
+                bindings = zip(table[-1], table)
+            else:
+                bindings = table.iteritems()
+            for name, val in bindings:
+                val = BuiltIns.get_cell(val)
+                if self.is_alloc(val):
+                    if TRACE.gc:
+                        TRACE.event('gc', "root %s is cell %s", name, val.index)
+                    yield val
+        for val in GLOBAL_LITERALS + GLOBAL_TEMP_ROOTS:
+            val = BuiltIns.get_cell(val)
+            if self.is_alloc(val):
+                yield val
 
     def collect(self, nt, ft):
         num_allocated_start = self.get_count_allocated()
         log.info("Starting GC with %s used cells" % num_allocated_start)
-        self.print_cells()
+        self.numCollections += 1
+        self.freeEpoch += 1
+        if TRACE.heap:
+            self.print_cells()
+
+        start = time.time()
+        self.reclaim(nt, ft)
+        end = time.time()
+
+        num_allocated_end = self.get_count_allocated()
+        self.stats.record(self, start, end, num_allocated_start, num_allocated_end)
+        if TRACE.gc:
+            TRACE.event('gc', "collection %s: %s cells in use, %s after, %.3f ms",
+                        self.numCollections, num_allocated_start,
+                        num_allocated_end, (end - start) * 1e3)
+        if self.profiler is not None:
+            self.profiler.collected(self)
+        log.info("Number of cells now allocated: %s" % num_allocated_end)
+        log.info("Freed %s cells" % (num_allocated_start -num_allocated_end) )
+
+    def find_available(self):
+        "takes a cell off the free cells; there must be one"
+        raise NotImplementedError(
+            'BaseHeap.find_available: virtual method.  Must be overridden.' )
+
+    def grow(self, newSize):
+        "adds free cells until the heap has newSize cells"
+        raise NotImplementedError(
+            'BaseHeap.grow: virtual method.  Must be overridden.' )
+
+    def relocated(self, index):
+        '''right after a collection, the index of the cell that was at index
+        before it, or None if the cell was freed'''
+        raise NotImplementedError(
+            'BaseHeap.relocated: virtual method.  Must be overridden.' )
+
+    def is_alloc(self, cons_cell):
+        raise NotImplementedError(
+            'BaseHeap.is_alloc: virtual method.  Must be overridden.' )
+
+    def reclaim(self, nt, ft):
+        "frees every cell that can't be reached from nt"
+        raise NotImplementedError(
+            'BaseHeap.reclaim: virtual method.  Must be overridden.' )
+
+    def print_cells(self):
+        raise NotImplementedError(
+            'BaseHeap.print_cells: virtual method.  Must be overridden.' )
+
+
+class Heap( BaseHeap ) :
+    '''A list of HeapCells.
+
+    With freeList set, unallocated cells are kept on a free list and the
+    number of allocated cells is kept in a running counter, so alloc,
+    hasSpace and get_count_allocated don't have to walk the heap.  Without
+    it, alloc scans for the first unallocated cell (first fit).
+
+    Marks live in the marks bytearray, outside the cells.  A cell is marked
+    when its byte equals markEpoch, so clearing every mark before a
+    collection is just moving on to the next epoch.
+
+    With lazySweep set, collect only marks.  alloc then sweeps forward from
+    sweepCursor to the next cell that isn't marked, which is either free or
+    garbage, so a collection only costs as much as the live cells and the
+    sweep is spread over the allocations after it.'''
 
+    def __init__( self, maxSize=100, freeList=True, sizing=None,
+                  lazySweep=False ) :
+        BaseHeap.__init__(self, maxSize, sizing)
+        self.cellHeap = list()
+        self.allocated = False
+        self.useFreeList = freeList
+        self.lazySweep = lazySweep
+        self.sweepCursor = 0
+        self.marks = bytearray(maxSize)
+        self.markEpoch = 1
+        for i in range(maxSize):
+            self.cellHeap.append(HeapCell(ConsCell(self, i)))
+        # popped from the end, so keep the lowest cell last
+        self.freeList = list(reversed(self.cellHeap))
+
+    def is_alloc(self, cons_cell):
+        if isinstance(cons_cell, ConsCell) and cons_cell.heap is self:
+            return self.cellHeap[cons_cell.index].allocated
+        return False
+
+    def is_marked(self, index):
+        return self.marks[index] == self.markEpoch
+
+    def relocated(self, index):
+        return index if self.is_marked(index) else None
+
+    def clear_marks(self):
+        "unmarks every cell by starting a new epoch"
+        self.markEpoch += 1
+        if self.markEpoch > 255:
+            # out of epochs, so clear the bytes for real
+            self.marks = bytearray(self.maxSize)
+            self.markEpoch = 1
+
+    def mark_from(self, index):
+        '''Marks cell index and everything reachable from it.  Uses a
+        worklist rather than recursion, so long and deeply nested lists
+        can't run out of Python stack.  Cells already marked aren't walked
+        again.  Returns the number of cells it marked.'''
+        marks = self.marks
+        epoch = self.markEpoch
+        if marks[index] == epoch:
+            return 0
+        marks[index] = epoch
+        stack = [self.cellHeap[index].cell]
+        count = 1
+        while stack:
+            cell = stack.pop()
+            car = cell.car
+            if isinstance(car, ConsCell) and marks[car.index] != epoch:
+                marks[car.index] = epoch
+                stack.append(car)
+                count += 1
+            cdr = cell.cdr
+            if isinstance(cdr, ConsCell) and marks[cdr.index] != epoch:
+                marks[cdr.index] = epoch
+                stack.append(cdr)
+                count += 1
+        return count
+
+    def find_available(self):
+        if self.lazySweep:
+            cell = self.sweep_to_unmarked()
+        elif self.useFreeList:
+            cell = self.freeList.pop()
+        else:
+            for cell in self.cellHeap:
+                if cell.allocated == False:
+                    break
+        cell.cell.car = None
+        cell.cell.cdr = None
+        cell.allocated = True
+        self.numAllocated += 1
+        return cell.cell
+
+    def sweep_to_unmarked(self):
+        '''sweeps from sweepCursor up to the first unmarked cell, and
+        returns it.  hasSpace means there is one.'''
+        marks = self.marks
+        epoch = self.markEpoch
+        i = self.sweepCursor
+        while marks[i] == epoch:
+            i += 1
+        cell = self.cellHeap[i]
+        if cell.allocated and TRACE.alloc:
+            TRACE.event('alloc', "cell %s freed: %s", cell.cell.index,
+                        cell.cell.shallow())
+        self.sweepCursor = i + 1
+        return cell
+
+    def finish_sweep(self):
+        "frees the garbage alloc hasn't swept up yet"
+        marks = self.marks
+        epoch = self.markEpoch
+        for cell in self.cellHeap[self.sweepCursor:]:
+            if cell.allocated and marks[cell.cell.index] != epoch:
+                if TRACE.alloc:
+                    TRACE.event('alloc', "cell %s freed: %s", cell.cell.index,
+                                cell.cell.shallow())
+                cell.allocated = False
+                cell.cell.car = None
+                cell.cell.cdr = None
+        self.sweepCursor = self.maxSize
+
+    def grow(self, newSize):
+        newCells = [HeapCell(ConsCell(self, i))
+                    for i in xrange(self.maxSize, newSize)]
+        self.cellHeap.extend(newCells)
+        self.marks.extend(bytearray(newSize - self.maxSize))
+        if not self.lazySweep:
+            newCells.reverse()
+            self.freeList.extend(newCells)
+        self.maxSize = newSize
+
+    def print_cells(self):
         for cell in self.cellHeap:
-            cell.cell.mark = False
+            TRACE.event('heap', "cell %s is %s", cell.cell.index,
+                        cell.cell.shallow())
 
-        for name in nt:
-            val = BuiltIns.get_cell(nt[name])
-            if isinstance(val, ConsCell):
-                log.debug("Found val %s" % val)
-                for cell in self.cellHeap:
-                    if hex(id(cell.cell)) == hex(id(val)):
-                        ConsCell.mark_cell(cell.cell)
+    def reclaim(self, nt, ft):
+        if self.lazySweep:
+            self.finish_sweep()
 
-        num_marked = len(filter(lambda x: x.cell.mark == True, self.cellHeap))
+        self.clear_marks()
+        num_marked = 0
+        for val in self.roots(nt):
+            num_marked += self.mark_from(val.index)
         log.info("Number of cells marked / total cells: %s / %s" % (num_marked, self.maxSize))
-        #Sweep
-        unmarked_list = filter(lambda x: x.cell.mark == False, self.cellHeap)
-        for unmarked in unmarked_list:
-            log.debug("freeing ConsCell: %s: %s" % (hex(id(unmarked.cell)), unmarked.cell))
-            unmarked.allocated = False
-            unmarked.cell.cell = None
-            unmarked.cell.cell = None
+        self.numAllocated = num_marked
 
-        num_allocated_end = self.get_count_allocated()
-        log.info("Number of cells now allocated: %s" % num_allocated_end)
-        log.info("Freed %s cells" % (num_allocated_start -num_allocated_end) )
+        if self.lazySweep:
+            # the cells that aren't marked get swept by alloc
+            self.sweepCursor = 0
+            return
+
+        #Sweep, rebuilding the free list from the unmarked cells, the
+        #lowest one last
+        marks = self.marks
+        epoch = self.markEpoch
+        freeList = list()
+        for cell in reversed(self.cellHeap):
+            if marks[cell.cell.index] != epoch:
+                if cell.allocated:
+                    if TRACE.alloc:
+                        TRACE.event('alloc', "cell %s freed: %s",
+                                    cell.cell.index, cell.cell.shallow())
+                    cell.allocated = False
+                    cell.cell.car = None
+                    cell.cell.cdr = None
+                freeList.append(cell)
+        self.freeList = freeList
+
+
+class ArrayCell( ConsCell, object ) :
+    '''A ConsCell living in an ArrayHeap.  It only holds the heap and the
+    cell's index; car, cdr and mark read and write the heap's arrays.  Two
+    ArrayCells are the same cell if they have the same heap and index.'''
+
+    def __init__( self, heap, index ) :
+        self.heap = heap
+        self.index = index
+
+    @property
+    def car(self):
+        return self.heap.get_field(self.index, 0)
+
+    @car.setter
+    def car(self, val):
+        self.heap.set_field(self.index, 0, val)
+
+    @property
+    def cdr(self):
+        return self.heap.get_field(self.index, 1)
 
+    @cdr.setter
+    def cdr(self, val):
+        self.heap.set_field(self.index, 1, val)
+
+    @property
+    def mark(self):
+        return self.heap.marks[self.index] == 1
+
+    @mark.setter
+    def mark(self, val):
+        self.heap.marks[self.index] = 1 if val else 0
+
+    def __eq__(self, other):
+        return (isinstance(other, ArrayCell) and other.heap is self.heap
+                and other.index == self.index)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self.heap), self.index))
+
+
+class ArrayHeap( BaseHeap ) :
+    '''Struct-of-arrays heap: the car and cdr of cell i are cars[i] and
+    cdrs[i] in two integer arrays, and its mark and allocated flags are bytes
+    in two bytearrays.  No Python object exists per cell; alloc hands out
+    ArrayCell handles.
+
+    car and cdr values are tagged integers:
+        0               nil
+        (n << 1) | 1    the small integer n, stored unboxed
+        (i << 2) | 2    cell i
+        4               a Number too big to tag, kept in self.boxed
+
+    Unallocated cells are chained through their cdr (as plain indices, -1
+    ends the chain), so the free list costs no extra memory.'''
+
+    NIL = 0
+    BOXED = 4
+
+    def __init__( self, maxSize=100, sizing=None ) :
+        BaseHeap.__init__(self, maxSize, sizing)
+        self.cars = array('l', [0]) * maxSize
+        self.cdrs = array('l', xrange(1, maxSize + 1))
+        if maxSize > 0:
+            self.cdrs[maxSize - 1] = -1
+        self.marks = bytearray(maxSize)
+        self.allocatedFlags = bytearray(maxSize)
+        self.boxed = dict()
+        self.freeHead = 0 if maxSize > 0 else -1
+        bits = self.cars.itemsize * 8
+        self.smallIntMax = 2 ** (bits - 2) - 1
+        self.smallIntMin = -(2 ** (bits - 2))
+
+    def cell(self, index):
+        "a handle on cell index"
+        return ArrayCell(self, index)
+
+    def encode(self, index, field, val):
+        if val is None:
+            return self.NIL
+        elif isinstance(val, ArrayCell) and val.heap is self:
+            return (val.index << 2) | 2
+        elif field == 0 and isinstance(val, Number):
+            if self.smallIntMin <= val.value <= self.smallIntMax:
+                return (val.value << 1) | 1
+            self.boxed[index * 2] = val
+            return self.BOXED
+        else:
+            raise Exception("Can not store %s in an ArrayHeap cell" % val)
+
+    def decode(self, index, field, tagged):
+        if tagged == self.NIL:
+            return None
+        elif tagged & 1:
+            return Number(tagged >> 1)
+        elif tagged & 3 == 2:
+            return self.cell(tagged >> 2)
+        else:
+            return self.boxed[index * 2 + field]
+
+    def get_field(self, index, field):
+        if field == 0:
+            return self.decode(index, 0, self.cars[index])
+        return self.decode(index, 1, self.cdrs[index])
+
+    def set_field(self, index, field, val):
+        if self.boxed:
+            self.boxed.pop(index * 2 + field, None)
+        if field == 0:
+            self.cars[index] = self.encode(index, 0, val)
+        else:
+            self.cdrs[index] = self.encode(index, 1, val)
+
+    def is_alloc(self, cons_cell):
+        if isinstance(cons_cell, ArrayCell) and cons_cell.heap is self:
+            return self.allocatedFlags[cons_cell.index] == 1
+        return False
+
+    def find_available(self):
+        index = self.freeHead
+        self.freeHead = self.cdrs[index]
+        self.cars[index] = self.NIL
+        self.cdrs[index] = self.NIL
+        self.allocatedFlags[index] = 1
+        self.numAllocated += 1
+        return self.cell(index)
+
+    def grow(self, newSize):
+        added = newSize - self.maxSize
+        self.cars.extend(array('l', [0]) * added)
+        # chain the new cells together, in front of the old free cells
+        self.cdrs.extend(array('l', xrange(self.maxSize + 1, newSize + 1)))
+        self.cdrs[newSize - 1] = self.freeHead
+        self.freeHead = self.maxSize
+        self.marks.extend(bytearray(added))
+        self.allocatedFlags.extend(bytearray(added))
+        self.maxSize = newSize
+
+    def print_cells(self):
+        for i in xrange(self.maxSize):
+            if self.allocatedFlags[i]:
+                TRACE.event('heap', "cell %s is %s", i, self.cell(i).shallow())
+
+    def is_marked(self, index):
+        return self.marks[index] == 1
+
+    def relocated(self, index):
+        return index if self.marks[index] else None
+
+    def mark_from(self, index):
+        '''Marks cell index and everything reachable from it.  Returns the
+        number of cells it marked.'''
+        cars = self.cars
+        cdrs = self.cdrs
+        marks = self.marks
+        if marks[index]:
+            return 0
+        marks[index] = 1
+        stack = [index]
+        count = 1
+        while stack:
+            i = stack.pop()
+            for tagged in (cars[i], cdrs[i]):
+                if tagged & 3 == 2:
+                    j = tagged >> 2
+                    if not marks[j]:
+                        marks[j] = 1
+                        stack.append(j)
+                        count += 1
+        return count
+
+    def mark_roots(self, nt):
+        "clears the marks and marks from the roots, returns the marked count"
+        self.marks = bytearray(self.maxSize)
+
+        num_marked = 0
+        for val in self.roots(nt):
+            num_marked += self.mark_from(val.index)
+
+        log.info("Number of cells marked / total cells: %s / %s" % (num_marked, self.maxSize))
+        return num_marked
+
+    def reclaim(self, nt, ft):
+        self.sweep(self.mark_roots(nt))
+
+    def sweep(self, num_marked):
+        "chains every unmarked cell onto the free list"
+        cars = self.cars
+        cdrs = self.cdrs
+        marks = self.marks
+        allocatedFlags = self.allocatedFlags
+        freeHead = -1
+        for i in xrange(self.maxSize - 1, -1, -1):
+            if not marks[i]:
+                if allocatedFlags[i]:
+                    allocatedFlags[i] = 0
+                    cars[i] = self.NIL
+                    if self.boxed:
+                        self.boxed.pop(i * 2, None)
+                cdrs[i] = freeHead
+                freeHead = i
+        self.freeHead = freeHead
+        self.numAllocated = num_marked
+
+
+class CompactingHeap( ArrayHeap ) :
+    '''An ArrayHeap that slides the live cells down to the front of the heap
+    once they have got too scattered (Lisp 2 style mark-compact), keeping
+    them in the same order.
+
+    After marking, fragmentation is the fraction of the cells up to the
+    last live one that are free.  If it is over compactAt, collect works
+    out each live cell's new index, rewrites the cars and cdrs that point
+    at cells, and slides the cells down; otherwise it sweeps like an
+    ArrayHeap.  As in SemispaceHeap the heap keeps one handle per cell and
+    moves it along with the cell, which is how the roots get rewritten.'''
+
+    def __init__( self, maxSize=100, sizing=None, compactAt=0.25 ) :
+        ArrayHeap.__init__(self, maxSize, sizing)
+        self.compactAt = compactAt
+        self.compactions = 0
+        self.handles = weakref.WeakValueDictionary()
+        # new index of each cell after the last compaction, -1 if freed
+        self.forward = None
+
+    def cell(self, index):
+        handle = self.handles.get(index)
+        if handle is None:
+            handle = ArrayCell(self, index)
+            self.handles[index] = handle
+        return handle
+
+    def relocated(self, index):
+        if self.forward is not None:
+            index = self.forward[index]
+            return index if index >= 0 else None
+        return ArrayHeap.relocated(self, index)
+
+    def fragmentation(self, num_marked):
+        "the fraction of the cells up to the last marked one that are free"
+        last = self.marks.rfind('\x01')
+        if last < 0:
+            return 0.0
+        return float(last + 1 - num_marked) / (last + 1)
+
+    def reclaim(self, nt, ft):
+        num_marked = self.mark_roots(nt)
+        fragmentation = self.fragmentation(num_marked)
+        if fragmentation > self.compactAt:
+            log.info("Compacting, %.0f%% fragmented" % (fragmentation * 100))
+            self.compact(num_marked)
+        else:
+            self.forward = None
+            self.sweep(num_marked)
+
+    def compact(self, num_marked):
+        "slides the marked cells down to 0..num_marked-1"
+        cars = self.cars
+        cdrs = self.cdrs
+        marks = self.marks
+        n = self.maxSize
+        BOXED = self.BOXED
+
+        forward = array('l', [-1]) * n
+        free = 0
+        for i in xrange(n):
+            if marks[i]:
+                forward[i] = free
+                free += 1
+
+        boxed = dict()
+        for i in xrange(n):
+            if not marks[i]:
+                continue
+            car = cars[i]
+            if car & 3 == 2:
+                car = (forward[car >> 2] << 2) | 2
+            elif car == BOXED:
+                boxed[forward[i] * 2] = self.boxed[i * 2]
+            cdr = cdrs[i]
+            if cdr & 3 == 2:
+                cdr = (forward[cdr >> 2] << 2) | 2
+            # forward[i] <= i, so this never overwrites a cell still to move
+            cars[forward[i]] = car
+            cdrs[forward[i]] = cdr
+
+        for j in xrange(free, n):
+            cars[j] = self.NIL
+            cdrs[j] = j + 1
+        if free < n:
+            cdrs[n - 1] = -1
+            self.freeHead = free
+        else:
+            self.freeHead = -1
+
+        handles = weakref.WeakValueDictionary()
+        for handle in self.handles.values():
+            if marks[handle.index]:
+                handle.index = forward[handle.index]
+                handles[handle.index] = handle
+        self.handles = handles
+
+        self.boxed = boxed
+        self.allocatedFlags = bytearray('\x01') * free + bytearray(n - free)
+        self.marks = bytearray(self.allocatedFlags)
+        self.forward = forward
+        self.numAllocated = num_marked
+        self.compactions += 1
+
+
+class SemispaceCell( ArrayCell ) :
+    '''An ArrayCell in a SemispaceHeap.  Collections move cells, so the heap
+    keeps one handle per cell and moves the handle with its cell.  A handle
+    also remembers the collection it was last valid in, so one left behind
+    on a cell that wasn't copied is stale.'''
+
+    def __init__( self, heap, index ) :
+        ArrayCell.__init__(self, heap, index)
+        self.epoch = heap.epoch
+
+
+class SemispaceHeap( ArrayHeap ) :
+    '''Cheney style copying collector over two ArrayHeap style spaces of
+    maxSize cells each.
+
+    alloc bumps a pointer through the current space.  collect copies the
+    cells reachable from the roots into the other space, forwarding each one
+    by overwriting its car with FORWARDED and its cdr with its new index,
+    then scans the copies to forward what they point to.  The spaces are then
+    swapped.  Only live cells are touched, garbage is never visited, and the
+    survivors end up packed at the front of the new space.
+
+    Every handle on a cell that was copied is moved along with it (see
+    SemispaceCell); handles on cells that weren't are stale, and is_alloc
+    says so.'''
+
+    FORWARDED = 8
+
+    def __init__( self, maxSize=100, sizing=None ) :
+        BaseHeap.__init__(self, maxSize, sizing)
+        self.cars = array('l', [0]) * maxSize
+        self.cdrs = array('l', [0]) * maxSize
+        self.toCars = array('l', [0]) * maxSize
+        self.toCdrs = array('l', [0]) * maxSize
+        self.boxed = dict()
+        self.epoch = 0
+        self.handles = weakref.WeakValueDictionary()
+        bits = self.cars.itemsize * 8
+        self.smallIntMax = 2 ** (bits - 2) - 1
+        self.smallIntMin = -(2 ** (bits - 2))
+
+    def cell(self, index):
+        handle = self.handles.get(index)
+        if handle is None:
+            handle = SemispaceCell(self, index)
+            self.handles[index] = handle
+        return handle
+
+    def is_alloc(self, cons_cell):
+        return (isinstance(cons_cell, SemispaceCell) and cons_cell.heap is self
+                and cons_cell.epoch == self.epoch
+                and cons_cell.index < self.numAllocated)
+
+    def find_available(self):
+        index = self.numAllocated
+        self.cars[index] = self.NIL
+        self.cdrs[index] = self.NIL
+        self.numAllocated += 1
+        return self.cell(index)
+
+    def grow(self, newSize):
+        added = array('l', [0]) * (newSize - self.maxSize)
+        for space in (self.cars, self.cdrs, self.toCars, self.toCdrs):
+            space.extend(added)
+        self.maxSize = newSize
+
+    def relocated(self, index):
+        # the old space is now toCars/toCdrs, with forwarding addresses
+        if self.toCars[index] == self.FORWARDED:
+            return self.toCdrs[index]
+        return None
+
+    def print_cells(self):
+        for i in xrange(self.numAllocated):
+            TRACE.event('heap', "cell %s is %s", i, self.cell(i).shallow())
+
+    def reclaim(self, nt, ft):
+        cars = self.cars
+        cdrs = self.cdrs
+        toCars = self.toCars
+        toCdrs = self.toCdrs
+        boxed = self.boxed
+        newBoxed = dict()
+        FORWARDED = self.FORWARDED
+        BOXED = self.BOXED
+        # the list is just a counter the nested function can update
+        free = [0]
+
+        def forward(tagged):
+            if tagged & 3 != 2:
+                return tagged
+            i = tagged >> 2
+            if cars[i] == FORWARDED:
+                return (cdrs[i] << 2) | 2
+            j = free[0]
+            free[0] = j + 1
+            car = cars[i]
+            toCars[j] = car
+            toCdrs[j] = cdrs[i]
+            if car == BOXED:
+                newBoxed[j * 2] = boxed[i * 2]
+            cars[i] = FORWARDED
+            cdrs[i] = j
+            return (j << 2) | 2
+
+        for root in list(self.roots(nt)):
+            forward((root.index << 2) | 2)
+
+        scan = 0
+        while scan < free[0]:
+            toCars[scan] = forward(toCars[scan])
+            toCdrs[scan] = forward(toCdrs[scan])
+            scan += 1
+
+        # move the handles on copied cells, the rest go stale
+        self.epoch += 1
+        handles = weakref.WeakValueDictionary()
+        for handle in self.handles.values():
+            if handle.epoch == self.epoch - 1 and cars[handle.index] == FORWARDED:
+                handle.index = cdrs[handle.index]
+                handle.epoch = self.epoch
+                handles[handle.index] = handle
+        self.handles = handles
+
+        log.info("Number of cells copied / total cells: %s / %s" % (free[0], self.maxSize))
+        self.cars, self.toCars = toCars, cars
+        self.cdrs, self.toCdrs = toCdrs, cdrs
+        self.boxed = newBoxed
+        self.numAllocated = free[0]
+
+
+class GenerationalCell( ArrayCell ) :
+    '''An ArrayCell in a GenerationalHeap.  Like a SemispaceCell, a handle
+    on a nursery cell is moved when its cell is promoted, and goes stale if
+    its cell dies in the nursery.'''
+
+    def __init__( self, heap, index ) :
+        ArrayCell.__init__(self, heap, index)
+        self.epoch = heap.epoch
+
+
+class GenerationalHeap( ArrayHeap ) :
+    '''Two generations in one set of ArrayHeap style arrays.  Cells
+    0..nurserySize-1 are the nursery, the rest are the old generation.
+
+    New cells are bumped out of the nursery.  When it fills, a minor
+    collection copies the nursery cells reachable from the roots, or from
+    old cells in the remembered set, into the old generation (every
+    survivor is promoted) and empties the nursery.  The old generation is
+    mark/swept like an ArrayHeap, in a major collection, only when it might
+    not have room for the nursery's survivors.
+
+    write_barrier records old cells that point into the nursery, so a minor
+    collection doesn't have to look at the rest of the old generation.
+
+    minorCollections/majorCollections count the collections of each kind,
+    and minorPauses/majorPauses hold how long each one took, in seconds.'''
+
+    def __init__( self, maxSize=100, sizing=None, nurserySize=None ) :
+        if nurserySize is None:
+            nurserySize = max(1, maxSize / 4)
+        if not 0 < nurserySize < maxSize:
+            raise ValueError("Nursery must be smaller than the heap")
+        BaseHeap.__init__(self, maxSize, sizing)
+        self.nurserySize = nurserySize
+        self.nurseryTop = 0
+        self.cars = array('l', [0]) * maxSize
+        self.cdrs = array('l', [0]) * nurserySize
+        self.cdrs.extend(array('l', xrange(nurserySize + 1, maxSize + 1)))
+        self.cdrs[maxSize - 1] = -1
+        self.freeHead = nurserySize
+        self.oldAllocated = 0
+        self.marks = bytearray(maxSize)
+        self.allocatedFlags = bytearray(maxSize)
+        self.boxed = dict()
+        self.remembered = set()
+        self.epoch = 0
+        self.handles = weakref.WeakValueDictionary()
+        self.minorCollections = 0
+        self.majorCollections = 0
+        self.minorPauses = list()
+        self.majorPauses = list()
+        self.promoted = 0
+        bits = self.cars.itemsize * 8
+        self.smallIntMax = 2 ** (bits - 2) - 1
+        self.smallIntMin = -(2 ** (bits - 2))
+
+    def cell(self, index):
+        if index >= self.nurserySize:
+            return GenerationalCell(self, index)
+        handle = self.handles.get(index)
+        if handle is None:
+            handle = GenerationalCell(self, index)
+            self.handles[index] = handle
+        return handle
+
+    def hasSpace( self ) :
+        return self.nurseryTop < self.nurserySize
+
+    def room(self):
+        return self.nurserySize - self.nurseryTop
+
+    def max_reservation(self):
+        # fill what's left of the nursery before forcing a minor collection
+        return self.room() or self.nurserySize
+
+    def is_alloc(self, cons_cell):
+        if not (isinstance(cons_cell, GenerationalCell) and cons_cell.heap is self):
+            return False
+        if cons_cell.index >= self.nurserySize:
+            return self.allocatedFlags[cons_cell.index] == 1
+        return (cons_cell.epoch == self.epoch
+                and cons_cell.index < self.nurseryTop)
+
+    def find_available(self):
+        index = self.nurseryTop
+        self.cars[index] = self.NIL
+        self.cdrs[index] = self.NIL
+        self.nurseryTop += 1
+        self.numAllocated += 1
+        return self.cell(index)
+
+    def write_barrier(self, cell):
+        index = cell.index
+        if index < self.nurserySize:
+            return
+        for tagged in (self.cars[index], self.cdrs[index]):
+            if tagged & 3 == 2 and (tagged >> 2) < self.nurserySize:
+                self.remembered.add(index)
+
+    def grow(self, newSize):
+        added = newSize - self.maxSize
+        self.cars.extend(array('l', [0]) * added)
+        self.cdrs.extend(array('l', xrange(self.maxSize + 1, newSize + 1)))
+        self.cdrs[newSize - 1] = self.freeHead
+        self.freeHead = self.maxSize
+        self.marks.extend(bytearray(added))
+        self.allocatedFlags.extend(bytearray(added))
+        self.maxSize = newSize
+
+    def relocated(self, index):
+        if index >= self.nurserySize:
+            return index if self.allocatedFlags[index] else None
+        if self.cars[index] == SemispaceHeap.FORWARDED:
+            return self.cdrs[index]
+        return None
+
+    def print_cells(self):
+        for i in xrange(self.nurseryTop):
+            TRACE.event('heap', "young cell %s is %s", i, self.cell(i).shallow())
+        for i in xrange(self.nurserySize, self.maxSize):
+            if self.allocatedFlags[i]:
+                TRACE.event('heap', "old cell %s is %s", i,
+                            self.cell(i).shallow())
+
+    def reclaim(self, nt, ft):
+        oldFree = self.maxSize - self.nurserySize - self.oldAllocated
+        if oldFree < self.nurseryTop:
+            start = time.time()
+            self.major(nt)
+            self.majorCollections += 1
+            self.majorPauses.append(time.time() - start)
+        start = time.time()
+        promoted = self.minor(nt)
+        self.minorCollections += 1
+        self.minorPauses.append(time.time() - start)
+        log.info("Promoted %s of %s nursery cells, %s old cells in use"
+                 % (promoted, self.nurserySize, self.oldAllocated))
+
+    def major(self, nt):
+        "mark/sweeps the old generation, leaving the nursery alone"
+        self.marks = bytearray(self.maxSize)
+        for val in self.roots(nt):
+            self.mark_from(val.index)
+
+        cars = self.cars
+        cdrs = self.cdrs
+        marks = self.marks
+        allocatedFlags = self.allocatedFlags
+        freeHead = -1
+        for i in xrange(self.maxSize - 1, self.nurserySize - 1, -1):
+            if not marks[i]:
+                if allocatedFlags[i]:
+                    allocatedFlags[i] = 0
+                    cars[i] = self.NIL
+                    if self.boxed:
+                        self.boxed.pop(i * 2, None)
+                cdrs[i] = freeHead
+                freeHead = i
+        self.freeHead = freeHead
+        self.oldAllocated = marks.count('\x01', self.nurserySize)
+        self.remembered = set(i for i in self.remembered if allocatedFlags[i])
+
+        liveYoung = marks.count('\x01', 0, self.nurseryTop)
+        oldFree = self.maxSize - self.nurserySize - self.oldAllocated
+        log.info("Major GC: %s old cells live, %s nursery cells live"
+                 % (self.oldAllocated, liveYoung))
+        if liveYoung > oldFree:
+            newSize = self.maxSize + liveYoung - oldFree
+            if self.sizing.maxSize is None or newSize > self.sizing.maxSize:
+                raise MemoryError("Out of memory in the heap")
+            self.grow(newSize)
+
+    def minor(self, nt):
+        "promotes the live nursery cells, returns how many there were"
+        cars = self.cars
+        cdrs = self.cdrs
+        boxed = self.boxed
+        allocatedFlags = self.allocatedFlags
+        nurserySize = self.nurserySize
+        FORWARDED = SemispaceHeap.FORWARDED
+        BOXED = self.BOXED
+        promoted = list()
+
+        def forward(tagged):
+            if tagged & 3 != 2 or (tagged >> 2) >= nurserySize:
+                return tagged
+            i = tagged >> 2
+            if cars[i] == FORWARDED:
+                return (cdrs[i] << 2) | 2
+            j = self.freeHead
+            if j == -1:
+                raise MemoryError("Out of memory in the heap")
+            self.freeHead = cdrs[j]
+            allocatedFlags[j] = 1
+            car = cars[i]
+            cars[j] = car
+            cdrs[j] = cdrs[i]
+            if car == BOXED:
+                boxed[j * 2] = boxed.pop(i * 2)
+            cars[i] = FORWARDED
+            cdrs[i] = j
+            promoted.append(j)
+            return (j << 2) | 2
+
+        for root in list(self.roots(nt)):
+            forward((root.index << 2) | 2)
+        for index in self.remembered:
+            cars[index] = forward(cars[index])
+            cdrs[index] = forward(cdrs[index])
+        scan = 0
+        while scan < len(promoted):
+            j = promoted[scan]
+            cars[j] = forward(cars[j])
+            cdrs[j] = forward(cdrs[j])
+            scan += 1
+
+        # move the handles on promoted cells, the rest go stale
+        for handle in self.handles.values():
+            if handle.epoch == self.epoch and cars[handle.index] == FORWARDED:
+                handle.index = cdrs[handle.index]
+        self.handles = weakref.WeakValueDictionary()
+        for key in [k for k in boxed if k < nurserySize * 2]:
+            del boxed[key]
+        self.epoch += 1
+        self.remembered = set()
+        self.nurseryTop = 0
+        self.oldAllocated += len(promoted)
+        self.numAllocated = self.oldAllocated
+        self.promoted += len(promoted)
+        return len(promoted)
+
+    def generation_stats(self):
+        "collection counts and pause times of each generation"
+        stats = dict()
+        for name, count, pauses in [
+                ('minor', self.minorCollections, self.minorPauses),
+                ('major', self.majorCollections, self.majorPauses)]:
+            stats[name] = {
+                'collections' : count,
+                'totalPause' : sum(pauses),
+                'maxPause' : max(pauses) if pauses else 0.0,
+            }
+        stats['promoted'] = self.promoted
+        return stats
+
+
+class IncrementalHeap( ArrayHeap ) :
+    '''An ArrayHeap whose mark and sweep are spread over allocations.
+
+    Once more than startAt of the heap is in use, alloc starts a cycle by
+    graying the roots, and from then on every alloc does a bounded step of
+    work: stepCells cells marked or swept, or as many as fit in stepMicros
+    microseconds.  Marking keeps the tri-color invariant (no black cell
+    points at a white one): cells allocated during a cycle are black, and
+    write_barrier, called by BuiltIns.cons, grays any white cell a new cell
+    points at.  When there are no gray cells left the roots are checked once
+    more and sweeping starts, a step at a time, from the bottom of the heap.
+
+    alloc_many starts cycles the same way, and does a step n times as big
+    for n cells.  A cycle started by an allocation is recorded in stats when
+    its sweep is done, from the cells in use when it started, its pause
+    being the time its steps took.
+
+    If the heap runs out before a cycle is over, collect finishes it in one
+    go, like ArrayHeap.collect would.'''
+
+    IDLE = 'idle'
+    MARKING = 'marking'
+    SWEEPING = 'sweeping'
+
+    def __init__( self, maxSize=100, sizing=None, stepCells=64,
+                  stepMicros=None, startAt=0.5 ) :
+        ArrayHeap.__init__(self, maxSize, sizing)
+        self.stepCells = stepCells
+        self.stepMicros = stepMicros
+        self.startAt = startAt
+        self.phase = self.IDLE
+        self.gray = list()
+        self.sweepCursor = 0
+        self.cycleRoots = None
+        # when the cycle started by an allocation began, the cells in use
+        # then, and the time its steps have taken; cycleStart is None if
+        # there is no such cycle
+        self.cycleStart = None
+        self.cycleBefore = 0
+        self.cyclePause = 0.0
+
+    def alloc(self):
+        self.start_if_due(1)
+        if self.phase != self.IDLE:
+            self.step()
+        return BaseHeap.alloc(self)
+
+    def alloc_many(self, n):
+        self.start_if_due(n)
+        if self.phase != self.IDLE:
+            self.step(cells=n)
+        return BaseHeap.alloc_many(self, n)
+
+    def start_if_due(self, n):
+        "starts a cycle if allocating n more cells takes the heap past startAt"
+        if self.phase != self.IDLE:
+            return
+        if self.numAllocated + n - 1 >= self.startAt * self.maxSize:
+            if TRACE.gc:
+                TRACE.event('gc', "starting incremental GC cycle")
+            self.numCollections += 1
+            self.cycleStart = time.time()
+            self.cycleBefore = self.numAllocated
+            self.start_cycle(GLOBAL_NAME_TABLE)
+            self.cyclePause = time.time() - self.cycleStart
+
+    def find_available(self):
+        cell = ArrayHeap.find_available(self)
+        if self.phase != self.IDLE:
+            # allocate black, so this cycle can't free it
+            self.marks[cell.index] = 1
+        return cell
+
+    def write_barrier(self, cell):
+        if self.phase != self.MARKING:
+            return
+        for tagged in (self.cars[cell.index], self.cdrs[cell.index]):
+            self.shade(tagged)
+
+    def shade(self, tagged):
+        "grays the cell tagged refers to if it is white"
+        if tagged & 3 == 2:
+            i = tagged >> 2
+            if not self.marks[i]:
+                self.marks[i] = 1
+                self.gray.append(i)
+
+    def start_cycle(self, nt):
+        self.marks = bytearray(self.maxSize)
+        self.gray = list()
+        self.cycleRoots = nt
+        for val in self.roots(nt):
+            self.shade((val.index << 2) | 2)
+        self.phase = self.MARKING
+
+    def budget_left(self, done, started, cells=1):
+        "whether a step for cells allocated cells may do more work"
+        if self.stepMicros is not None:
+            # only look at the clock every so often
+            if done & 31 == 0:
+                return (time.time() - started) * 1e6 < self.stepMicros * cells
+            return True
+        return self.stepCells is None or done < self.stepCells * cells
+
+    def step(self, unbounded=False, cells=1):
+        "does one bounded step of marking or sweeping, for cells allocations"
+        started = time.time()
+        done = 0
+        finished = False
+        cars = self.cars
+        cdrs = self.cdrs
+        gray = self.gray
+        while self.phase == self.MARKING and (unbounded or self.budget_left(done, started, cells)):
+            if not gray:
+                # remark: a root might have been assigned a white cell
+                for val in self.roots(self.cycleRoots):
+                    self.shade((val.index << 2) | 2)
+                if not gray:
+                    if TRACE.gc:
+                        TRACE.event('gc', "incremental GC marking done")
+                    self.phase = self.SWEEPING
+                    self.sweepCursor = 0
+                    # the sweep frees cells found white, which were live
+                    # when the cycle started
+                    self.freeEpoch += 1
+                    break
+            i = gray.pop()
+            self.shade(cars[i])
+            self.shade(cdrs[i])
+            done += 1
+        marks = self.marks
+        allocatedFlags = self.allocatedFlags
+        while self.phase == self.SWEEPING and (unbounded or self.budget_left(done, started, cells)):
+            i = self.sweepCursor
+            if allocatedFlags[i] and not marks[i]:
+                allocatedFlags[i] = 0
+                cars[i] = self.NIL
+                if self.boxed:
+                    self.boxed.pop(i * 2, None)
+                cdrs[i] = self.freeHead
+                self.freeHead = i
+                self.numAllocated -= 1
+            self.sweepCursor = i + 1
+            done += 1
+            if self.sweepCursor >= self.maxSize:
+                if TRACE.gc:
+                    TRACE.event('gc', "incremental GC sweeping done")
+                self.phase = self.IDLE
+                self.cycleRoots = None
+                finished = True
+        if self.cycleStart is not None:
+            end = time.time()
+            self.cyclePause += end - started
+            if finished:
+                # collect records the cycles it runs itself
+                self.stats.record(self, self.cycleStart, end, self.cycleBefore,
+                                  self.numAllocated, self.cyclePause)
+                self.cycleStart = None
+                if self.profiler is not None:
+                    self.profiler.collected(self)
+
+    def reclaim(self, nt, ft):
+        if self.phase != self.IDLE:
+            # finish the cycle in progress, then do a whole one from nt
+            self.step(unbounded=True)
+        self.start_cycle(nt)
+        self.step(unbounded=True)
+        log.info("Number of cells marked / total cells: %s / %s" % (self.numAllocated, self.maxSize))
+
+
+HEAP_KINDS = {
+    'heap' : Heap,
+    'array' : ArrayHeap,
+    'semispace' : SemispaceHeap,
+    'generational' : GenerationalHeap,
+    'incremental' : IncrementalHeap,
+    'compact' : CompactingHeap,
+}
 
 GLOBAL_HEAP = Heap(20)
 
+def configure_heap( size=20, maxSize=None, growthFactor=2.0, growAt=0.75,
+                    kind='heap', gcPercent=None, gcFraction=0.05, **options ) :
+    '''Replaces GLOBAL_HEAP with a heap of size cells, growing up to maxSize
+    cells (see HeapSizing, or PacedSizing if gcPercent is set).  kind picks
+    the implementation from HEAP_KINDS, options are passed on to its
+    constructor.  Must be called before any lists are parsed.'''
+    global GLOBAL_HEAP
+    if gcPercent is not None:
+        sizing = PacedSizing(maxSize, gcPercent, gcFraction, growthFactor)
+    else:
+        sizing = HeapSizing(maxSize, growthFactor, growAt)
+    GLOBAL_HEAP = HEAP_KINDS[kind](size, sizing=sizing, **options)
+    return GLOBAL_HEAP
+
 
 ######   CLASSES   ##################
 
@@ -338,8 +1774,7 @@ class List( Element ) :
         elif isinstance(s, Sequence) or s is None:
             self.sequence = s
         else:
-            log.debug("s: %s" % s)
-            raise TypeError
+            raise TypeError("Can't make a List of %s" % s)
 
     def unPackSequence(self,seq):
         """ Loops through the sequence, pulling out
@@ -394,14 +1829,21 @@ class List( Element ) :
 
 class Sequence( Expr ) :
 
-    def __init__( self, e=None, s=None, cons_cell=None ) :
+    def __init__( self, e=None, s=None, cons_cell=None, lineno=None,
+                  elements=None ) :
 
+        self.lineno = lineno
         if cons_cell is not None:
             self.cons_cell = cons_cell
-        elif s is None:
-            self.cons_cell = BuiltIns.cons(e, None)
         else:
-            self.cons_cell = BuiltIns.cons(e, s.cons_cell)
+            if elements is not None:
+                self.cons_cell = GLOBAL_HEAP.build_list(elements, self)
+            elif s is None:
+                self.cons_cell = BuiltIns.cons(e, None, self)
+            else:
+                self.cons_cell = BuiltIns.cons(e, s.cons_cell, self)
+            # a list literal, it lives as long as the program
+            GLOBAL_LITERALS.append(self.cons_cell)
 
     def eval( self, nt=None, ft=None ) :
         return ConsCell.eval(self.cons_cell)
@@ -437,6 +1879,28 @@ class Ident( Expr ) :
         print "%s%s" % (tabstop*depth, self.name)
 
 
+class LocalIdent( Ident ) :
+    '''An Ident in a proc body, read from its slot in the proc's Frame'''
+
+    def __init__( self, name, slot ) :
+        self.name = name
+        self.slot = slot
+
+    def eval( self, nt, ft, gh, UNBOUND=UNBOUND ) :
+        val = nt[ self.slot ]
+        if val is UNBOUND :
+            raise KeyError( self.name )
+        return val
+
+
+class BoundIdent( LocalIdent ) :
+    '''A LocalIdent whose slot is bound whenever it is read: a parameter,
+    or a variable every way to it through the body assigns (see Resolver)'''
+
+    def eval( self, nt, ft, gh ) :
+        return nt[ self.slot ]
+
+
 class Times( Expr ) :
     '''expression for binary multiplication'''
 
@@ -464,8 +1928,6 @@ class Plus( Expr ) :
         self.rhs = rhs
 
     def eval( self, nt, ft, gh ) :
-        log.debug("lhs is: "+str(self.lhs))
-        log.debug("rhs is: "+str(self.rhs))
         rhsEval = self.rhs.eval(nt,ft,gh)
         while(type(rhsEval) is not int) :
             rhsEval = rhsEval.eval(nt,ft,gh)
@@ -473,8 +1935,8 @@ class Plus( Expr ) :
         while(type(lhsEval) is not int) :
             lhsEval = lhsEval.eval(nt,ft,gh)
 
-        log.debug("lhsEval is: "+str(lhsEval))
-        log.debug("rhsEval is: "+str(rhsEval))
+        if TRACE.eval:
+            TRACE.event('eval', "%s + %s", lhsEval, rhsEval)
         return lhsEval + rhsEval
 
     def display( self, nt, ft, depth=0 ) :
@@ -502,9 +1964,10 @@ class Minus( Expr ) :
 class Concat( Expr ) :
     '''expression for list concatenation'''
 
-    def __init__( self, lhs, rhs ) :
+    def __init__( self, lhs, rhs, lineno=None ) :
         self.lhs = lhs
         self.rhs = rhs
+        self.lineno = lineno
 
     def eval( self, nt, ft, gh) :
         lhsList = self.lhs
@@ -513,12 +1976,35 @@ class Concat( Expr ) :
             lhsList = self.lhs.eval(nt,ft,gh)
 
         if(isinstance(self.rhs,Ident) or isinstance(self.rhs,FunCall)) :
-            rhsList = self.rhs.eval(nt,ft,gh)
+            return self.join_rooted(lhsList, self.rhs.eval, nt, ft, gh)
 
+        return self.join(lhsList, rhsList)
+
+    def join_rooted( self, lhsList, rhs, *args ) :
+        '''lhsList || rhs(*args), lhsList held in GLOBAL_TEMP_ROOTS while rhs
+        runs: nothing else refers to it, and rhs may collect'''
+        GLOBAL_TEMP_ROOTS.append(lhsList)
+        try:
+            rhsList = rhs(*args)
+        finally:
+            del GLOBAL_TEMP_ROOTS[-1]
+        return self.join(lhsList, rhsList)
+
+    def join( self, lhsList, rhsList ) :
+        'lhsList || rhsList, once the operands have been evaluated'
         if(not isinstance(lhsList,List) or not isinstance(rhsList,List)) :
             raise Exception("Can only concat Lists")
 
-        return List(cons_cell=BuiltIns.cons(lhsList, rhsList))
+        # copy the spine of the lhs, its last cell pointing at the rhs; if
+        # its first cell has been freed, so may the rest have been
+        lhsCars = []
+        cell = BuiltIns.get_cell(lhsList)
+        BuiltIns.check_alloc(cell)
+        while cell is not None:
+            lhsCars.append(cell.car)
+            cell = cell.cdr
+        return List(cons_cell=GLOBAL_HEAP.build_list(lhsCars, self,
+            tail=rhsList))
 
 
 
@@ -560,18 +2046,22 @@ class BuiltIns :
             return None
 
     @staticmethod
-    def cons(x, y) :
+    def cons(x, y, site=None) :
+        '''site is the AST node doing the cons, for GLOBAL_HEAP's
+        profiler'''
         x = BuiltIns.get_cell(x)
         y = BuiltIns.get_cell(y)
 
         ConsCell.check_car(x)
         ConsCell.check_cdr(y)
 
-        #Get new cons cell
-        c = GLOBAL_HEAP.alloc()
+        #Get new cons cell, keeping x and y alive if it collects
+        GLOBAL_TEMP_ROOTS.extend([x, y])
+        try:
+            c = GLOBAL_HEAP.alloc()
+        finally:
+            del GLOBAL_TEMP_ROOTS[-2:]
 
-        log.debug("x: %s" % x)
-        log.debug("y: %s" % y)
         #check to see if x and y are still good
         BuiltIns.check_alloc(x)
         BuiltIns.check_alloc(y)
@@ -579,15 +2069,19 @@ class BuiltIns :
 
         c.car = x
         c.cdr = y
+        GLOBAL_HEAP.write_barrier(c)
+        if GLOBAL_HEAP.profiler is not None:
+            GLOBAL_HEAP.profiler.tag(c, site)
 
-        log.debug("New cons: %s at: %s" % (c,hex(id(c))))
+        if TRACE.cons:
+            TRACE.event('cons', "cell %s is %s", c.index, c.shallow())
         return c
 
     @staticmethod
     def check_dup(x,y,c):
-        if isinstance(x,ConsCell) and hex(id(x)) == hex(id(c)):
+        if isinstance(x,ConsCell) and x == c:
             raise MemoryError("Heap returned same cell value")
-        if isinstance(y,ConsCell) and hex(id(y)) == hex(id(c)):
+        if isinstance(y,ConsCell) and y == c:
             raise MemoryError("Heap returned same cell value")
 
     @staticmethod
@@ -599,9 +2093,17 @@ class FunCall( Expr ):
     '''stores a function call:
       - its name, and arguments'''
 
-    def __init__( self, name, argList ) :
+    def __init__( self, name, argList, lineno=None ) :
         self.name = name
         self.argList = argList
+        self.lineno = lineno
+        # what the call runs (see resolve): a builtin (a bound method) or a
+        # Proc, looked up in the function table table when defineEpoch was
+        # epoch.  It holds while both still match.
+        self.builtin = None
+        self.proc = None
+        self.table = None
+        self.epoch = None
 
     def car( self, nt, ft, gh ) :
         if not(len(self.argList) == 1) :
@@ -719,7 +2221,7 @@ class FunCall( Expr ):
         elif isinstance(arg2,List):
             destList = arg2
 
-        return List(cons_cell=BuiltIns.cons(arg1, destList))
+        return List(cons_cell=BuiltIns.cons(arg1, destList, self))
 
 
 
@@ -728,16 +2230,34 @@ class FunCall( Expr ):
 
 
     def eval( self, nt, ft, gh ) :
-
-        func = getattr(self, self.name, None)
-        # Is this function defined in this class?
-        if func:
-            # It is, so call it (like car, cdr, etc...)
-            log.debug("Calling builtin")
-            return func(nt,ft, gh)
+        if self.epoch != defineEpoch or self.table is not ft :
+            self.resolve( ft )
+        if self.builtin is not None :
+            # a builtin, like car, cdr, etc...
+            if TRACE.call:
+                TRACE.event('call', "builtin %s", self.name)
+            return self.builtin(nt, ft, gh)
         # Otherwise, call the function from the function table
         else :
-            return ft[ self.name ].apply( nt, ft, self.argList, gh)
+            if TRACE.call:
+                TRACE.event('call', "%s line %s", self.name, self.lineno)
+            return self.proc.apply( nt, ft, self.argList, gh)
+
+    def resolve( self, ft ) :
+        '''looks up what this call runs: the proc the function table ft has
+        for its name, or the builtin method of the name if there is no such
+        proc.  It is kept until a define binds a name, or the call is
+        evaluated with another function table.'''
+        proc = ft.get( self.name )
+        if proc is None and self.name in BUILTINS :
+            self.builtin = getattr(self, self.name)
+        elif proc is None :
+            raise KeyError( self.name )
+        else :
+            self.builtin = None
+        self.proc = proc
+        self.table = ft
+        self.epoch = defineEpoch
 
 
     def display( self, nt, ft, depth=0 ) :
@@ -778,7 +2298,8 @@ class AssignStmt( Stmt ) :
         self.rhs = rhs
 
     def eval( self, nt, ft, gh ) :
-        log.debug("assign: "+str(self.name)+" to: "+str(self.rhs))
+        if TRACE.eval:
+            TRACE.event('eval', "assign %s", self.name)
         if(isinstance(self.rhs,List)) :
             nt[ self.name ] = self.rhs
         else :
@@ -789,6 +2310,61 @@ class AssignStmt( Stmt ) :
         self.rhs.display( nt, ft, depth+1 )
 
 
+class LocalAssignStmt( AssignStmt ) :
+    '''An AssignStmt in a proc body, binding a slot in the proc's Frame'''
+
+    def __init__( self, name, rhs, slot ) :
+        self.name = name
+        self.rhs = rhs
+        self.slot = slot
+
+    def eval( self, nt, ft, gh ) :
+        if TRACE.eval:
+            TRACE.event('eval', "assign %s", self.name)
+        nt[ self.slot ] = self.rhs.eval( nt, ft, gh )
+
+
+class LocalListAssignStmt( LocalAssignStmt ) :
+    '''A LocalAssignStmt of a list literal, which is bound as it is'''
+
+    def eval( self, nt, ft, gh ) :
+        if TRACE.eval:
+            TRACE.event('eval', "assign %s", self.name)
+        nt[ self.slot ] = self.rhs
+
+
+class TailCall :
+    '''What a TailCallStmt leaves in its proc's return slot: the proc it
+    calls, and the Frame with that call's arguments bound, for the caller's
+    apply to run.  The closure and python backends use it the same way, with
+    their own kind of body and frame (see closurecompiler, transpiler).'''
+
+    def __init__( self, proc, frame ) :
+        self.proc = proc
+        self.frame = frame
+
+
+class TailCallStmt( LocalAssignStmt ) :
+    '''A LocalAssignStmt of a call to return, when nothing in the proc runs
+    after it.  A call to a Proc isn't made here: its arguments are bound, and
+    a TailCall left in the return slot for Proc.apply, so tail recursion
+    doesn't nest apply calls, and runs in constant Python stack.'''
+
+    def eval( self, nt, ft, gh ) :
+        if TRACE.eval:
+            TRACE.event('eval', "assign %s", self.name)
+        call = self.rhs
+        if call.epoch != defineEpoch or call.table is not ft :
+            call.resolve( ft )
+        proc = call.proc
+        if call.builtin is not None or not isinstance(proc, Proc) :
+            nt[ self.slot ] = call.eval( nt, ft, gh )
+            return
+        if TRACE.call:
+            TRACE.event('call', "%s line %s", call.name, call.lineno)
+        nt[ self.slot ] = TailCall( proc, proc.bind( nt, ft, call.argList, gh ) )
+
+
 class DefineStmt( Stmt ) :
     '''Binds a proc object to a name'''
 
@@ -797,7 +2373,7 @@ class DefineStmt( Stmt ) :
         self.proc = proc
 
     def eval( self, nt, ft, gh ) :
-        ft[ self.name ] = self.proc
+        define( ft, self.name, self.proc )
 
     def display( self, nt, ft, depth=0 ) :
         print "%sDEFINE %s :" % (tabstop*depth, self.name)
@@ -868,6 +2444,211 @@ class StmtList :
             s.display( nt, ft, depth+1 )
 
 
+class Resolver :
+    '''Gives each of a proc's parameters, and each name its body assigns or
+    reads, a slot in its Frame, and copies the body with its Idents and
+    AssignStmts turned into LocalIdents and LocalAssignStmts for those
+    slots.  A Frame is a plain list (a subclass costs three times as much to
+    make and index): the variables by slot, then the list of their names,
+    for the collectors.  Slots nothing has been bound to hold UNBOUND.
+
+    The parameters get the first slots.  An Ident is a BoundIdent, which
+    doesn't look for UNBOUND, where its variable is bound on every way
+    there: a parameter, or one assigned before it and not only in a branch
+    of an if or in a while's body.  The body itself is left alone, for
+    display and the backends that compile it.  Defines in the body keep
+    their Procs, which are resolved on their own; list literals and numbers
+    aren't copied.'''
+
+    def __init__( self, parList ) :
+        # slot -> name, and name -> slot
+        self.names = list()
+        self.slots = dict()
+        self.parList = parList
+        self.parSlots = [ self.slot(name) for name in parList ]
+        self.returnSlot = self.slot(returnSymbol)
+        # the slots bound wherever resolve is
+        self.bound = set(self.parSlots)
+
+    def slot( self, name ) :
+        if name not in self.slots :
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def branch( self, node, tail=False ) :
+        '''node resolved as a body that might not run, leaving bound as it
+        was'''
+        bound = self.bound
+        self.bound = set(bound)
+        resolved = self.resolve(node, tail)
+        branchBound = self.bound
+        self.bound = bound
+        return resolved, branchBound
+
+    def resolve( self, node, tail=False ) :
+        '''node, or a copy of it addressing variables by slot.  tail says
+        nothing in the proc runs after node; a call assigned to return there
+        becomes a TailCallStmt.'''
+        if isinstance(node, StmtList) :
+            resolved = StmtList()
+            last = len(node.sl) - 1
+            resolved.sl = [ self.resolve(s, tail and i == last)
+                            for i, s in enumerate(node.sl) ]
+            if len(resolved.sl) == 1 :
+                # a Stmt evals as the list of just it would
+                return resolved.sl[0]
+        elif isinstance(node, AssignStmt) :
+            if isinstance(node.rhs, List) :
+                cls, rhs = LocalListAssignStmt, node.rhs
+            else :
+                rhs = self.resolve(node.rhs)
+                if (tail and node.name == returnSymbol
+                    and isinstance(rhs, FunCall)) :
+                    cls = TailCallStmt
+                else :
+                    cls = LocalAssignStmt
+            slot = self.slot(node.name)
+            self.bound.add(slot)
+            return cls(node.name, rhs, slot)
+        elif isinstance(node, Ident) :
+            slot = self.slot(node.name)
+            if slot in self.bound :
+                return BoundIdent(node.name, slot)
+            return LocalIdent(node.name, slot)
+        elif isinstance(node, IfStmt) :
+            resolved = copy.copy(node)
+            resolved.cond = self.resolve(node.cond)
+            resolved.tBody, tBound = self.branch(node.tBody, tail)
+            resolved.fBody, fBound = self.branch(node.fBody, tail)
+            self.bound = tBound & fBound
+        elif isinstance(node, WhileStmt) :
+            resolved = copy.copy(node)
+            resolved.cond = self.resolve(node.cond)
+            resolved.body = self.branch(node.body)[0]
+        elif (isinstance(node, Plus) or isinstance(node, Minus)
+              or isinstance(node, Times) or isinstance(node, Concat)) :
+            resolved = copy.copy(node)
+            resolved.lhs = self.resolve(node.lhs)
+            resolved.rhs = self.resolve(node.rhs)
+        elif isinstance(node, FunCall) :
+            resolved = copy.copy(node)
+            resolved.argList = [ self.resolve(arg) for arg in node.argList ]
+            resolved.epoch = None
+        else :
+            # Numbers, list literals, defines
+            return node
+        return resolved
+
+
+# lists of up to this many cells, nested ones included, are keyed by their
+# elements; longer ones by their first cell (see memo_key)
+MEMO_VALUE_CELLS = 16
+
+def memo_key( val ) :
+    '''a hashable stand in for a value passed to a proc, equal for equal
+    values: an int itself, a Number its value, a List of up to
+    MEMO_VALUE_CELLS cells a tuple with a key for each element, however its
+    cells are laid out.  A longer List is keyed by its first cell, with the
+    heap's freeEpoch (see BaseHeap), so that a memoized recursion down a list
+    doesn't walk the rest of it on every call; it only matches the same
+    cells.  Raises TypeError for anything else.'''
+    if isinstance(val, int) or isinstance(val, long) :
+        return val
+    elif isinstance(val, Number) :
+        return (Number, val.value)
+    elif isinstance(val, List) :
+        if val.sequence is None :
+            return (List, ())
+        cell = BuiltIns.get_cell(val)
+        try :
+            return (List, cells_key(cell, [MEMO_VALUE_CELLS]))
+        except OverflowError :
+            heap = cell.heap
+            return (List, heap, heap.freeEpoch, cell.index)
+    raise TypeError("Can't key %s" % val)
+
+def cells_key( cell, budget ) :
+    '''the elements of the list starting at cell as nested tuples, walking
+    the cdrs in a loop.  budget is a one element list of the cells that may
+    still be walked; OverflowError is raised when it runs out.'''
+    elements = list()
+    while cell is not None :
+        if isinstance(cell, Sequence) :
+            cell = cell.cons_cell
+            continue
+        budget[0] -= 1
+        if budget[0] < 0 :
+            raise OverflowError("list longer than %d cells" % MEMO_VALUE_CELLS)
+        car = cell.car
+        if isinstance(car, Sequence) or isinstance(car, ConsCell) :
+            elements.append(cells_key(car, budget))
+        elif isinstance(car, Number) :
+            elements.append((Number, car.value))
+        elif car is None :
+            elements.append(None)
+        else :
+            raise TypeError("Can't key %s" % car)
+        cell = cell.cdr
+    return tuple(elements)
+
+
+class Memo :
+    '''The results of proc calls, by the proc and the values of its
+    arguments (see memo_key), for the most recent size calls.
+
+    A proc only sees its arguments, so calling it again with equal ones
+    gives the same result, as long as the procs it calls are the same: a
+    define, or a different function table, empties the memo.  Only numbers
+    are kept; a list result would have to be a root for the collectors, and
+    follow its cells when they move.'''
+
+    def __init__( self, size=1000 ) :
+        self.size = size
+        # key -> result, least recently used first
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.table = None
+        self.epoch = None
+
+    def key( self, proc, frame, ft ) :
+        '''the key for a call to proc with its parameters bound in frame, or
+        None if one of them can't be keyed'''
+        if self.epoch != defineEpoch or self.table is not ft :
+            self.results.clear()
+            self.epoch = defineEpoch
+            self.table = ft
+        try :
+            return (proc,) + tuple([ memo_key(frame[slot])
+                                     for slot in proc.parSlots ])
+        except TypeError :
+            return None
+
+    def get( self, key ) :
+        '''the result kept for key, UNBOUND if there is none'''
+        result = self.results.pop(key, UNBOUND)
+        if result is UNBOUND :
+            self.misses += 1
+        else :
+            self.hits += 1
+            self.results[key] = result
+        return result
+
+    def put( self, key, result ) :
+        if not (isinstance(result, int) or isinstance(result, Number)) :
+            return
+        self.results[key] = result
+        if len(self.results) > self.size :
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def report( self, out=sys.stderr ) :
+        out.write("memo: %d hits, %d misses, %d evicted, %d kept\n"
+                  % (self.hits, self.misses, self.evictions, len(self.results)))
+
+
 class Proc :
     '''stores a procedure (formal params, and the body)
 
@@ -876,7 +2657,17 @@ class Proc :
     functions is legal, but no different than defining them all in the global
     environment.  Further, all calls are handled the same way, regardless of
     the calling environment (after the actual args are evaluated); the proc
-    doesn't need/want/get an outside environment.'''
+    doesn't need/want/get an outside environment.
+
+    Since a proc only sees its own variables, they are all known when it is
+    parsed, and a Resolver gives each a slot: a call's name table is a
+    Frame (see Resolver), a list with one entry per variable, and
+    frameBody, the body as apply runs it, reads and binds them by slot.
+    apply runs tail calls (see TailCallStmt) in its own loop.
+
+    The same goes for the procs a proc calls, so with calls memoized (see
+    configure_memo) apply looks for the result of a call in GLOBAL_MEMO
+    before running the body.'''
 
     def __init__( self, paramList, body ) :
         '''expects a list of formal parameters (variables, as strings), and a
@@ -884,30 +2675,79 @@ class Proc :
 
         self.parList = paramList
         self.body = body
-
-    def apply( self, nt, ft, args, gh ) :
-        newContext = {}
-
+        self.resolve()
+
+    def resolve( self ) :
+        '''numbers the variables of body, and makes frameBody from it.
+        Called again by anything that changes body.'''
+        resolver = Resolver( self.parList )
+        self.frameBody = resolver.resolve( self.body, True )
+        self.parSlots = resolver.parSlots
+        self.returnSlot = resolver.returnSlot
+        # a new call's Frame is a copy of this one
+        self.frame = [ UNBOUND ] * len( resolver.names ) + [ resolver.names ]
+
+    def bind( self, nt, ft, args, gh ) :
+        '''a new Frame for a call, pushed on GLOBAL_FRAMES, with the
+        parameters bound to args, evaluated in nt'''
         # sanity check, # of args
-        if len( args ) is not len( self.parList ) :
+        if len( args ) != len( self.parList ) :
             print "Param count does not match:"
             sys.exit( 1 )
 
-            # bind parameters in new name table (the only things there right now)
-            # use zip, bastard
-        for i in range( len( args )) :
-           if isinstance(args[i], List):
-               newContext[ self.parList[i] ] = args[i]
-           else:
-               newContext[ self.parList[i] ] = args[i].eval( nt, ft, gh )
+        newContext = self.frame[:]
 
-        # evaluate the function body using the new name table and the old (only)
-        # function table.  Note that the proc's return value is stored as
-        # 'return in its nametable
+        # the new name table holds GC roots while the proc runs
+        GLOBAL_FRAMES.append( newContext )
+        # bind parameters in new name table (the only things there right now);
+        # they have the first slots
+        slot = 0
+        for arg in args :
+           if isinstance(arg, List):
+               newContext[ slot ] = arg
+           else:
+               newContext[ slot ] = arg.eval( nt, ft, gh )
+           slot += 1
+        return newContext
 
-        self.body.eval( newContext, ft, gh )
-        if newContext.has_key( returnSymbol ) :
-            return newContext[ returnSymbol ]
+    def apply( self, nt, ft, args, gh ) :
+        base = len( GLOBAL_FRAMES )
+        proc = self
+        memo = GLOBAL_MEMO
+        # the keys of the calls the result is for, to memoize
+        keys = None
+        try :
+            newContext = self.bind( nt, ft, args, gh )
+
+            # evaluate the function body using the new name table and the old (only)
+            # function table.  Note that the proc's return value is stored as
+            # 'return in its nametable.  A tail call leaves a TailCall there
+            # instead, with its Frame pushed after this one, which is no
+            # longer needed: run the callee's body here in its place.
+            while True :
+                if memo is not None :
+                    key = memo.key( proc, newContext, ft )
+                    if key is not None :
+                        val = memo.get( key )
+                        if val is not UNBOUND :
+                            break
+                        if keys is None :
+                            keys = list()
+                        keys.append( key )
+                proc.frameBody.eval( newContext, ft, gh )
+                val = newContext[ proc.returnSlot ]
+                if val.__class__ is not TailCall :
+                    break
+                proc = val.proc
+                newContext = val.frame
+                del GLOBAL_FRAMES[ -2 ]
+        finally :
+            del GLOBAL_FRAMES[ base: ]
+        if val is not UNBOUND :
+            if keys is not None :
+                for key in keys :
+                    memo.put( key, val )
+            return val
         else :
             print "Error:  no return value"
             sys.exit( 2 )
@@ -920,8 +2760,12 @@ class Proc :
 
 class Program :
 
-    def __init__( self, stmtList) :
+    def __init__( self, stmtList, source=None ) :
         self.stmtList = stmtList
+        # the text it was parsed from, if known, and whether constfold has
+        # folded it since, for the backends that cache compiled code
+        self.source = source
+        self.folded = False
         self.nameTable = GLOBAL_NAME_TABLE
         self.funcTable = GLOBAL_FUNCTION_TABLE
         self.globalHeap = GLOBAL_HEAP
@@ -950,6 +2794,40 @@ class Program :
 
 # FUNCTIONS
 
+def configure_memo( size=None ) :
+    '''Has Proc.apply memoize calls in a Memo of the last size results, or
+    stop if size is None'''
+    global GLOBAL_MEMO
+    if size is None :
+        GLOBAL_MEMO = None
+    else :
+        GLOBAL_MEMO = Memo(size)
+    return GLOBAL_MEMO
+
+def define(ft, name, proc):
+    '''binds name to proc in the function table ft, and has every FunCall
+    look up what it calls again'''
+    global defineEpoch
+    ft[name] = proc
+    defineEpoch += 1
+
+def defined_names(stmt, names=None):
+    '''the names stmt, or the procs it defines, may define procs as'''
+    if names is None:
+        names = set()
+    if isinstance(stmt, StmtList):
+        for s in stmt.sl:
+            defined_names(s, names)
+    elif isinstance(stmt, DefineStmt):
+        names.add(stmt.name)
+        defined_names(stmt.proc.body, names)
+    elif isinstance(stmt, IfStmt):
+        defined_names(stmt.tBody, names)
+        defined_names(stmt.fBody, names)
+    elif isinstance(stmt, WhileStmt):
+        defined_names(stmt.body, names)
+    return names
+
 def evalIdent(ident, nt, ft, gh):
 
     orig = ident
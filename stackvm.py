@@ -0,0 +1,763 @@
+#!/usr/bin/python
+#
+# stackvm.py - compiles a programextgc Program to bytecode for a stack machine
+#
+# DESCRIPTION:
+#       Compiler turns a Program into a Code: the instructions of the main
+#       program and of each proc, and the constants they refer to.  An
+#       instruction is a tuple, its op then its operands, and everything in
+#       a Code is an int, a string, None or a tuple of those, so Code.dumps
+#       can write it out with marshal and a compiled program can be kept on
+#       disk and loaded again (Code.loads).
+#
+#       VM runs a Code against a name table and function table.  It has its
+#       own operand stack and call frames instead of recursing, so a call is
+#       a jump to the start of the proc's instructions and a return a jump
+#       back.  Each call still gets a name table of its own on GLOBAL_FRAMES
+#       while it runs, binding its arguments as they are evaluated, as
+#       Proc.apply does, so the collectors see the same roots.
+#
+#       Each op costs about as much as a node's eval, so the common shapes
+#       get ops of their own: an assignment of a sum, difference or product
+#       of Idents and Numbers is one instruction, and so is the test of a
+#       while loop on an Ident.  Idents and Numbers used as operands are kept
+#       in the instruction, a name as a string and a number as an int.
+#
+#       The ops do what the nodes' eval methods do, quirks included (intp
+#       looks at the argument's node, a literal in an expression evaluates
+#       to an empty python list, nullp of anything but an Ident, call or
+#       literal complains that car can only be called on a List, ...).  A
+#       call is a builtin if it names one of the six builtins and no proc of
+#       that name has been defined; the test for the proc is only compiled
+#       in where the program defines one.
+#
+#       List literals are constants, kept as nested tuples of their numbers.
+#       A Code compiled from a program uses the literals the parser built;
+#       one loaded from disk builds them when a VM is made for it.
+#
+#       load_code keeps Codes in a cache directory, under a hash of the
+#       program's source, whether it was folded (see constfold) and
+#       FORMAT_VERSION, so a program run again skips compiling.  The program
+#       was parsed all the same, so a Code from the cache shares the parsed
+#       literals rather than building its own.
+#
+
+import os
+import sys
+import marshal
+import hashlib
+
+from programextgc import ( Number, List, Sequence, Ident, Times, Plus, Minus,
+    Concat, FunCall, AssignStmt, DefineStmt, IfStmt, WhileStmt, StmtList,
+    BuiltIns, ConsCell, MiniLangUtils, GLOBAL_FRAMES, GLOBAL_LITERALS,
+    GLOBAL_TEMP_ROOTS, BUILTINS, returnSymbol, define, defined_names )
+from tracing import TRACE
+
+# bumped whenever the ops or constants change meaning
+FORMAT_VERSION = 3
+
+# what the files load_code keeps Codes in end in
+CACHE_SUFFIX = '.mlvm'
+
+# The ops, in the order the VM tests for them.  An operand called a leaf is
+# the name of an Ident (a string) or the value of a Number (an int).
+#   LOAD_NAME name              push nt[name]
+#   STORE_NAME name             pop into nt[name]
+#   SET_ADD name lhs rhs        nt[name] = lhs + rhs, for leaves lhs and rhs
+#   SET_SUB name lhs rhs        nt[name] = lhs - rhs
+#   SET_MUL name lhs rhs        nt[name] = lhs * rhs
+#   JUMP_IF_NAME_POS name to    jump to to if nt[name] > 0
+#   JUMP_IF_POS to              pop, jump if it's > 0
+#   LOAD_CONST k                push constant k
+#   ADD_LEAF leaf               leaf + the rhs on the stack
+#   ADD                         the lhs on the stack + the rhs under it
+#   SUB_LEAF leaf               the lhs on the stack - leaf
+#   MUL_LEAF leaf               the lhs on the stack * leaf
+#   SUB, MUL                    the rhs on the stack, the lhs under it
+#   JUMP_IF_NOT_POS to          pop, jump unless it's > 0
+#   JUMP to
+#   CALL_BEGIN name n lineno    find proc name, push a name table for it
+#   BIND_ARG i                  pop into the proc's i'th parameter
+#   CALL                        run the proc
+#   RETURN                      push its return value, back to the caller
+#   CDR mode, NULLP mode, CAR, LISTP
+#                               the builtins, on the top of the stack
+#   ROOT                        add the top of the stack to GLOBAL_TEMP_ROOTS,
+#                               until the CONCAT it is the lhs of
+#   CONS k, CONCAT k            cons and ||, site constant k
+#   SETUP_LISTP to              if listp's argument raises, push 0, go to to
+#   DEFINE k                    define the Function constant k
+#   RAISE message               raise an Exception
+#   HALT
+#   JUMP_IF_DEFINED name to     jump to to if there's a proc called name (a
+#                               call of a builtin the program may define)
+OPS = ( 'LOAD_NAME', 'STORE_NAME', 'SET_ADD', 'SET_SUB', 'SET_MUL',
+        'JUMP_IF_NAME_POS', 'JUMP_IF_POS', 'LOAD_CONST', 'ADD_LEAF', 'ADD',
+        'SUB_LEAF', 'MUL_LEAF', 'SUB', 'MUL', 'JUMP_IF_NOT_POS', 'JUMP',
+        'CALL_BEGIN', 'BIND_ARG', 'CALL', 'RETURN', 'CDR', 'NULLP', 'CAR',
+        'ROOT', 'CONS', 'CONCAT', 'SETUP_LISTP', 'LISTP', 'DEFINE', 'RAISE', 'HALT',
+        'JUMP_IF_DEFINED' )
+( LOAD_NAME, STORE_NAME, SET_ADD, SET_SUB, SET_MUL, JUMP_IF_NAME_POS,
+  JUMP_IF_POS, LOAD_CONST, ADD_LEAF, ADD, SUB_LEAF, MUL_LEAF, SUB, MUL,
+  JUMP_IF_NOT_POS, JUMP, CALL_BEGIN, BIND_ARG, CALL, RETURN, CDR, NULLP, CAR,
+  ROOT, CONS, CONCAT, SETUP_LISTP, LISTP, DEFINE, RAISE, HALT,
+  JUMP_IF_DEFINED ) = range(len(OPS))
+
+# the ops whose operand is a constant's index
+CONST_OPS = ( LOAD_CONST, CONS, CONCAT, DEFINE )
+
+# NULLP's operand: how car would have treated nullp's argument
+NULLP_LIST, NULLP_NOT_LIST, NULLP_ARG_COUNT = range(3)
+
+# CDR's operand: whether the argument was an Ident (see evalIdent)
+CDR_VALUE, CDR_IDENT = range(2)
+
+tabstop = '  ' # 2 spaces
+
+
+class Function :
+    '''a proc as the VM runs it, what DEFINE puts in the function table'''
+
+    def __init__( self, name, parList, unit ) :
+        self.name = name
+        self.parList = list(parList)
+        self.unit = unit
+
+
+class Code :
+    '''A compiled program: units[0] is the main program's instructions, the
+    others the procs', and consts the constants they refer to by index.
+    objects holds, by index, constants already built by the parser; it isn't
+    written out.'''
+
+    def __init__( self, units, consts, objects=None ) :
+        self.units = units
+        self.consts = consts
+        self.objects = objects or dict()
+
+    def dumps( self ) :
+        return marshal.dumps((FORMAT_VERSION, self.units, self.consts))
+
+    @staticmethod
+    def loads( data ) :
+        version, units, consts = marshal.loads(data)
+        if version != FORMAT_VERSION :
+            raise ValueError("Bytecode format %s, expected %s"
+                             % (version, FORMAT_VERSION))
+        return Code(units, consts)
+
+    def display( self ) :
+        for unit, instructions in enumerate(self.units) :
+            print "UNIT %s" % unit
+            for pc, ins in enumerate(instructions) :
+                operands = list(ins[1:])
+                if ins[0] in CONST_OPS :
+                    operands = [self.consts[operands[0]]]
+                print "%s%4d %-16s %s" % (tabstop, pc, OPS[ins[0]],
+                    ' '.join([str(x) for x in operands]))
+
+
+def _leaf( expr ) :
+    'an Ident or Number as an operand, None for anything else'
+    if isinstance(expr, Ident) :
+        return expr.name
+    elif isinstance(expr, Number) :
+        return expr.value
+    return None
+
+
+class Compiler :
+    '''Compiles a Program's statements, and the Procs defined in them, into
+    a Code'''
+
+    def __init__( self ) :
+        self.units = [None]
+        self.consts = list()
+        self.objects = dict()
+        # Proc -> unit
+        self.procs = dict()
+        self.shadowed = set()
+        self.code = None
+
+    def compile( self, program ) :
+        # the builtins a proc may be defined over
+        self.shadowed = defined_names(program.stmtList) & set(BUILTINS)
+        self.code = list()
+        self.compile_stmt(program.stmtList)
+        self.emit(HALT)
+        self.units[0] = tuple(self.code)
+        return Code(tuple(self.units), tuple(self.consts), self.objects)
+
+    def emit( self, op, *operands ) :
+        'appends an instruction, returning where it is, for patch'
+        self.code.append((op,) + operands)
+        return len(self.code) - 1
+
+    def patch( self, where ) :
+        'points the jump at where (its last operand) at the next instruction'
+        self.code[where] = self.code[where][:-1] + (len(self.code),)
+
+    def const( self, value, obj=None ) :
+        '''the index of a new constant; obj is what it stands for, if that's
+        already been built'''
+        self.consts.append(value)
+        index = len(self.consts) - 1
+        if obj is not None :
+            self.objects[index] = obj
+        return index
+
+    def literal( self, lst ) :
+        'the constant for the list literal lst'
+        return self.const(literal_data(lst), lst)
+
+    ######   STATEMENTS   ##########
+
+    def compile_stmt( self, stmt ) :
+        if isinstance(stmt, StmtList) :
+            for s in stmt.sl :
+                self.compile_stmt(s)
+        elif isinstance(stmt, AssignStmt) :
+            self.compile_assign(stmt)
+        elif isinstance(stmt, DefineStmt) :
+            unit = self.compile_proc(stmt.proc)
+            self.emit(DEFINE, self.const(('function', stmt.name,
+                                          tuple(stmt.proc.parList), unit)))
+        elif isinstance(stmt, IfStmt) :
+            self.compile_expr(stmt.cond)
+            toElse = self.emit(JUMP_IF_NOT_POS, None)
+            self.compile_stmt(stmt.tBody)
+            toEnd = self.emit(JUMP, None)
+            self.patch(toElse)
+            self.compile_stmt(stmt.fBody)
+            self.patch(toEnd)
+        elif isinstance(stmt, WhileStmt) :
+            # the test goes after the body, so each pass is one jump
+            toCond = self.emit(JUMP, None)
+            top = len(self.code)
+            self.compile_stmt(stmt.body)
+            self.patch(toCond)
+            if isinstance(stmt.cond, Ident) :
+                self.emit(JUMP_IF_NAME_POS, stmt.cond.name, top)
+            else :
+                self.compile_expr(stmt.cond)
+                self.emit(JUMP_IF_POS, top)
+        else :
+            raise TypeError("Can't compile %s" % stmt.__class__.__name__)
+
+    def compile_assign( self, stmt ) :
+        rhs = stmt.rhs
+        if isinstance(rhs, List) :
+            # a list literal is bound as it is
+            self.emit(LOAD_CONST, self.literal(rhs))
+        elif isinstance(rhs, (Plus, Minus, Times)) :
+            lhsLeaf = _leaf(rhs.lhs)
+            rhsLeaf = _leaf(rhs.rhs)
+            if lhsLeaf is not None and rhsLeaf is not None :
+                op = { Plus : SET_ADD, Minus : SET_SUB, Times : SET_MUL }
+                self.emit(op[rhs.__class__], stmt.name, lhsLeaf, rhsLeaf)
+                return
+            self.compile_expr(rhs)
+        else :
+            self.compile_expr(rhs)
+        self.emit(STORE_NAME, stmt.name)
+
+    def compile_proc( self, proc ) :
+        if proc not in self.procs :
+            self.units.append(None)
+            unit = self.procs[proc] = len(self.units) - 1
+            outer = self.code
+            self.code = list()
+            self.compile_stmt(proc.body)
+            self.emit(RETURN)
+            self.units[unit] = tuple(self.code)
+            self.code = outer
+        return self.procs[proc]
+
+    ######   EXPRESSIONS   #########
+
+    def compile_expr( self, expr ) :
+        'code leaving what expr.eval would return on the stack'
+        if isinstance(expr, Number) :
+            self.emit(LOAD_CONST, self.const(expr.value))
+        elif isinstance(expr, Ident) :
+            self.emit(LOAD_NAME, expr.name)
+        elif isinstance(expr, Plus) :
+            # Plus evaluates its rhs first; adding ints, the order of the
+            # operands doesn't matter
+            self.compile_expr(expr.rhs)
+            self.compile_arith(expr.lhs, ADD, ADD_LEAF)
+        elif isinstance(expr, Minus) :
+            self.compile_expr(expr.lhs)
+            self.compile_arith(expr.rhs, SUB, SUB_LEAF)
+        elif isinstance(expr, Times) :
+            self.compile_expr(expr.lhs)
+            self.compile_arith(expr.rhs, MUL, MUL_LEAF)
+        elif isinstance(expr, Concat) :
+            # the stack isn't a root: the lhs is rooted while the rhs runs
+            self.compile_operand(expr.lhs)
+            self.emit(ROOT)
+            self.compile_operand(expr.rhs)
+            self.emit(CONCAT, self.const(('concat', expr.lineno)))
+        elif isinstance(expr, FunCall) :
+            self.compile_call(expr)
+        elif isinstance(expr, List) :
+            # List.eval of a literal is an empty python list
+            self.emit(LOAD_CONST, self.const(('pylist',)))
+        else :
+            raise TypeError("Can't compile %s" % expr.__class__.__name__)
+
+    def compile_arith( self, expr, op, leafOp ) :
+        'the second operand evaluated, and op'
+        leaf = _leaf(expr)
+        if leaf is not None :
+            self.emit(leafOp, leaf)
+        else :
+            self.compile_expr(expr)
+            self.emit(op)
+
+    def compile_operand( self, expr ) :
+        '''the operands of ||, and of cons, and car's argument: an Ident or
+        a call is evaluated, a list literal used as it is, anything else is
+        no list at all'''
+        if isinstance(expr, Ident) or isinstance(expr, FunCall) :
+            self.compile_expr(expr)
+        elif isinstance(expr, List) :
+            self.emit(LOAD_CONST, self.literal(expr))
+        elif isinstance(expr, Number) :
+            # cons keeps the Number
+            self.emit(LOAD_CONST, self.const(('number', expr.value), expr))
+        else :
+            self.emit(LOAD_CONST, self.const(None))
+
+    def compile_call( self, call ) :
+        name = call.name
+        argList = call.argList
+        if name in self.shadowed :
+            # a proc of the name, once defined, is called instead
+            toProc = self.emit(JUMP_IF_DEFINED, name, None)
+            getattr(self, 'compile_' + name)(call)
+            toEnd = self.emit(JUMP, None)
+            self.patch(toProc)
+            self.compile_proc_call(call)
+            self.patch(toEnd)
+            return
+        elif name in BUILTINS :
+            getattr(self, 'compile_' + name)(call)
+            return
+        self.compile_proc_call(call)
+
+    def compile_proc_call( self, call ) :
+        name = call.name
+        argList = call.argList
+        self.emit(CALL_BEGIN, name, len(argList), call.lineno)
+        for i, arg in enumerate(argList) :
+            if isinstance(arg, List) :
+                # a list literal is passed as it is
+                self.emit(LOAD_CONST, self.literal(arg))
+            else :
+                self.compile_expr(arg)
+            self.emit(BIND_ARG, i)
+        self.emit(CALL)
+
+    def compile_car( self, call ) :
+        if len(call.argList) != 1 :
+            self.emit(RAISE, "Car function requires exactly 1 argument")
+            return
+        self.compile_list_arg(call.argList[0])
+        self.emit(CAR)
+
+    def compile_list_arg( self, arg ) :
+        if isinstance(arg, Number) :
+            self.emit(LOAD_CONST, self.const(None))
+        else :
+            self.compile_operand(arg)
+
+    def compile_cdr( self, call ) :
+        arg = call.argList[0]
+        self.compile_list_arg(arg)
+        self.emit(CDR, CDR_IDENT if isinstance(arg, Ident) else CDR_VALUE)
+
+    def compile_nullp( self, call ) :
+        arg = call.argList[0]
+        self.compile_expr(arg)
+        if len(call.argList) != 1 :
+            mode = NULLP_ARG_COUNT
+        elif (isinstance(arg, Ident) or isinstance(arg, FunCall)
+              or isinstance(arg, List)) :
+            # car would evaluate it again and get the same List; here it's
+            # only evaluated once
+            mode = NULLP_LIST
+        else :
+            mode = NULLP_NOT_LIST
+        self.emit(NULLP, mode)
+
+    def compile_listp( self, call ) :
+        # listp is 0 if evaluating its argument raises anything
+        handler = self.emit(SETUP_LISTP, None)
+        self.compile_expr(call.argList[0])
+        self.emit(LISTP)
+        self.patch(handler)
+
+    def compile_intp( self, call ) :
+        # intp looks at the node, not at what it evaluates to
+        self.emit(LOAD_CONST,
+                  self.const(1 if isinstance(call.argList[0], Number) else 0))
+
+    def compile_cons( self, call ) :
+        if len(call.argList) != 2 :
+            self.emit(RAISE, "Cons function requires exactly 2 arguments")
+            return
+        self.compile_operand(call.argList[0])
+        self.compile_list_arg(call.argList[1])
+        self.emit(CONS, self.const(('site', call.name, call.lineno)))
+
+
+def literal_data( lst ) :
+    '''a list literal as nested ('list', lineno, items) tuples, each item a
+    ('number', value), a nested list or None'''
+    if lst.sequence is None :
+        return ('list', None, ())
+    return cells_data(lst.sequence.cons_cell, lst.sequence.lineno)
+
+def cells_data( cell, lineno=None ) :
+    items = list()
+    while cell is not None :
+        val = cell.car
+        if isinstance(val, Number) :
+            items.append(('number', val.value))
+        elif isinstance(val, ConsCell) :
+            items.append(cells_data(val))
+        else :
+            items.append(None)
+        cell = cell.cdr
+    return ('list', lineno, tuple(items))
+
+def build_literal( data ) :
+    'the List for literal_data, its cells rooted like a parsed literal'
+    tag, lineno, items = data
+    if not items :
+        return List()
+    elements = list()
+    for item in items :
+        if item is None :
+            elements.append(None)
+        elif item[0] == 'number' :
+            elements.append(Number(item[1]))
+        else :
+            elements.append(build_literal(item))
+    return List(Sequence(elements=elements, lineno=lineno))
+
+def build_const( value ) :
+    'the object a constant stands for'
+    if not isinstance(value, tuple) :
+        return value
+    tag = value[0]
+    if tag == 'list' :
+        return build_literal(value)
+    elif tag == 'number' :
+        return Number(value[1])
+    elif tag == 'pylist' :
+        return list()
+    elif tag == 'site' :
+        return FunCall(value[1], [], value[2])
+    elif tag == 'concat' :
+        return Concat(None, None, value[1])
+    elif tag == 'function' :
+        return Function(value[1], value[2], value[3])
+    raise ValueError("Unknown constant %s" % (value,))
+
+
+class VM :
+    '''Runs a Code against the name table nt and function table ft'''
+
+    def __init__( self, code, nt, ft, gh ) :
+        self.code = code
+        self.nt = nt
+        self.ft = ft
+        self.gh = gh
+        self.consts = [code.objects[i] if i in code.objects else build_const(c)
+                       for i, c in enumerate(code.consts)]
+
+    def run( self ) :
+        base = len(GLOBAL_FRAMES)
+        rootsBase = len(GLOBAL_TEMP_ROOTS)
+        try :
+            self.execute()
+        finally :
+            del GLOBAL_FRAMES[base:]
+            del GLOBAL_TEMP_ROOTS[rootsBase:]
+
+    def execute( self, LOAD_NAME=LOAD_NAME, STORE_NAME=STORE_NAME,
+                 SET_ADD=SET_ADD, SET_SUB=SET_SUB, SET_MUL=SET_MUL,
+                 JUMP_IF_NAME_POS=JUMP_IF_NAME_POS, JUMP_IF_POS=JUMP_IF_POS,
+                 LOAD_CONST=LOAD_CONST, ADD_LEAF=ADD_LEAF, ADD=ADD,
+                 SUB_LEAF=SUB_LEAF, MUL_LEAF=MUL_LEAF, SUB=SUB, MUL=MUL,
+                 JUMP_IF_NOT_POS=JUMP_IF_NOT_POS, JUMP=JUMP,
+                 CALL_BEGIN=CALL_BEGIN, BIND_ARG=BIND_ARG, CALL=CALL,
+                 RETURN=RETURN, CDR=CDR, NULLP=NULLP, CAR=CAR, ROOT=ROOT,
+                 CONS=CONS, CONCAT=CONCAT, SETUP_LISTP=SETUP_LISTP, LISTP=LISTP,
+                 DEFINE=DEFINE, RAISE=RAISE, HALT=HALT,
+                 JUMP_IF_DEFINED=JUMP_IF_DEFINED ) :
+        # the ops are arguments so comparing with them doesn't look up
+        # globals
+        consts = self.consts
+        units = self.code.units
+        ft = self.ft
+        gh = self.gh
+        nt = self.nt
+        tracer = TRACE
+        code = units[0]
+        pc = 0
+        stack = list()
+        push = stack.append
+        pop = stack.pop
+        # the callers' ( code, pc, name table )
+        frames = list()
+        # ( Function, name table ) of the calls binding their arguments
+        pending = list()
+        # listp's, the state to go back to if its argument raises
+        handlers = list()
+        while True :
+            try :
+                while True :
+                    ins = code[pc]
+                    op = ins[0]
+                    pc += 1
+                    if op == LOAD_NAME :
+                        push(nt[ins[1]])
+                    elif op == STORE_NAME :
+                        if tracer.eval:
+                            tracer.event('eval', "assign %s", ins[1])
+                        nt[ins[1]] = pop()
+                    elif op <= SET_MUL :
+                        if tracer.eval:
+                            tracer.event('eval', "assign %s", ins[1])
+                        lhs = ins[2]
+                        rhs = ins[3]
+                        if op == SET_ADD :
+                            # as Plus.eval, rhs first
+                            if type(rhs) is str :
+                                rhs = nt[rhs]
+                                while type(rhs) is not int :
+                                    rhs = rhs.eval(nt, ft, gh)
+                            if type(lhs) is str :
+                                lhs = nt[lhs]
+                                while type(lhs) is not int :
+                                    lhs = lhs.eval(nt, ft, gh)
+                            if tracer.eval:
+                                tracer.event('eval', "%s + %s", lhs, rhs)
+                            nt[ins[1]] = lhs + rhs
+                        else :
+                            if type(lhs) is str :
+                                lhs = nt[lhs]
+                            if type(rhs) is str :
+                                rhs = nt[rhs]
+                            if op == SET_SUB :
+                                nt[ins[1]] = lhs - rhs
+                            else :
+                                nt[ins[1]] = lhs * rhs
+                    elif op == JUMP_IF_NAME_POS :
+                        if nt[ins[1]] > 0 :
+                            pc = ins[2]
+                    elif op == JUMP_IF_POS :
+                        if pop() > 0 :
+                            pc = ins[1]
+                    elif op == LOAD_CONST :
+                        push(consts[ins[1]])
+                    elif op <= ADD :
+                        # Plus, the rhs under the lhs if that's on the stack
+                        if op == ADD :
+                            lhs = pop()
+                        else :
+                            lhs = ins[1]
+                        rhs = stack[-1]
+                        while type(rhs) is not int :
+                            rhs = rhs.eval(nt, ft, gh)
+                        if type(lhs) is str :
+                            lhs = nt[lhs]
+                        while type(lhs) is not int :
+                            lhs = lhs.eval(nt, ft, gh)
+                        if tracer.eval:
+                            tracer.event('eval', "%s + %s", lhs, rhs)
+                        stack[-1] = lhs + rhs
+                    elif op <= MUL :
+                        if op == SUB or op == MUL :
+                            rhs = pop()
+                        else :
+                            rhs = ins[1]
+                            if type(rhs) is str :
+                                rhs = nt[rhs]
+                        if op == SUB_LEAF or op == SUB :
+                            stack[-1] = stack[-1] - rhs
+                        else :
+                            stack[-1] = stack[-1] * rhs
+                    elif op == JUMP_IF_NOT_POS :
+                        if not pop() > 0 :
+                            pc = ins[1]
+                    elif op == JUMP :
+                        pc = ins[1]
+                    elif op == CALL_BEGIN :
+                        name = ins[1]
+                        if tracer.call:
+                            tracer.event('call', "%s line %s", name, ins[3])
+                        function = ft[name]
+                        if ins[2] != len(function.parList) :
+                            print "Param count does not match:"
+                            sys.exit( 1 )
+                        newContext = {}
+                        # the new name table holds GC roots while the proc runs
+                        GLOBAL_FRAMES.append(newContext)
+                        pending.append((function, newContext))
+                    elif op == BIND_ARG :
+                        function, newContext = pending[-1]
+                        newContext[function.parList[ins[1]]] = pop()
+                    elif op == CALL :
+                        function, newContext = pending.pop()
+                        frames.append((code, pc, nt))
+                        code = units[function.unit]
+                        pc = 0
+                        nt = newContext
+                    elif op == RETURN :
+                        GLOBAL_FRAMES.pop()
+                        if returnSymbol not in nt :
+                            print "Error:  no return value"
+                            sys.exit( 2 )
+                        push(nt[returnSymbol])
+                        code, pc, nt = frames.pop()
+                    elif op == CDR :
+                        if tracer.call:
+                            tracer.event('call', "builtin %s", 'cdr')
+                        listPassed = stack[-1]
+                        if ins[1] == CDR_IDENT and not isinstance(listPassed, List) :
+                            listPassed = MiniLangUtils.pythonListToList(listPassed)
+                        if not isinstance(listPassed, List) :
+                            raise Exception("Can only call cdr on List")
+                        stack[-1] = List(cons_cell=BuiltIns.cdr(listPassed))
+                    elif op == NULLP :
+                        if tracer.call:
+                            tracer.event('call', "builtin %s", 'nullp')
+                        the_list = stack[-1]
+                        if not isinstance(the_list, List) :
+                            stack[-1] = 0
+                        elif ins[1] == NULLP_LIST :
+                            stack[-1] = 1 if BuiltIns.car(the_list) is None else 0
+                        elif ins[1] == NULLP_NOT_LIST :
+                            raise Exception("Can only call car on List")
+                        else :
+                            raise Exception("Car function requires exactly 1 argument")
+                    elif op == CAR :
+                        if tracer.call:
+                            tracer.event('call', "builtin %s", 'car')
+                        listPassed = stack[-1]
+                        if not isinstance(listPassed, List) :
+                            raise Exception("Can only call car on List")
+                        val = BuiltIns.car(listPassed)
+                        if isinstance(val, ConsCell) :
+                            val = List(cons_cell=val)
+                        stack[-1] = val
+                    elif op == ROOT :
+                        GLOBAL_TEMP_ROOTS.append(stack[-1])
+                    elif op == CONS :
+                        if tracer.call:
+                            tracer.event('call', "builtin %s", 'cons')
+                        destList = pop()
+                        if isinstance(destList, int) :
+                            raise Exception("Can only cons an object onto a List")
+                        stack[-1] = List(cons_cell=BuiltIns.cons(stack[-1],
+                            destList, consts[ins[1]]))
+                    elif op == CONCAT :
+                        rhs = pop()
+                        del GLOBAL_TEMP_ROOTS[-1]
+                        stack[-1] = consts[ins[1]].join(stack[-1], rhs)
+                    elif op == SETUP_LISTP :
+                        handlers.append((code, ins[1], nt, len(frames),
+                                         len(stack), len(GLOBAL_FRAMES),
+                                         len(pending), len(GLOBAL_TEMP_ROOTS)))
+                    elif op == LISTP :
+                        if tracer.call:
+                            tracer.event('call', "builtin %s", 'listp')
+                        handlers.pop()
+                        evaledArg = stack[-1]
+                        if isinstance(evaledArg, List) or isinstance(evaledArg, list) :
+                            stack[-1] = 1
+                        else :
+                            stack[-1] = 0
+                    elif op == DEFINE :
+                        function = consts[ins[1]]
+                        define(ft, function.name, function)
+                    elif op == RAISE :
+                        raise Exception(ins[1])
+                    elif op == HALT :
+                        return
+                    elif op == JUMP_IF_DEFINED :
+                        if ins[1] in ft :
+                            pc = ins[2]
+                    else :
+                        raise ValueError("Bad op %s at %s" % (op, pc - 1))
+            except :
+                # listp swallows anything its argument raises, as
+                # FunCall.listp does
+                if not handlers :
+                    raise
+                (code, pc, nt, depth, stackDepth, framesDepth,
+                 pendingDepth, rootsDepth) = handlers.pop()
+                del frames[depth:]
+                del stack[stackDepth:]
+                del GLOBAL_FRAMES[framesDepth:]
+                del pending[pendingDepth:]
+                del GLOBAL_TEMP_ROOTS[rootsDepth:]
+                push(0)
+
+
+def compile_program( program ) :
+    'compiles program, returning its Code'
+    return Compiler().compile(program)
+
+def source_key( program ) :
+    'the hash the Code for program is cached under'
+    return hashlib.sha1('%s\0%s\0%s' % (FORMAT_VERSION, program.folded,
+                                        program.source)).hexdigest()
+
+def reuse_literals( code ) :
+    '''points code's list literals at the parsed literals they were compiled
+    from, so a loaded Code doesn't build its literals' cells a second time'''
+    parsed = dict()
+    for cell in GLOBAL_LITERALS :
+        parsed[cells_data(cell)[2]] = cell
+    for i, c in enumerate(code.consts) :
+        if (isinstance(c, tuple) and c[0] == 'list' and c[2]
+                and c[2] in parsed) :
+            code.objects[i] = List(Sequence(cons_cell=parsed[c[2]],
+                                            lineno=c[1]))
+
+def load_code( program, cacheDir=None ) :
+    '''the Code for program, from cacheDir if it was compiled and kept
+    there before, otherwise compiled (and kept, given a cacheDir).  Without
+    the program's source there is nothing to key it on, so it's compiled.'''
+    if cacheDir is None or program.source is None :
+        return compile_program(program)
+    path = os.path.join(cacheDir, source_key(program) + CACHE_SUFFIX)
+    if os.path.exists(path) :
+        try:
+            with open(path, 'rb') as f :
+                code = Code.loads(f.read())
+            reuse_literals(code)
+            return code
+        except (EOFError, ValueError, TypeError) :
+            pass    # compile it again
+    code = compile_program(program)
+    if not os.path.isdir(cacheDir) :
+        os.makedirs(cacheDir)
+    # written then renamed, so a reader never sees half a file
+    temp = '%s.%d' % (path, os.getpid())
+    with open(temp, 'wb') as f :
+        f.write(code.dumps())
+    os.rename(temp, path)
+    return code
+
+def run_program( program, code=None, cacheDir=None ) :
+    '''runs program, or code compiled from it, on a VM, keeping the code
+    in cacheDir if given'''
+    if code is None :
+        code = load_code(program, cacheDir)
+    VM(code, program.nameTable, program.funcTable, program.globalHeap).run()
@@ -7,5 +7,5 @@ STMT LIST
 Running Program
 Dump of Symbol Table
   b -> 
-( ( 5 nil ) ( 1 ( 2 nil ) ) )
+( 5 ( 1 ( 2 nil ) ) )
 Function Table
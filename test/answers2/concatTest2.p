@@ -11,5 +11,5 @@ Dump of Symbol Table
   a -> 
 ( 1 ( ( ( 2 nil ) nil ) ( ( ( ( 3 nil ) nil ) nil ) nil ) ) )
   b -> 
-( ( 1 ( ( ( 2 nil ) nil ) ( ( ( ( 3 nil ) nil ) nil ) nil ) ) ) ( 1 ( 2 nil ) ) )
+( 1 ( ( ( 2 nil ) nil ) ( ( ( ( 3 nil ) nil ) nil ) ( 1 ( 2 nil ) ) ) ) )
 Function Table
@@ -16,7 +16,7 @@ Dump of Symbol Table
   a -> 
 ( 1 ( ( 2 nil ) ( ( ( 3 nil ) nil ) nil ) ) )
   c -> 
-( ( ( 2 nil ) ( ( ( 3 nil ) nil ) nil ) ) ( 5 ( 4 nil ) ) )
+( ( 2 nil ) ( ( ( 3 nil ) nil ) ( 5 ( 4 nil ) ) ) )
   b -> 
 ( 4 nil )
 Function Table
@@ -14,7 +14,7 @@ Dump of Symbol Table
   a -> 
 1
   c -> 
-( nil ( nil ( ( 3 nil ) ( 4 ( ( ( ( 5 nil ) nil ) nil ) nil ) ) ) ) )
+( nil ( ( 3 nil ) ( 4 ( ( ( ( 5 nil ) nil ) nil ) nil ) ) ) )
   b -> 
 ( nil ( ( 3 nil ) ( 4 ( ( ( ( 5 nil ) nil ) nil ) nil ) ) ) )
 Function Table
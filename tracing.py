@@ -0,0 +1,107 @@
+#!/usr/bin/python
+#
+# tracing.py - cheap event tracing for the interpreters
+#
+# DESCRIPTION:
+#       Trace points in the evaluators and heaps look like
+#
+#           if TRACE.cons :
+#               TRACE.event('cons', "new cons at %s", c.index)
+#
+#       so with a category off an event costs one attribute test, and nothing
+#       is formatted.  Events go into a ring buffer holding the last few
+#       thousand; the format string and arguments are kept as they are and
+#       only formatted when the buffer is dumped, so arguments should be
+#       plain values (numbers, names, cell indexes) rather than cells or
+#       lists, which may have changed by then.
+#
+#       The interpreters turn categories on with --trace (MINILANG_TRACE)
+#       and dump the buffer to stderr if the program dies with an exception.
+#
+
+import sys
+import collections
+
+# the categories there are trace points for:
+#   eval    statements and arithmetic
+#   call    function calls, built in or not
+#   cons    new cons cells, from cons, || and list literals
+#   alloc   cells handed out and freed by a heap
+#   gc      collections, and the phases of incremental ones
+#   heap    every cell in the heap, before each collection (a lot)
+CATEGORIES = ('eval', 'call', 'cons', 'alloc', 'gc', 'heap')
+
+
+def parse_categories( text ) :
+    '''the categories in a comma separated string, "all" meaning every
+    one.  Raises ValueError for a category there's no such thing as.'''
+    categories = list()
+    for category in text.split(',') :
+        category = category.strip()
+        if category == 'all' :
+            categories.extend(CATEGORIES)
+        elif category in CATEGORIES :
+            categories.append(category)
+        elif category :
+            raise ValueError("Unknown trace category %s" % category)
+    return categories
+
+
+class Tracer :
+    '''Per category switches plus a ring buffer of the last size events.
+    Each category is a boolean attribute, for the trace points to test.'''
+
+    def __init__( self, size=5000 ) :
+        self.ring = collections.deque(maxlen=size)
+        self.dropped = 0
+        for category in CATEGORIES :
+            setattr(self, category, False)
+
+    def enable( self, categories ) :
+        '''turns on the categories, a list of names or a string for
+        parse_categories'''
+        if isinstance(categories, basestring) :
+            categories = parse_categories(categories)
+        for category in categories :
+            if category not in CATEGORIES :
+                raise ValueError("Unknown trace category %s" % category)
+            setattr(self, category, True)
+
+    def disable( self ) :
+        for category in CATEGORIES :
+            setattr(self, category, False)
+
+    def resize( self, size ) :
+        self.ring = collections.deque(self.ring, maxlen=size)
+
+    def event( self, category, fmt, *args ) :
+        if len(self.ring) == self.ring.maxlen :
+            self.dropped += 1
+        self.ring.append((category, fmt, args))
+
+    def events( self ) :
+        'the buffered events, oldest first, formatted'
+        for category, fmt, args in self.ring :
+            yield "%-5s %s" % (category, fmt % args)
+
+    def clear( self ) :
+        self.ring.clear()
+        self.dropped = 0
+
+    def dump( self, out=sys.stderr ) :
+        out.write("Last %d trace events (%d older ones dropped):\n"
+                  % (len(self.ring), self.dropped))
+        for line in self.events() :
+            out.write("  %s\n" % line)
+
+    def install( self ) :
+        '''dumps the buffer when the program dies with an uncaught
+        exception, then reports the exception as usual'''
+        previous = sys.excepthook
+        def hook( excType, value, tb ) :
+            self.dump()
+            previous(excType, value, tb)
+        sys.excepthook = hook
+
+
+TRACE = Tracer()
@@ -0,0 +1,611 @@
+#!/usr/bin/python
+#
+# transpiler.py - translates a programextgc Program into Python source
+#
+# DESCRIPTION:
+#       Transpiler writes out a Program as the source of a Python module: the
+#       main program becomes a function _main taking the name table, and
+#       each Proc a function of its own whose parameters and locals are
+#       Python locals (an identifier x is v_x).  An if or while becomes a
+#       Python if or while, arithmetic becomes Python arithmetic, and the
+#       builtins and || call the runtime helpers below (after checking for a
+#       proc of the builtin's name, if the program defines one).  load_code
+#       compiles the source with compile(), keeping the code object, by a
+#       hash of the source, in a cache directory if it is given one, so a
+#       program run again isn't compiled again.
+#
+#       What the generated code does is what the nodes' eval methods do,
+#       quirks included, as in closurecompiler.py and stackvm.py.  Two things
+#       need help to come out the same:
+#
+#         The collectors look for roots in the name tables on GLOBAL_FRAMES.
+#         A proc pushes a FrameLocals for its Python frame there, which reads
+#         the frame's locals when a collection asks for them.  The arguments
+#         of a call are bound one by one in a name table on GLOBAL_FRAMES, as
+#         Proc.apply does, unless none but the last can allocate anything.
+#
+#         Reading a name that isn't bound is a KeyError for the name, as a
+#         name table lookup is; run_program turns the UnboundLocalError a
+#         proc raises into one.
+#
+#       A call to a proc assigned to return with nothing in the proc after
+#       it is a tail call, as in the Resolver.  It returns a TailCall of the
+#       callee and its arguments instead of calling it, and a proc making
+#       tail calls is called through _trampoline, which makes them in a
+#       loop, so tail recursion doesn't nest Python frames.
+#
+#       Constants (list literals, Numbers cons keeps, the nodes cons and ||
+#       count allocations against) are module globals named _k0, _k1, ...
+#       bound to the parser's objects when the code is run, so the source
+#       only depends on the program's text.
+#
+
+import os
+import re
+import sys
+import marshal
+import hashlib
+
+from programextgc import ( Number, List, Ident, Times, Plus, Minus, Concat,
+    FunCall, AssignStmt, DefineStmt, IfStmt, WhileStmt, StmtList, BuiltIns,
+    ConsCell, MiniLangUtils, TailCall, GLOBAL_FRAMES, BUILTINS, define,
+    defined_names )
+from tracing import TRACE
+
+# what the code cache's files end with
+CACHE_SUFFIX = '.code'
+
+indent = '    ' # 4 spaces
+
+
+######   RUNTIME HELPERS   ##########
+
+class FrameLocals :
+    '''The Python locals of a running proc as a name table, for roots().
+    Only the mini-language names (v_x, read as x) are in it.'''
+
+    def __init__( self, frame ) :
+        self.frame = frame
+
+    def iteritems( self ) :
+        # f_locals copies the frame's locals into a dict as it is read
+        for name, val in self.frame.f_locals.items() :
+            if name.startswith('v_') :
+                yield name[2:], val
+
+
+class PendingCall( dict ) :
+    '''the name table a call binds its arguments in, on GLOBAL_FRAMES until
+    the proc starts'''
+
+    def __init__( self, function ) :
+        dict.__init__(self)
+        self.function = function
+        self.args = list()
+
+
+def _undefined( name ) :
+    raise KeyError(name)
+
+def _raise( message ) :
+    raise Exception(message)
+
+def _no_return() :
+    print "Error:  no return value"
+    sys.exit( 2 )
+
+def _trace_assign( name ) :
+    TRACE.event('eval', "assign %s", name)
+
+def _add( rhs, lhs ) :
+    'Plus evaluates its operands until they are ints (Numbers held in lists)'
+    while type(rhs) is not int :
+        rhs = rhs.eval(None, None, None)
+    while type(lhs) is not int :
+        lhs = lhs.eval(None, None, None)
+    if TRACE.eval :
+        TRACE.event('eval', "%s + %s", lhs, rhs)
+    return lhs + rhs
+
+def _callee( name, nArgs, lineno, ft ) :
+    'the function a call runs, once the argument count is checked'
+    if TRACE.call :
+        TRACE.event('call', "%s line %s", name, lineno)
+    function = ft[name]
+    if nArgs != len(function.parList) :
+        print "Param count does not match:"
+        sys.exit( 1 )
+    return function
+
+def _enter( name, nArgs, lineno, ft ) :
+    'a PendingCall for the call, on GLOBAL_FRAMES'
+    pending = PendingCall(_callee(name, nArgs, lineno, ft))
+    GLOBAL_FRAMES.append(pending)
+    return pending
+
+def _arg( pending, value ) :
+    pending[pending.function.parList[len(pending.args)]] = value
+    pending.args.append(value)
+    return pending
+
+def _invoke( pending ) :
+    GLOBAL_FRAMES.pop()
+    return pending.function(*pending.args)
+
+def _tail( function, *args ) :
+    'a tail call of function, for the _trampoline of the proc making it'
+    return TailCall(function, args)
+
+def _tail_invoke( pending ) :
+    GLOBAL_FRAMES.pop()
+    return TailCall(pending.function, pending.args)
+
+def _trampoline( body ) :
+    '''the function a proc making tail calls is called through: body returns
+    a TailCall for each, and the callee's body is run here in its place'''
+    def function( *args ) :
+        val = body(*args)
+        while val.__class__ is TailCall :
+            val = val.proc.body(*val.frame)
+        return val
+    function.parList = body.parList
+    function.body = body
+    return function
+
+def _car( listPassed ) :
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'car')
+    if not isinstance(listPassed, List) :
+        raise Exception("Can only call car on List")
+    val = BuiltIns.car(listPassed)
+    if isinstance(val, ConsCell) :
+        return List(cons_cell=val)
+    return val
+
+def _cdr( listPassed ) :
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'cdr')
+    if not isinstance(listPassed, List) :
+        raise Exception("Can only call cdr on List")
+    # BuiltIns.cdr, inline
+    try:
+        rest = listPassed.sequence.cons_cell.cdr
+    except AttributeError:
+        rest = None
+    return List(cons_cell=rest)
+
+def _cdr_ident( listPassed ) :
+    'cdr of an Ident, which evalIdent turns into a List if it isn\'t one'
+    if not isinstance(listPassed, List) :
+        listPassed = MiniLangUtils.pythonListToList(listPassed)
+    return _cdr(listPassed)
+
+def _nullp( the_list ) :
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'nullp')
+    if not isinstance(the_list, List) :
+        return 0
+    # BuiltIns.car, inline
+    try:
+        first = the_list.sequence.cons_cell.car
+    except AttributeError:
+        first = None
+    return 1 if first is None else 0
+
+def _nullp_raise( the_list, message ) :
+    '''nullp where car would have been handed something it can't take, as
+    it is for anything but an Ident, a call or a literal'''
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'nullp')
+    if not isinstance(the_list, List) :
+        return 0
+    raise Exception(message)
+
+def _listp( thunk ) :
+    'listp is 0 if evaluating its argument raises anything'
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'listp')
+    depth = len(GLOBAL_FRAMES)
+    try:
+        evaledArg = thunk()
+    except:
+        del GLOBAL_FRAMES[depth:]
+        return 0
+    if isinstance(evaledArg, List) or isinstance(evaledArg, list) :
+        return 1
+    return 0
+
+def _cons( first, destList, site ) :
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'cons')
+    if isinstance(destList, int) :
+        raise Exception("Can only cons an object onto a List")
+    return List(cons_cell=BuiltIns.cons(first, destList, site))
+
+def _intp( value ) :
+    if TRACE.call :
+        TRACE.event('call', "builtin %s", 'intp')
+    return value
+
+RUNTIME = {
+    '_define' : define,
+    '_FrameLocals' : FrameLocals,
+    '_getframe' : sys._getframe,
+    '_push' : GLOBAL_FRAMES.append,
+    '_pop' : GLOBAL_FRAMES.pop,
+    '_undefined' : _undefined,
+    '_raise' : _raise,
+    '_no_return' : _no_return,
+    '_trace_assign' : _trace_assign,
+    '_add' : _add,
+    '_callee' : _callee,
+    '_enter' : _enter,
+    '_arg' : _arg,
+    '_invoke' : _invoke,
+    '_tail' : _tail,
+    '_tail_invoke' : _tail_invoke,
+    '_trampoline' : _trampoline,
+    '_car' : _car,
+    '_cdr' : _cdr,
+    '_cdr_ident' : _cdr_ident,
+    '_nullp' : _nullp,
+    '_nullp_raise' : _nullp_raise,
+    '_listp' : _listp,
+    '_cons' : _cons,
+    '_intp' : _intp,
+}
+
+
+######   TRANSLATION   ##########
+
+def _assigned( stmt, names ) :
+    '''adds the names stmt assigns to names; a define's body is another
+    function, so what it assigns doesn't count'''
+    if isinstance(stmt, StmtList) :
+        for s in stmt.sl :
+            _assigned(s, names)
+    elif isinstance(stmt, AssignStmt) :
+        names.add(stmt.name)
+    elif isinstance(stmt, IfStmt) :
+        _assigned(stmt.tBody, names)
+        _assigned(stmt.fBody, names)
+    elif isinstance(stmt, WhileStmt) :
+        _assigned(stmt.body, names)
+    return names
+
+def _can_allocate( expr ) :
+    'False if evaluating expr can\'t allocate a cell (or run a collection)'
+    return not (isinstance(expr, Ident) or isinstance(expr, Number)
+                or isinstance(expr, List))
+
+
+class Transpiler :
+    '''Translates a Program, and the Procs defined in it, into the source of
+    a Python module.  source is the text, consts the objects its _k names
+    stand for.'''
+
+    def __init__( self, program ) :
+        self.program = program
+        self.consts = dict()
+        self.constIds = dict()
+        # Proc -> name of its function
+        self.procs = dict()
+        self.functions = list()
+        # None in the main program, else the names a proc's function binds
+        self.locals = None
+        # whether the proc's function makes tail calls
+        self.tailCalls = False
+        # the builtins a proc may be defined over
+        self.shadowed = defined_names(program.stmtList) & set(BUILTINS)
+        self.lines = list()
+        self.depth = 0
+        self.emit("def _main( nt ) :")
+        self.compile_block(program.stmtList)
+        main = self.lines
+        self.source = '\n'.join(main + self.functions) + '\n'
+
+    def emit( self, line ) :
+        self.lines.append(indent*self.depth + line)
+
+    def const( self, obj ) :
+        'the global name the object obj is bound to'
+        if id(obj) not in self.constIds :
+            name = '_k%d' % len(self.consts)
+            self.consts[name] = obj
+            self.constIds[id(obj)] = name
+        return self.constIds[id(obj)]
+
+    def namespace( self, ft ) :
+        'the globals to run the source in, with the function table ft'
+        namespace = dict(RUNTIME)
+        namespace.update(self.consts)
+        namespace['ft'] = ft
+        return namespace
+
+    def name( self, name ) :
+        'an expression reading the identifier name'
+        if self.locals is None :
+            return 'nt[%r]' % name
+        elif name in self.locals :
+            return 'v_' + name
+        return '_undefined(%r)' % name
+
+    ######   STATEMENTS   ##########
+
+    def compile_stmt( self, stmt, tail=False ) :
+        '''tail says nothing in the proc runs after stmt'''
+        if isinstance(stmt, StmtList) :
+            last = len(stmt.sl) - 1
+            for i, s in enumerate(stmt.sl) :
+                self.compile_stmt(s, tail and i == last)
+        elif isinstance(stmt, AssignStmt) :
+            self.compile_assign(stmt, tail)
+        elif isinstance(stmt, DefineStmt) :
+            self.emit("_define(ft, %r, %s)" % (stmt.name,
+                                               self.compile_proc(stmt.proc)))
+        elif isinstance(stmt, IfStmt) :
+            self.emit("if %s > 0 :" % self.compile_expr(stmt.cond))
+            self.compile_block(stmt.tBody, tail)
+            self.emit("else :")
+            self.compile_block(stmt.fBody, tail)
+        elif isinstance(stmt, WhileStmt) :
+            self.emit("while %s > 0 :" % self.compile_expr(stmt.cond))
+            self.compile_block(stmt.body)
+        else :
+            raise TypeError("Can't compile %s" % stmt.__class__.__name__)
+
+    def compile_block( self, stmt, tail=False ) :
+        'stmt, a level in; pass if it comes to nothing (see constfold)'
+        self.depth += 1
+        start = len(self.lines)
+        self.compile_stmt(stmt, tail)
+        if len(self.lines) == start :
+            self.emit("pass")
+        self.depth -= 1
+
+    def compile_assign( self, stmt, tail=False ) :
+        if TRACE.eval :
+            self.emit("_trace_assign(%r)" % stmt.name)
+        if isinstance(stmt.rhs, List) :
+            # a list literal is bound as it is
+            rhs = self.const(stmt.rhs)
+        elif (tail and stmt.name == 'return' and isinstance(stmt.rhs, FunCall)
+              and stmt.rhs.name not in BUILTINS) :
+            rhs = self.compile_proc_call(stmt.rhs, True)
+            self.tailCalls = True
+        else :
+            rhs = self.compile_expr(stmt.rhs)
+        if self.locals is None :
+            self.emit("nt[%r] = %s" % (stmt.name, rhs))
+        else :
+            self.emit("v_%s = %s" % (stmt.name, rhs))
+
+    def compile_proc( self, proc ) :
+        if proc in self.procs :
+            return self.procs[proc]
+        function = self.procs[proc] = '_proc%d' % len(self.procs)
+        outer = (self.lines, self.depth, self.locals, self.tailCalls)
+        self.lines = list()
+        self.depth = 0
+        self.locals = _assigned(proc.body, set(proc.parList))
+        self.tailCalls = False
+        params = list()
+        rebind = list()
+        for i, par in enumerate(proc.parList) :
+            if 'v_' + par in params :
+                # bound again, the later argument wins
+                params.append('_arg%d' % i)
+                rebind.append("v_%s = _arg%d" % (par, i))
+            else :
+                params.append('v_' + par)
+        self.emit("def %s( %s ) :" % (function, ', '.join(params)))
+        self.depth += 1
+        for line in rebind :
+            self.emit(line)
+        # the proc's locals hold GC roots while it runs
+        self.emit("_push(_FrameLocals(_getframe()))")
+        self.compile_stmt(proc.body, True)
+        self.emit("_pop()")
+        if 'return' in self.locals :
+            self.emit("try :")
+            self.emit(indent + "return v_return")
+            self.emit("except UnboundLocalError :")
+            self.emit(indent + "_no_return()")
+        else :
+            self.emit("_no_return()")
+        self.depth -= 1
+        self.emit("%s.parList = %r" % (function, list(proc.parList)))
+        if self.tailCalls :
+            self.emit("%s = _trampoline(%s)" % (function, function))
+        else :
+            self.emit("%s.body = %s" % (function, function))
+        self.functions.append('')
+        self.functions.extend(self.lines)
+        self.lines, self.depth, self.locals, self.tailCalls = outer
+        return function
+
+    ######   EXPRESSIONS   #########
+
+    def compile_expr( self, expr ) :
+        'a Python expression for what expr.eval would return'
+        if isinstance(expr, Number) :
+            return repr(expr.value)
+        elif isinstance(expr, Ident) :
+            return self.name(expr.name)
+        elif isinstance(expr, Plus) :
+            return self.compile_plus(expr)
+        elif isinstance(expr, Minus) :
+            return '(%s - %s)' % (self.compile_expr(expr.lhs),
+                                  self.compile_expr(expr.rhs))
+        elif isinstance(expr, Times) :
+            return '(%s * %s)' % (self.compile_expr(expr.lhs),
+                                  self.compile_expr(expr.rhs))
+        elif isinstance(expr, Concat) :
+            # the lhs is rooted while the rhs runs (see Concat.join_rooted)
+            return '%s.join_rooted(%s, lambda : %s)' % (
+                self.const(expr), self.compile_operand(expr.lhs),
+                self.compile_operand(expr.rhs))
+        elif isinstance(expr, FunCall) :
+            return self.compile_call(expr)
+        elif isinstance(expr, List) :
+            # List.eval of a literal is an empty python list
+            return '[]'
+        raise TypeError("Can't compile %s" % expr.__class__.__name__)
+
+    def compile_plus( self, expr ) :
+        # Plus evaluates its rhs first, and goes on evaluating each operand
+        # until it is an int
+        lhs = self.compile_expr(expr.lhs)
+        rhs = self.compile_expr(expr.rhs)
+        if TRACE.eval :
+            return '_add(%s, %s)' % (rhs, lhs)
+        checks = list()
+        for operand, code in ((expr.rhs, rhs), (expr.lhs, lhs)) :
+            if isinstance(operand, Ident) and not code.startswith('_') :
+                checks.append('type(%s) is int' % code)
+            elif not isinstance(operand, Number) :
+                return '_add(%s, %s)' % (rhs, lhs)
+        if not checks :
+            return '(%s + %s)' % (lhs, rhs)
+        return '(%s + %s if %s else _add(%s, %s))' % (lhs, rhs,
+            ' and '.join(checks), rhs, lhs)
+
+    def compile_operand( self, expr ) :
+        '''the operands of ||, and of cons, and car's argument: an Ident or
+        a call is evaluated, a list literal or Number used as it is,
+        anything else is no list at all'''
+        if isinstance(expr, Ident) or isinstance(expr, FunCall) :
+            return self.compile_expr(expr)
+        elif isinstance(expr, List) or isinstance(expr, Number) :
+            return self.const(expr)
+        return 'None'
+
+    def compile_list_arg( self, arg ) :
+        if isinstance(arg, Number) :
+            return 'None'
+        return self.compile_operand(arg)
+
+    def compile_call( self, call ) :
+        if call.name in self.shadowed :
+            # a proc of the name, once defined, is called instead
+            return '(%s if %r in ft else %s)' % (
+                self.compile_proc_call(call), call.name,
+                getattr(self, 'compile_' + call.name)(call))
+        elif call.name in BUILTINS :
+            return getattr(self, 'compile_' + call.name)(call)
+        return self.compile_proc_call(call)
+
+    def compile_proc_call( self, call, tail=False ) :
+        '''the call; with tail, a TailCall of it (see _trampoline)'''
+        argList = call.argList
+        args = list()
+        for arg in argList :
+            if isinstance(arg, List) :
+                # a list literal is passed as it is
+                args.append(self.const(arg))
+            else :
+                args.append(self.compile_expr(arg))
+        header = (call.name, len(argList), call.lineno)
+        if not [arg for arg in argList[:-1] if _can_allocate(arg)] :
+            # nothing can be collected while the arguments are evaluated
+            if tail :
+                return '_tail(%s)' % ', '.join(
+                    ['_callee(%r, %d, %r, ft)' % header] + args)
+            return '_callee(%r, %d, %r, ft)(%s)' % (header + (', '.join(args),))
+        pending = '_enter(%r, %d, %r, ft)' % header
+        for arg in args :
+            pending = '_arg(%s, %s)' % (pending, arg)
+        if tail :
+            return '_tail_invoke(%s)' % pending
+        return '_invoke(%s)' % pending
+
+    def compile_car( self, call ) :
+        if len(call.argList) != 1 :
+            return '_raise("Car function requires exactly 1 argument")'
+        return '_car(%s)' % self.compile_list_arg(call.argList[0])
+
+    def compile_cdr( self, call ) :
+        arg = call.argList[0]
+        if isinstance(arg, Ident) :
+            return '_cdr_ident(%s)' % self.compile_list_arg(arg)
+        return '_cdr(%s)' % self.compile_list_arg(arg)
+
+    def compile_nullp( self, call ) :
+        arg = call.argList[0]
+        value = self.compile_expr(arg)
+        if len(call.argList) != 1 :
+            return ('_nullp_raise(%s, "Car function requires exactly 1 '
+                    'argument")' % value)
+        elif (isinstance(arg, Ident) or isinstance(arg, FunCall)
+              or isinstance(arg, List)) :
+            # car would evaluate it again and get the same List; here it's
+            # only evaluated once
+            return '_nullp(%s)' % value
+        return '_nullp_raise(%s, "Can only call car on List")' % value
+
+    def compile_listp( self, call ) :
+        return '_listp(lambda : %s)' % self.compile_expr(call.argList[0])
+
+    def compile_intp( self, call ) :
+        # intp looks at the node, not at what it evaluates to
+        return '_intp(%d)' % isinstance(call.argList[0], Number)
+
+    def compile_cons( self, call ) :
+        if len(call.argList) != 2 :
+            return '_raise("Cons function requires exactly 2 arguments")'
+        return '_cons(%s, %s, %s)' % (self.compile_operand(call.argList[0]),
+                                      self.compile_list_arg(call.argList[1]),
+                                      self.const(call))
+
+
+######   COMPILING AND RUNNING   ##########
+
+def source_key( source ) :
+    'the hash the code for source is cached under'
+    return hashlib.sha1(sys.version + '\0' + source).hexdigest()
+
+def load_code( source, cacheDir=None ) :
+    '''the code object for source, from cacheDir if it was compiled and
+    kept there before, otherwise compiled (and kept, given a cacheDir)'''
+    key = source_key(source)
+    path = None
+    if cacheDir is not None :
+        path = os.path.join(cacheDir, key + CACHE_SUFFIX)
+        if os.path.exists(path) :
+            try:
+                with open(path, 'rb') as f :
+                    return marshal.load(f)
+            except (EOFError, ValueError, TypeError) :
+                pass    # compile it again
+    code = compile(source, '<minilang %s>' % key[:12], 'exec')
+    if path is not None :
+        if not os.path.isdir(cacheDir) :
+            os.makedirs(cacheDir)
+        # written then renamed, so a reader never sees half a file
+        temp = '%s.%d' % (path, os.getpid())
+        with open(temp, 'wb') as f :
+            marshal.dump(code, f)
+        os.rename(temp, path)
+    return code
+
+def transpile( program ) :
+    'translates program, returning the Transpiler holding its source'
+    return Transpiler(program)
+
+def run_program( program, cacheDir=None ) :
+    'runs program as Python, caching its code in cacheDir if given'
+    transpiler = transpile(program)
+    code = load_code(transpiler.source, cacheDir)
+    namespace = transpiler.namespace(program.funcTable)
+    exec code in namespace
+    depth = len(GLOBAL_FRAMES)
+    try:
+        namespace['_main'](program.nameTable)
+    except UnboundLocalError as e :
+        # a proc read a name before binding it
+        match = re.search(r"'v_(\w+)'", str(e))
+        if match is None :
+            raise
+        raise KeyError(match.group(1))
+    finally:
+        del GLOBAL_FRAMES[depth:]